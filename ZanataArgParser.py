@@ -9,27 +9,51 @@ https://gist.github.com/KurtJacobson/c87425ad8db411c73c6359933e5db9f9"""
 
 from __future__ import (absolute_import, division, print_function)
 
+import Queue  # pylint: disable=import-error
+import atexit
 import inspect
+import itertools
+import json
 import logging
 import os
 import re
+import shlex
 import sys
+import threading
+import time
 
 from argparse import ArgumentParser, ArgumentError, RawDescriptionHelpFormatter
+from argparse import SUPPRESS
 # Following are for mypy
 from argparse import Action  # noqa: F401 # pylint: disable=W0611
 from argparse import Namespace  # noqa: F401 # pylint: disable=W0611
 from argparse import _SubParsersAction  # noqa: F401 # pylint: disable=W0611
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+
+import ZanataTrace  # pylint: disable=E0401
 
 try:
     from typing import List, Any  # noqa: F401 # pylint: disable=W0611
     from typing import Dict  # noqa: F401 # pylint: disable=W0611
     from typing import Optional  # noqa: F401 # pylint: disable=W0611
     from typing import Tuple  # noqa: F401 # pylint: disable=W0611
+    from typing import Iterator  # noqa: F401 # pylint: disable=W0611
 except ImportError:
     sys.stderr.write("python typing module is not installed" + os.linesep)
 
 
+def _to_str(value):
+    # type (Any) -> Any
+    """Convert unicode loaded from JSON back to str"""
+    if isinstance(value, unicode):  # noqa: F821 # pylint: disable=E0602
+        return value.encode('utf-8')
+    return value
+
+
+BatchResult = namedtuple('BatchResult', ['command', 'status', 'elapsed'])
+
+
 class NoSuchMethodError(Exception):
     """Method does not exist
 
@@ -46,7 +70,11 @@ class NoSuchMethodError(Exception):
 
 class ColoredFormatter(logging.Formatter):
     """Log colored formated
-    Inspired from KurtJacobson's colored_log.py"""
+    Inspired from KurtJacobson's colored_log.py
+
+    Color escape sequences are resolved once per level at construction,
+    and records are not modified, so they can be shared with other
+    handlers."""
     # Background ASCII color
     bg = os.getenv("LOGGING_BG_COLOR", 40)  # Default black background
 
@@ -60,34 +88,46 @@ class ColoredFormatter(logging.Formatter):
     PREFIX = '\033['
     SUFFIX = '\033[0m'
 
-    def __init__(self, patern):
-        logging.Formatter.__init__(self, patern)
+    def __init__(self, patern, datefmt=None, use_color=None):
+        # type (str, str, bool) -> None
+        """New a ColoredFormatter
 
-    @staticmethod
-    def _color(colors, content):
-        if os.getenv("LOGGING_NO_COLOR", ""):
-            return ""
-        return "\033[%d;%dm%s\033[0m" % (colors[0], colors[1], content)
+        Args:
+            patern (str): format string
+            datefmt (str, optional): Defaults to None. Date format
+            use_color (bool, optional): Defaults to None, which means
+                    color unless env LOGGING_NO_COLOR is set.
+        """
+        logging.Formatter.__init__(self, patern, datefmt)
+        if use_color is None:
+            # Turn of color with env LOGGING_NO_COLOR=1
+            use_color = not os.getenv('LOGGING_NO_COLOR', '')
+        # level name: (prefix, suffix)
+        self.level_colors = {}  # type: Dict[str, Tuple[str, str]]
+        for level, colors in ColoredFormatter.COLOR_MAPPING.items():
+            self.level_colors[level] = (
+                    "%s%d;%dm" % (
+                            ColoredFormatter.PREFIX,
+                            int(colors[0]), int(colors[1])),
+                    ColoredFormatter.SUFFIX) if use_color else ('', '')
+        self.uses_time = self.usesTime()
 
     def format(self, record):
-        if not os.getenv('LOGGING_NO_COLOR', ''):
-            # Turn of color with env LOGGING_NO_COLOR=1
-            colors = ColoredFormatter.COLOR_MAPPING.get(
-                    record.levelname, ColoredFormatter.COLOR_MAPPING['DEBUG'])
-            record.levelname = ColoredFormatter._color(
-                    colors, record.levelname)
-            record.message = ColoredFormatter._color(
-                    colors, record.getMessage())
-            if self.usesTime():
-                record.asctime = ColoredFormatter._color(
-                        colors, self.formatTime(record, self.datefmt))
+        prefix, suffix = self.level_colors.get(
+                record.levelname, self.level_colors['DEBUG'])
+        values = dict(record.__dict__)
+        values['levelname'] = prefix + record.levelname + suffix
+        values['message'] = prefix + record.getMessage() + suffix
+        if self.uses_time:
+            values['asctime'] = prefix + self.formatTime(
+                    record, self.datefmt) + suffix
         try:
-            s = self._fmt % record.__dict__
+            s = self._fmt % values
         except UnicodeDecodeError as e:
             # Issue 25664. The logger name may be Unicode. Try again ...
             try:
-                record.name = record.name.decode('utf-8')
-                s = self._fmt % record.__dict__
+                values['name'] = record.name.decode('utf-8')
+                s = self._fmt % values
             except UnicodeDecodeError:
                 raise e
         if record.exc_info:
@@ -112,6 +152,145 @@ class ColoredFormatter(logging.Formatter):
         return s
 
 
+class JsonLinesFormatter(logging.Formatter):
+    """Format a record as a JSON object in one line, for machine ingestion
+    """
+
+    def format(self, record):
+        entry = {
+                'time': record.created,
+                'level': record.levelname,
+                'logger': record.name,
+                'thread': record.threadName,
+                'message': record.getMessage()}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class QueueHandler(logging.Handler):
+    """Put records in a queue, QueueListener formats and writes them
+    in another thread.
+
+    Unlike logging.handlers.QueueHandler in Python 3, formatting is not
+    done in the calling thread, only the message arguments are merged,
+    as they might be changed after logging."""
+
+    def __init__(self, queue):
+        # type (Queue.Queue) -> None
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                if not record.exc_text:
+                    record.exc_text = logging.Formatter().formatException(
+                            record.exc_info)
+                # Traceback holds frames, which should not outlive the call
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+
+class RingBufferHandler(logging.Handler):
+    """Keep the latest records in memory, without formatting them
+
+    Records are formatted and written only when dump() is called,
+    for example, when the program fails. Like QueueHandler, a copy of
+    each record is kept with message arguments merged and traceback
+    formatted, as arguments might be changed after logging and
+    tracebacks hold frames alive."""
+
+    FORMAT = '%(asctime)-15s [%(levelname)s] %(threadName)s %(message)s'
+
+    def __init__(self, capacity, dump_file):
+        # type (int, str) -> None
+        """New a RingBufferHandler
+
+        Args:
+            capacity (int): Maximum number of records to be kept
+            dump_file (str): File that dump() writes to
+        """
+        logging.Handler.__init__(self)
+        self.records = deque(maxlen=capacity)  # type: deque
+        self.dump_file = dump_file
+        self.setFormatter(logging.Formatter(RingBufferHandler.FORMAT))
+
+    def emit(self, record):
+        try:
+            kept = logging.makeLogRecord(record.__dict__)
+            kept.msg = record.getMessage()
+            kept.args = None
+            if record.exc_info:
+                if not kept.exc_text:
+                    kept.exc_text = self.formatter.formatException(
+                            record.exc_info)
+                kept.exc_info = None
+            self.records.append(kept)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def dump(self):
+        # type () -> str
+        """Write kept records to dump_file
+
+        Returns:
+            str: dump_file
+        """
+        self.acquire()
+        try:
+            records = list(self.records)
+        finally:
+            self.release()
+        with open(self.dump_file, 'w') as out_file:
+            for record in records:
+                out_file.write(self.format(record) + "\n")
+        return self.dump_file
+
+
+class QueueListener(object):
+    """Pass records from a queue to handlers in a background thread"""
+
+    _SENTINEL = None
+
+    def __init__(self, queue, *handlers):
+        # type (Queue.Queue, logging.Handler) -> None
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None  # type: threading.Thread
+
+    def start(self):
+        # type () -> None
+        """Start the background thread"""
+        self._thread = threading.Thread(
+                target=self._monitor, name='log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is QueueListener._SENTINEL:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        # type () -> None
+        """Write the remaining records then stop the background thread"""
+        if self._thread:
+            self.queue.put(QueueListener._SENTINEL)
+            self._thread.join()
+            self._thread = None
+
+
 class ZanataArgParser(ArgumentParser):
     """Zanata Argument Parser that support sub-commands and environment
 
@@ -130,8 +309,24 @@ class ZanataArgParser(ArgumentParser):
     master
     """
 
+    # Bump when the format of signature table changes
+    SIGNATURE_TABLE_VERSION = 1
+
+    BATCH_SUB_COMMAND = 'batch'
+
+    _console_handler = None  # type: logging.Handler
+    _ring_buffer_handler = None  # type: RingBufferHandler
+
     def __init__(self, *args, **kwargs):
         # type: (Any, Any) -> None
+        # Sub-parsers set the global options only when given after
+        # the sub-command, otherwise their defaults would override
+        # the values given before the sub-command
+        is_sub_parser = kwargs.pop('is_sub_parser', False)
+
+        def _default(value):
+            return SUPPRESS if is_sub_parser else value
+
         # Ignore mypy "ArgumentParser" gets multiple values for keyword
         # argument "formatter_class"
         # See https://github.com/python/mypy/issues/1028
@@ -140,13 +335,50 @@ class ZanataArgParser(ArgumentParser):
         self.env_def = {}  # type: Dict[str, dict]
         self.parent_parser = ArgumentParser(add_help=False)
         self.add_argument(
-                '-v', '--verbose', type=str, default='INFO',
+                '-v', '--verbose', type=str, default=_default('INFO'),
                 metavar='VERBOSE_LEVEL',
                 help='Valid values: %s'
                 % 'DEBUG, INFO, WARNING, ERROR, CRITICAL, NONE')
+        self.add_argument(
+                '--profile', type=str,
+                default=_default(os.getenv('ZANATA_PROFILE')),
+                choices=['cprofile', 'sample'],
+                help='Profile the sub-command. cprofile: cProfile stats, '
+                'sample: wall-clock sampling as collapsed stacks '
+                '(env ZANATA_PROFILE)')
+        self.add_argument(
+                '--profile-output', type=str,
+                default=_default(os.getenv('ZANATA_PROFILE_OUTPUT')),
+                help='Profile output file. Default: profile_stats.txt for '
+                'cprofile, profile_stacks.txt for sample '
+                '(env ZANATA_PROFILE_OUTPUT)')
+        self.add_argument(
+                '--profile-sort', type=str,
+                default=_default(
+                        os.getenv('ZANATA_PROFILE_SORT', 'cumulative')),
+                help='pstats sort key for cprofile. Default: cumulative '
+                '(env ZANATA_PROFILE_SORT)')
+        self.add_argument(
+                '--profile-interval', type=float,
+                default=_default(
+                        float(os.getenv('ZANATA_PROFILE_INTERVAL', 0.005))),
+                help='Seconds between samples. Default: 0.005 '
+                '(env ZANATA_PROFILE_INTERVAL)')
+        self.add_argument(
+                '--trace', type=str,
+                default=_default(os.getenv('ZANATA_TRACE')),
+                metavar='TRACE_FILE',
+                help='Write spans of the sub-command as Chrome trace '
+                'to TRACE_FILE at exit (env ZANATA_TRACE)')
+        self.profile_options = {}  # type: Dict[str, Any]
+        self.profiler = None  # type: Any
+        # Instances shared by sub-commands in batch mode
+        self.instance_cache = None  # type: Dict[str, Any]
 
         self.sub_parsers = None  # type: _SubParsersAction
         self.sub_command_obj_dict = {}  # type: Dict[str, Any]
+        # Sub-commands whose sub-parser are not built yet
+        self.lazy_sub_commands = OrderedDict()  # type: Dict[str, tuple]
 
     def add_common_argument(self, *args, **kwargs):
         # type:  (Any, Any) -> None
@@ -181,7 +413,7 @@ class ZanataArgParser(ArgumentParser):
             kwargs['parents'] = [self.parent_parser]
 
         anonymous_parser = self.sub_parsers.add_parser(
-                name, **kwargs)
+                name, is_sub_parser=True, **kwargs)
         if arguments:
             for arg in arguments:
                 k = arg[0]
@@ -218,15 +450,40 @@ class ZanataArgParser(ArgumentParser):
                 'dest': dest,
                 'sub_commands': sub_commands}
 
-    def add_methods_as_sub_commands(self, obj, name_pattern='.*'):
-        # type (Any, str) -> None
+    def add_methods_as_sub_commands(
+            self, obj, name_pattern='.*', lazy=False):
+        # type (Any, str, bool) -> None
         """Add public methods as sub-commands
 
         Args:
             cls ([type]): Public methods of obj will be used
             name_pattern (str, optional): Defaults to '.*'.
                     Method name should match the pattern.
+            lazy (bool, optional): Defaults to False.
+                    Only register the sub-command names, the sub-parser
+                    is built when the sub-command is selected.
+                    The method signatures are cached in a signature table,
+                    which is refreshed when the source file changes.
         """
+        if lazy:
+            table = self._load_signature_table(obj, name_pattern)
+        else:
+            table = ZanataArgParser._collect_signatures(obj, name_pattern)
+
+        for name, signature, doc in table:
+            if lazy:
+                self.lazy_sub_commands[name] = (obj, signature, doc)
+                self.sub_command_obj_dict[name] = obj
+            else:
+                self._add_signature_sub_command(name, obj, signature, doc)
+
+    @staticmethod
+    def _collect_signatures(obj, name_pattern):
+        # type (Any, str) -> List[list]
+        """Return [name, signature, doc] of public methods of obj
+
+        signature is a list of [arg_name, has_default, default]"""
+        result = []
         method_list = inspect.getmembers(obj)
         for m in method_list:
             if not re.match(name_pattern, m[0]):
@@ -248,32 +505,147 @@ class ZanataArgParser(ArgumentParser):
                 continue
 
             argspec = inspect.getargspec(m_obj)
-            sub_args = None
             try:
                 start_idx = len(argspec.args) - len(argspec.defaults)
             except TypeError:
                 start_idx = len(argspec.args) + 1
+            signature = []
             for idx, a in enumerate(argspec.args):
                 if a == 'self' or a == 'cls':
                     continue
                 if argspec.defaults and idx >= start_idx:
-                    arg_def = {
-                            'nargs': '?',
-                            'default': argspec.defaults[idx - start_idx]}
+                    signature.append(
+                            [a, True, argspec.defaults[idx - start_idx]])
                 else:
-                    arg_def = None
-                if sub_args:
-                    sub_args.append(tuple([a, arg_def]))
-                else:
-                    sub_args = [tuple([a, arg_def])]
+                    signature.append([a, False, None])
+            result.append([name, signature, m_obj.__doc__ or ''])
+        return result
+
+    def _add_signature_sub_command(self, name, obj, signature, doc):
+        # type (str, Any, List[list], str) -> None
+        """Add a sub-command from the method signature
+
+        Arguments without default are positional.
+        Arguments with bool default become flags like --keep-going,
+        and int or float default become options like --jobs N.
+        Other arguments with default are optional positional."""
+        sub_args = None
+        for a, has_default, default in signature:
+            if isinstance(default, bool):
+                arg_def = {
+                        'dest': a, 'default': default,
+                        'action': 'store_false' if default else 'store_true'}
+                a = '--' + a.replace('_', '-')
+            elif isinstance(default, (int, float)):
+                arg_def = {'dest': a, 'default': default,
+                           'type': type(default)}
+                a = '--' + a.replace('_', '-')
+            elif has_default:
+                arg_def = {'nargs': '?', 'default': default}
+            else:
+                arg_def = None
+            if sub_args:
+                sub_args.append(tuple([a, arg_def]))
+            else:
+                sub_args = [tuple([a, arg_def])]
 
-            self.add_sub_command(
-                    name,
-                    sub_args,
-                    obj,
-                    help=re.sub(
-                            "\n.*$", "", m_obj.__doc__, flags=re.MULTILINE),
-                    description=m_obj.__doc__)
+        self.add_sub_command(
+                name,
+                sub_args,
+                obj,
+                help=re.sub("\n.*$", "", doc, flags=re.MULTILINE),
+                description=doc)
+
+    def _build_lazy_sub_commands(self, args=None):
+        # type (List[str]) -> None
+        """Build the sub-parser of the selected lazy sub-command
+
+        All pending sub-parsers are built when no sub-command is
+        selected, so help and error messages are complete."""
+        if not self.lazy_sub_commands:
+            return
+        if args is None:
+            args = sys.argv[1:]
+        selected = [a for a in args if a in self.lazy_sub_commands][:1]
+        if not selected and self.sub_parsers and [
+                a for a in args if a in self.sub_parsers.choices]:
+            # A sub-command that is already built is selected
+            return
+        for name in selected if selected else list(self.lazy_sub_commands):
+            obj, signature, doc = self.lazy_sub_commands.pop(name)
+            self._add_signature_sub_command(name, obj, signature, doc)
+
+    @staticmethod
+    def _source_mtime(obj):
+        # type (Any) -> float
+        """Latest modification time of source files that define obj"""
+        cls = obj if inspect.isclass(obj) else type(obj)
+        mtime = 0.0
+        for c in inspect.getmro(cls):
+            src = getattr(sys.modules.get(c.__module__), '__file__', None)
+            if not src:
+                continue
+            if src.endswith(('.pyc', '.pyo')):
+                src = src[:-1]
+            try:
+                mtime = max(mtime, os.path.getmtime(src))
+            except OSError:
+                continue
+        return mtime
+
+    @staticmethod
+    def _signature_table_path(obj):
+        # type (Any) -> str
+        """Path of the signature table file for the module of obj"""
+        cache_home = os.getenv(
+                'XDG_CACHE_HOME',
+                os.path.join(os.path.expanduser('~'), '.cache'))
+        # Module of a script is __main__, so use the file name instead
+        src = getattr(sys.modules.get(obj.__module__), '__file__', None)
+        module_name = os.path.splitext(
+                os.path.basename(src))[0] if src else obj.__module__
+        return os.path.join(
+                cache_home, 'zanata-scripts',
+                "sub-commands-%s.json" % module_name)
+
+    def _load_signature_table(self, obj, name_pattern):
+        # type (Any, str) -> List[list]
+        """Load signature table from cache, or collect and save it
+        when the cache is missing or outdated"""
+        table_path = ZanataArgParser._signature_table_path(obj)
+        key = "%s:%s:%s" % (
+                ZanataArgParser.SIGNATURE_TABLE_VERSION,
+                getattr(obj, '__name__', type(obj).__name__), name_pattern)
+        mtime = ZanataArgParser._source_mtime(obj)
+        try:
+            with open(table_path, 'r') as in_file:
+                tables = json.load(in_file)
+        except (IOError, OSError, ValueError):
+            tables = {}
+
+        if key in tables and tables[key]['mtime'] == mtime:
+            return [[_to_str(name), [
+                    [_to_str(a), has_default, _to_str(default)]
+                    for a, has_default, default in signature],
+                    _to_str(doc)]
+                    for name, signature, doc in tables[key]['commands']]
+
+        table = ZanataArgParser._collect_signatures(obj, name_pattern)
+        tables[key] = {'mtime': mtime, 'commands': table}
+        tmp_path = "%s.%d.tmp" % (table_path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(table_path)):
+                os.makedirs(os.path.dirname(table_path))
+            with open(tmp_path, 'w') as out_file:
+                json.dump(tables, out_file)
+            os.rename(tmp_path, table_path)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            # Signature table is only a cache,
+            # e.g. default values might not be JSON serializable
+            logging.debug("Skip saving signature table %s: %s", table_path, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return table
 
     def has_common_argument(self, option_string=None, dest=None):
         # type: (str, str) -> bool
@@ -302,37 +674,145 @@ class ZanataArgParser(ArgumentParser):
         return env_name in self.env_def
 
     @staticmethod
-    def set_logger(verbose):
-        # type: (str) -> None
+    def set_logger(
+            verbose, log_format=None, async_logging=None,
+            ring_buffer_size=None):
+        # type: (str, str, bool, int) -> None
         """Handle logger
-        Inspired from KurtJacobson's colored_log.py"""
+        Inspired from KurtJacobson's colored_log.py
+
+        Args:
+            verbose (str): log level, or NONE
+            log_format (str, optional): Defaults to env LOGGING_FORMAT,
+                    or 'color'. 'color' for colored text (plain text if
+                    env LOGGING_NO_COLOR is set), 'json' for JSON lines.
+            async_logging (bool, optional): Defaults to env LOGGING_ASYNC.
+                    Format and write logs in a background thread.
+            ring_buffer_size (int, optional): Defaults to env
+                    LOGGING_RING_BUFFER_SIZE, or 0 to disable.
+                    Keep this many latest records of all levels in memory,
+                    they are written to env LOGGING_RING_BUFFER_FILE
+                    (Default: zanata-debug-<pid>.log) on failure.
+                    See dump_debug_log().
+        """
         # Root logger will be fine
         logger = logging.getLogger()
-        # Add console handler
-        s_handler = logging.StreamHandler()
-        s_handler.setLevel(logging.DEBUG)
-        c_formatter = ColoredFormatter(
-                '%(asctime)-15s [%(levelname)s] %(message)s')
-        s_handler.setFormatter(c_formatter)
-        logger.addHandler(s_handler)
+        # Add console handler, only once even if parsed multiple times
+        if not ZanataArgParser._console_handler:
+            if log_format is None:
+                log_format = os.getenv('LOGGING_FORMAT', 'color')
+            if async_logging is None:
+                async_logging = bool(os.getenv('LOGGING_ASYNC', ''))
+            if ring_buffer_size is None:
+                ring_buffer_size = int(
+                        os.getenv('LOGGING_RING_BUFFER_SIZE', '0'))
+            s_handler = logging.StreamHandler()
+            s_handler.setLevel(logging.DEBUG)
+            if log_format == 'json':
+                c_formatter = JsonLinesFormatter()
+            else:
+                c_formatter = ColoredFormatter(
+                        '%(asctime)-15s [%(levelname)s] %(message)s')
+            s_handler.setFormatter(c_formatter)
+            if async_logging:
+                log_queue = Queue.Queue()
+                listener = QueueListener(log_queue, s_handler)
+                listener.start()
+                atexit.register(listener.stop)
+                s_handler = QueueHandler(log_queue)
+            logger.addHandler(s_handler)
+            ZanataArgParser._console_handler = s_handler
+            if ring_buffer_size > 0:
+                ZanataArgParser._ring_buffer_handler = RingBufferHandler(
+                        ring_buffer_size,
+                        os.getenv(
+                                'LOGGING_RING_BUFFER_FILE',
+                                "zanata-debug-%d.log" % os.getpid()))
+                logger.addHandler(ZanataArgParser._ring_buffer_handler)
+                sys.excepthook = ZanataArgParser._dump_debug_log_excepthook(
+                        sys.excepthook)
+
         if verbose == 'NONE':
             # Not showing any log
-            logger.setLevel(logging.CRITICAL + 1)
+            level = logging.CRITICAL + 1
         elif hasattr(logging, verbose):
-            logger.setLevel(getattr(logging, verbose))
+            level = getattr(logging, verbose)
         else:
             ArgumentError(None, "Invalid verbose level: %s" % verbose)
+            return
+        if ZanataArgParser._ring_buffer_handler:
+            # Records of all levels are needed by ring buffer,
+            # so filter at console handler instead.
+            logger.setLevel(logging.DEBUG)
+            ZanataArgParser._console_handler.setLevel(level)
+        else:
+            logger.setLevel(level)
+
+    @staticmethod
+    def dump_debug_log():
+        # type () -> str
+        """Write the in-memory debug records to file,
+        if ring buffer is enabled in set_logger()
+
+        Returns:
+            str: file written, or None if ring buffer is not enabled
+        """
+        if not ZanataArgParser._ring_buffer_handler:
+            return None
+        dump_file = ZanataArgParser._ring_buffer_handler.dump()
+        logging.error("Debug log is written to %s", dump_file)
+        return dump_file
+
+    @staticmethod
+    def _dump_debug_log_excepthook(orig_excepthook):
+        def excepthook(exc_type, exc_value, exc_traceback):
+            """Dump debug log on uncaught exception"""
+            ZanataArgParser.dump_debug_log()
+            orig_excepthook(exc_type, exc_value, exc_traceback)
+        return excepthook
 
     def parse_args(self, args=None, namespace=None):
         # type: (Any, Any) -> Namespace
         """Parse arguments"""
+        self._build_lazy_sub_commands(args)
         result = super(ZanataArgParser, self).parse_args(args, namespace)
         ZanataArgParser.set_logger(result.verbose)
 
         # We do not need verbose for the caller
         delattr(result, 'verbose')
+
+        # Profile options are consumed by profiling()
+        for k in ['profile', 'profile_output', 'profile_sort',
+                  'profile_interval']:
+            self.profile_options[k] = getattr(result, k)
+            delattr(result, k)
+
+        if result.trace:
+            ZanataTrace.start(result.trace)
+        delattr(result, 'trace')
         return result
 
+    @contextmanager
+    def profiling(self):
+        """Context manager that profiles the enclosed block
+        when --profile is given
+
+        Nested profiling() does nothing, so a batch is profiled as whole."""
+        if not self.profile_options.get('profile') or self.profiler:
+            yield None
+            return
+        from ZanataProfiler import Profiler  # pylint: disable=E0401
+        try:
+            with Profiler(
+                    self.profile_options['profile'],
+                    self.profile_options['profile_output'],
+                    self.profile_options['profile_sort'],
+                    self.profile_options['profile_interval']) as profiler:
+                self.profiler = profiler
+                yield profiler
+        finally:
+            self.profiler = None
+
     @staticmethod
     def _is_env_valid(env_name, env_value, env_data, args):
         # type (str, str, dict, argparse.Namespace) -> bool
@@ -384,9 +864,123 @@ class ZanataArgParser(ArgumentParser):
             setattr(result, k, v)
         return result
 
+    def add_batch_sub_command(self):
+        # type () -> None
+        """Add the 'batch' sub-command that runs many sub-commands
+        in one process, see run_batch()"""
+        self.add_sub_command(
+                ZanataArgParser.BATCH_SUB_COMMAND,
+                [
+                        ('script', {
+                                'type': str, 'nargs': '?', 'default': '-',
+                                'help': 'File of sub-command lines or '
+                                        'JSON list, - for stdin'}),
+                        ('--stop-on-error', {
+                                'action': 'store_true',
+                                'help': 'Stop at the first failed command'})],
+                help='Run sub-commands from a script or stdin',
+                description=self.run_batch.__doc__)
+
+    @staticmethod
+    def _read_batch_commands(stream):
+        # type (Any) -> Iterator[List[str]]
+        """Yield argument lists from stream
+
+        stream is either a JSON list, whose items are command strings or
+        argument lists; or lines of commands, where '#' starts a comment.
+        """
+        first_line = ''
+        for first_line in stream:
+            if first_line.strip():
+                break
+        if first_line.lstrip().startswith('['):
+            for cmd in json.loads(first_line + stream.read()):
+                if isinstance(cmd, list):
+                    yield [_to_str(a) for a in cmd]
+                else:
+                    yield shlex.split(_to_str(cmd))
+            return
+        for line in itertools.chain([first_line], stream):
+            argv = shlex.split(line, comments=True)
+            if argv:
+                yield argv
+
+    def run_batch(self, script='-', stop_on_error=False):
+        # type (str, bool) -> List[BatchResult]
+        """Run sub-commands sequentially in this process
+
+        Each command is parsed and run as if it were given in command line.
+        Instances created by init_from_parsed_args are shared among
+        commands with same arguments.
+        Exit status and time of each command are reported at the end.
+
+        Args:
+            script (str, optional): Defaults to '-'.
+                    File that contains a sub-command per line,
+                    or a JSON list of sub-commands. '-' for stdin
+            stop_on_error (bool, optional): Defaults to False.
+                    Stop at the first failed command
+
+        Returns:
+            List[BatchResult]: result of each executed command
+        """
+        results = []
+        self.instance_cache = {}
+        in_file = sys.stdin if script == '-' else open(script, 'r')
+        try:
+            for argv in ZanataArgParser._read_batch_commands(in_file):
+                command = ' '.join(argv)
+                logging.info("Batch command: %s", command)
+                start = time.time()
+                status = 0
+                try:
+                    args = self.parse_all(argv)
+                    if args.sub_command == ZanataArgParser.BATCH_SUB_COMMAND:
+                        raise ArgumentError(
+                                None, "Nested batch is not allowed")
+                    self.run_sub_command(args)
+                except SystemExit as e:
+                    # argparse exits on invalid arguments
+                    status = e.code if isinstance(e.code, int) else 1
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Batch command failed: %s", command)
+                    status = 1
+                results.append(
+                        BatchResult(command, status, time.time() - start))
+                if status and stop_on_error:
+                    break
+        finally:
+            if in_file is not sys.stdin:
+                in_file.close()
+            self.instance_cache = None
+
+        for r in results:
+            logging.info(
+                    "%-6s %8.3fs %s",
+                    'OK' if r.status == 0 else "E(%d)" % r.status,
+                    r.elapsed, r.command)
+        return results
+
+    def _get_instance(self, cls, args, method_args):
+        # type (type, Namespace, List[str]) -> Any
+        """New an instance with init_from_parsed_args,
+        or reuse the one with same arguments in batch mode"""
+        if self.instance_cache is None:
+            return getattr(cls, 'init_from_parsed_args')(args)
+        key = repr((cls, sorted(
+                (k, v) for k, v in vars(args).items()
+                if k != 'sub_command' and k not in method_args)))
+        if key not in self.instance_cache:
+            self.instance_cache[key] = getattr(
+                    cls, 'init_from_parsed_args')(args)
+        return self.instance_cache[key]
+
     def run_sub_command(self, args=None):
         """Run the sub ccommand with parsed arguments
 
+        Debug log is dumped when the sub-command exits with non-zero,
+        see dump_debug_log().
+
         Args:
             instance ([type]): [description]
             args ([type], optional): Defaults to None. Arguments
@@ -394,30 +988,49 @@ class ZanataArgParser(ArgumentParser):
         Raises:
             ArgumentError: When sub_command is missing
         """
+        try:
+            with ZanataTrace.span("%s %s" % (
+                    os.path.basename(self.prog), args.sub_command)):
+                return self._run_sub_command(args)
+        except SystemExit as e:
+            if e.code:
+                ZanataArgParser.dump_debug_log()
+            raise
+
+    def _run_sub_command(self, args):
+        # type (Namespace) -> Any
         if not args.sub_command:
             raise ArgumentError(args, "Missing sub-command")
 
+        if args.sub_command == ZanataArgParser.BATCH_SUB_COMMAND:
+            with self.profiling():
+                results = self.run_batch(args.script, args.stop_on_error)
+            if [r for r in results if r.status]:
+                sys.exit(1)
+            return results
+
         if args.sub_command not in self.sub_command_obj_dict:
             raise ArgumentError(
                     args,
                     "sub-command %s is not associated with any object" %
                     args.sub_command)
         obj = self.sub_command_obj_dict[args.sub_command]
+        argspec = inspect.getargspec(getattr(obj, args.sub_command))
         if inspect.isclass(obj):
             cls = obj
             if not hasattr(cls, 'init_from_parsed_args'):
                 raise NoSuchMethodError('init_from_parsed_args')
             # New an object accordingto args
-            obj = getattr(cls, 'init_from_parsed_args')(args)
+            obj = self._get_instance(cls, args, argspec.args)
 
         sub_cmd_obj = getattr(obj, args.sub_command)
-        argspec = inspect.getargspec(sub_cmd_obj)
         arg_values = []
         for a in argspec.args:
             if a == 'self' or a == 'cls':
                 continue
             arg_values.append(getattr(args, a))
-        return sub_cmd_obj(*arg_values)
+        with self.profiling():
+            return sub_cmd_obj(*arg_values)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""ZanataDocker -- Docker Engine API client
+
+ZanataDocker talks to the Docker daemon with HTTP over its Unix socket,
+so each operation is a request on a persistent connection instead of
+a docker CLI process.
+
+Socket path is taken from env DOCKER_HOST (unix:// only), otherwise
+/var/run/docker.sock.
+"""
+from __future__ import absolute_import, division, print_function
+
+import httplib
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import urllib
+
+from multiprocessing.pool import ThreadPool
+from ZanataTrace import bind  # pylint: disable=E0401
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+    from typing import Dict, Tuple  # noqa: F401 # pylint: disable=W0611
+    from typing import Iterator  # noqa: F401 # pylint: disable=W0611
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+DEFAULT_SOCKET_PATH = '/var/run/docker.sock'
+API_VERSION = 'v1.24'
+
+# Header of multiplexed stdout/stderr frames of container logs
+LOG_FRAME_HEADER = struct.Struct('>BxxxI')
+LOG_STREAMS = {0: 'stdin', 1: 'stdout', 2: 'stderr'}
+
+
+def default_socket_path():
+    # type () -> str
+    """Socket path from env DOCKER_HOST, or DEFAULT_SOCKET_PATH"""
+    docker_host = os.getenv('DOCKER_HOST', '')
+    if docker_host.startswith('unix://'):
+        return docker_host[len('unix://'):]
+    return DEFAULT_SOCKET_PATH
+
+
+class DockerError(Exception):
+    """Error response from Docker daemon"""
+
+    def __init__(self, status, msg):
+        super(DockerError, self).__init__(status, msg)
+        self.status = status
+        self.msg = msg
+
+    def __str__(self):
+        return "Docker API error %d: %s" % (self.status, self.msg)
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """HTTP connection over a Unix socket"""
+
+    def __init__(self, socket_path, timeout=None):
+        # type (str, float) -> None
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = socket_path
+        self.socket_timeout = timeout
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.socket_timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DockerClient(object):
+    """Minimal Docker Engine API client
+
+    Each thread keeps its own persistent connection.
+    """
+
+    def __init__(self, socket_path=None, api_version=API_VERSION):
+        # type (str, str) -> None
+        """
+        Args:
+            socket_path (str, optional): Defaults to default_socket_path().
+            api_version (str, optional): Defaults to API_VERSION.
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.api_version = api_version
+        self._local = threading.local()
+
+    def _connection(self):
+        # type () -> UnixHTTPConnection
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = UnixHTTPConnection(self.socket_path)
+            self._local.conn = conn
+        return conn
+
+    def _url(self, path, params=None):
+        # type (str, dict) -> str
+        url = "/%s%s" % (self.api_version, path)
+        if params:
+            url += '?' + urllib.urlencode(sorted(params.items()))
+        return url
+
+    def _send(self, conn, method, url, body):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        conn.request(method, url, body, headers)
+        return conn.getresponse()
+
+    def request(self, method, path, body=None, params=None):
+        # type (str, str, Any, dict) -> Tuple[int, Any]
+        """Send request on the persistent connection
+
+        The request is retried once on a new connection if the
+        persistent connection was closed by the daemon.
+
+        Args:
+            method (str): HTTP method
+            path (str): API path like '/volumes/name'
+            body (Any, optional): Defaults to None. JSON body
+            params (dict, optional): Defaults to None. Query parameters
+
+        Raises:
+            DockerError: status is 400 or above
+
+        Returns:
+            Tuple[int, Any]: status, and decoded JSON body or None
+        """
+        url = self._url(path, params)
+        logging.debug("Docker API %s %s", method, url)
+        conn = self._connection()
+        try:
+            response = self._send(conn, method, url, body)
+        except (httplib.BadStatusLine, httplib.CannotSendRequest,
+                socket.error):
+            conn.close()
+            response = self._send(conn, method, url, body)
+        data = response.read()
+        if response.status >= 400:
+            try:
+                msg = json.loads(data)['message']
+            except (ValueError, KeyError, TypeError):
+                msg = data
+            raise DockerError(response.status, msg)
+        if data and response.getheader(
+                'Content-Type', '').startswith('application/json'):
+            return response.status, json.loads(data)
+        return response.status, None
+
+    def _inspect(self, path):
+        # type (str) -> dict
+        try:
+            return self.request('GET', path)[1]
+        except DockerError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def volume_inspect(self, name):
+        # type (str) -> dict
+        """Return volume information, or None if it does not exist"""
+        return self._inspect("/volumes/%s" % urllib.quote(name))
+
+    def volume_create(self, name):
+        # type (str) -> dict
+        """Create volume"""
+        return self.request('POST', '/volumes/create', {'Name': name})[1]
+
+    def ensure_volume(self, name):
+        # type (str) -> dict
+        """Create volume if it does not exist"""
+        return self.volume_inspect(name) or self.volume_create(name)
+
+    def image_inspect(self, name):
+        # type (str) -> dict
+        """Return image information, or None if it is not pulled"""
+        return self._inspect("/images/%s/json" % urllib.quote(name, ':/@'))
+
+    def image_pull(self, name):
+        # type (str) -> None
+        """Pull image, name is like 'repo:tag' or 'repo@digest'
+
+        Raises:
+            DockerError: pull failed
+        """
+        if '@' in name:
+            repo, tag = name.split('@', 1)
+        else:
+            repo, _, tag = name.rpartition(':')
+            if not repo or '/' in tag:
+                repo, tag = name, 'latest'
+        logging.info("Pulling image %s", name)
+        status, _ = self.request(
+                'POST', '/images/create',
+                params={'fromImage': repo, 'tag': tag})
+        # Errors during pull are reported in the progress stream
+        # which request() has read, so check the image is there
+        if not self.image_inspect(name):
+            raise DockerError(status, "Failed to pull %s" % name)
+
+    def image_list(self):
+        # type () -> List[dict]
+        """Return information of all local images"""
+        return self.request('GET', '/images/json')[1] or []
+
+    def image_remove(self, name, force=False):
+        # type (str, bool) -> None
+        """Remove image"""
+        self.request(
+                'DELETE', "/images/%s" % urllib.quote(name, ':/@'),
+                params={'force': int(force)})
+
+    def container_create(self, image, cmd=None, name=None, binds=None):
+        # type (str, List[str], str, List[str]) -> str
+        """Create container, return its ID
+
+        Args:
+            image (str): image name
+            cmd (List[str], optional): Defaults to None. Arguments after
+                    image, like those of 'docker run'
+            name (str, optional): Defaults to None. container name
+            binds (List[str], optional): Defaults to None.
+                    Volumes, like ['volume:/repo:Z']
+        """
+        body = {
+                'Image': image, 'Cmd': cmd, 'Tty': False,
+                'AttachStdout': True, 'AttachStderr': True,
+                'HostConfig': {'Binds': binds or []}}
+        params = {'name': name} if name else None
+        return self.request('POST', '/containers/create', body, params)[1][
+                'Id']
+
+    def container_start(self, container):
+        # type (str) -> None
+        """Start container"""
+        self.request('POST', "/containers/%s/start" % container)
+
+    def container_wait(self, container):
+        # type (str) -> int
+        """Wait until the container stops, return its exit status"""
+        return self.request('POST', "/containers/%s/wait" % container)[1][
+                'StatusCode']
+
+    def container_stop(self, container, timeout=10):
+        # type (str, int) -> bool
+        """Stop container, return False if it does not exist"""
+        try:
+            self.request(
+                    'POST', "/containers/%s/stop" % container,
+                    params={'t': timeout})
+        except DockerError as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+
+    def container_remove(self, container, force=False):
+        # type (str, bool) -> None
+        """Remove container"""
+        self.request(
+                'DELETE', "/containers/%s" % container,
+                params={'force': int(force), 'v': 0})
+
+    def container_logs(self, container, follow=True):
+        # type (str, bool) -> Iterator[Tuple[str, str]]
+        """Yield (stream, line) of container output
+
+        Logs are read on a separate connection, as following logs
+        blocks until the container stops.
+        """
+        conn = UnixHTTPConnection(self.socket_path)
+        try:
+            response = self._send(conn, 'GET', self._url(
+                    "/containers/%s/logs" % container,
+                    {'follow': int(follow), 'stdout': 1, 'stderr': 1}), None)
+            if response.status >= 400:
+                raise DockerError(response.status, response.read())
+            pending = {}
+            while True:
+                header = response.read(LOG_FRAME_HEADER.size)
+                if len(header) < LOG_FRAME_HEADER.size:
+                    break
+                stream_type, size = LOG_FRAME_HEADER.unpack(header)
+                stream = LOG_STREAMS.get(stream_type, 'stdout')
+                lines = (pending.pop(stream, b'') +
+                         response.read(size)).split(b'\n')
+                pending[stream] = lines.pop()
+                for line in lines:
+                    yield stream, line
+            for stream, line in sorted(pending.items()):
+                if line:
+                    yield stream, line
+        finally:
+            conn.close()
+
+    def run(self, image, cmd=None, name=None, binds=None, log_line=None):
+        # type (str, List[str], str, List[str], Any) -> int
+        """Run container like 'docker run --rm', return exit status
+
+        Args:
+            image (str): image name
+            cmd (List[str], optional): Defaults to None.
+            name (str, optional): Defaults to None. container name
+            binds (List[str], optional): Defaults to None.
+            log_line (callable, optional): Defaults to writing to
+                    sys.stdout or sys.stderr. Called with (stream, line)
+        """
+        if log_line is None:
+            def log_line(stream, line):
+                out = sys.stderr if stream == 'stderr' else sys.stdout
+                out.write(line + '\n')
+                out.flush()
+        try:
+            container = self.container_create(image, cmd, name, binds)
+        except DockerError as e:
+            if e.status != 404:
+                raise
+            self.image_pull(image)
+            container = self.container_create(image, cmd, name, binds)
+        try:
+            self.container_start(container)
+            for stream, line in self.container_logs(container):
+                log_line(stream, line)
+            return self.container_wait(container)
+        finally:
+            try:
+                self.container_remove(container, force=True)
+            except (DockerError, socket.error) as e:
+                logging.warning("Failed to remove container %s: %s", name, e)
+
+
+class ImagePool(object):
+    """Images pulled ahead of use and pinned by ID for the whole run
+
+    prefetch() pulls missing images concurrently in background,
+    so builds do not stall on a pull. pin() returns the image ID,
+    so every container of the run uses the same image even if the tag
+    is moved meanwhile.
+    """
+    DEFAULT_BUDGET_MB = 4096
+
+    def __init__(self, client=None, jobs=4):
+        # type (DockerClient, int) -> None
+        """
+        Args:
+            client (DockerClient, optional): Defaults to DockerClient().
+            jobs (int, optional): Defaults to 4. Number of concurrent pulls
+        """
+        self.client = client or DockerClient()
+        self.jobs = jobs
+        self._pool = None  # type: ThreadPool
+        self._results = {}  # type: Dict[str, Any]
+        self._lock = threading.Lock()
+
+    def _fetch(self, name):
+        # type (str) -> dict
+        image = self.client.image_inspect(name)
+        if not image:
+            self.client.image_pull(name)
+            image = self.client.image_inspect(name)
+        logging.info("Image %s is pinned to %s", name, image['Id'])
+        return image
+
+    def prefetch(self, names):
+        # type (List[str]) -> None
+        """Start pulling images that are not prefetched yet"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.jobs)
+            for name in names:
+                if name not in self._results:
+                    self._results[name] = self._pool.apply_async(
+                            bind(self._fetch), (name,))
+
+    def inspect(self, name):
+        # type (str) -> dict
+        """Wait for the image to be fetched, return its information
+
+        Raises:
+            DockerError: pull failed
+        """
+        self.prefetch([name])
+        return self._results[name].get()
+
+    def pin(self, name):
+        # type (str) -> str
+        """Image ID of name for this run"""
+        return str(self.inspect(name)['Id'])
+
+    def digest(self, name):
+        # type (str) -> str
+        """Repository digest of name like 'repo@sha256:...',
+        or the image ID if the image has no repository digest"""
+        image = self.inspect(name)
+        return str((image.get('RepoDigests') or [image['Id']])[0])
+
+    def close(self):
+        # type () -> None
+        """Stop the pull threads"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+    def gc(self, repository, budget_mb=None):
+        # type (str, float) -> List[str]
+        """Remove the oldest unpinned images of repository
+        until their total size is within budget_mb
+
+        Args:
+            repository (str): like 'docker.io/zanata/centos-repo-builder'
+            budget_mb (float, optional): Defaults to env
+                    ZANATA_IMAGE_BUDGET_MB or DEFAULT_BUDGET_MB
+
+        Returns:
+            List[str]: IDs of removed images
+        """
+        budget = 1024 * 1024 * float(budget_mb or os.getenv(
+                'ZANATA_IMAGE_BUDGET_MB', ImagePool.DEFAULT_BUDGET_MB))
+        short_repo = repository.split('/', 1)[1] if repository.startswith(
+                'docker.io/') else repository
+        pinned = set()
+        for result in self._results.values():
+            if result.ready() and result.successful():
+                pinned.add(result.get()['Id'])
+
+        def _in_repo(image):
+            for ref in ((image.get('RepoTags') or []) +
+                        (image.get('RepoDigests') or [])):
+                if '@' in ref:
+                    ref_repo = ref.split('@', 1)[0]
+                else:
+                    ref_repo = ref.rsplit(':', 1)[0]
+                if ref_repo in (repository, short_repo):
+                    return True
+            return False
+
+        images = sorted(
+                [i for i in self.client.image_list() if _in_repo(i)],
+                key=lambda i: i.get('Created', 0))
+        total = sum(i.get('Size', 0) for i in images)
+        removed = []
+        for image in images:
+            if total <= budget:
+                break
+            if image['Id'] in pinned:
+                continue
+            try:
+                self.client.image_remove(image['Id'], force=True)
+            except DockerError as e:
+                logging.warning(
+                        "Failed to remove image %s: %s", image['Id'], e)
+                continue
+            logging.info("Removed image %s", image['Id'])
+            total -= image.get('Size', 0)
+            removed.append(image['Id'])
+        return removed
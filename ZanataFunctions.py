@@ -3,22 +3,31 @@
 
 from __future__ import (absolute_import, division, print_function)
 
+import base64
 import codecs
 import errno
+import hashlib
+import httplib  # noqa: F401 # pylint: disable=import-error
 import logging
 import os
 import re
 import subprocess  # nosec
 import sys
+import threading
 import urllib2  # noqa: F401 # pylint: disable=import-error
 import urlparse  # noqa: F401 # pylint: disable=import-error
 
+from collections import namedtuple
 from contextlib import contextmanager
 from distutils.version import LooseVersion
+from multiprocessing.pool import ThreadPool
 from ZanataArgParser import ZanataArgParser  # pylint: disable=import-error
+from ZanataTimings import timed  # pylint: disable=import-error
+from ZanataTrace import bind, span, trace_env  # pylint: disable=import-error
 
 try:
     from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+    from typing import Dict  # noqa: F401 # pylint: disable=unused-import
 except ImportError:
     sys.stderr.write("python typing module is not installed" + os.linesep)
 
@@ -77,6 +86,7 @@ def exec_call(cmd_list, **kwargs):
         int: exit status of command.
     """
     logging.debug("Running command: %s", " ".join(cmd_list))
+    kwargs['env'] = trace_env(kwargs.get('env'))
     return subprocess.call(cmd_list, **kwargs)  # nosec
 
 
@@ -101,6 +111,7 @@ def exec_check_call(cmd_list, **kwargs):
         CalledProcessError: When command exit status is not 0
     """
     logging.debug("Running command: %s", " ".join(cmd_list))
+    kwargs['env'] = trace_env(kwargs.get('env'))
     try:
         return subprocess.check_call(cmd_list, **kwargs)  # nosec
     except subprocess.CalledProcessError as e:
@@ -129,12 +140,52 @@ def exec_check_output(cmd_list, **kwargs):
         CalledProcessError: When command exit status is not 0
     """
     logging.debug("Running command: %s", " ".join(cmd_list))
+    kwargs['env'] = trace_env(kwargs.get('env'))
     try:
         return subprocess.check_output(cmd_list, **kwargs).rstrip()  # nosec
     except subprocess.CalledProcessError as e:
         raise e
 
 
+def exec_check_call_prefixed(cmd_list, prefix, **kwargs):
+    # type (List[str], str, Any) -> int
+    """Run command, log its output lines with prefix, and check exit status
+
+    This is useful when several commands run concurrently,
+    as their outputs would otherwise be interleaved.
+
+    Args:
+        cmd_list (List[str]): Command and arguments to be run.
+        prefix (str): Prefix of each output line, like 'el7'
+        **kwargs: subprocess.Popen() keyword arguments
+
+    Returns:
+        int: exit status of command.
+
+    Raises:
+        CalledProcessError: When command exit status is not 0
+    """
+    logging.debug("[%s] Running command: %s", prefix, " ".join(cmd_list))
+    kwargs['env'] = trace_env(kwargs.get('env'))
+    proc = subprocess.Popen(  # nosec
+            cmd_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            **kwargs)
+    for line in iter(proc.stdout.readline, b''):
+        logging.info("[%s] %s", prefix, line.rstrip())
+    proc.stdout.close()
+    status = proc.wait()
+    if status:
+        raise subprocess.CalledProcessError(status, cmd_list)
+    return status
+
+
+class PrefixLoggerAdapter(logging.LoggerAdapter):
+    """Logger adapter that prefixes messages with extra['prefix']"""
+
+    def process(self, msg, kwargs):
+        return "[%s] %s" % (self.extra['prefix'], msg), kwargs
+
+
 class CLIException(Exception):
     """Exception from command line"""
 
@@ -259,7 +310,88 @@ class GitHelper(object):
 
 
 class HTTPBasicAuthHandler(urllib2.HTTPBasicAuthHandler):
-    """Handle Basic Authentication"""
+    """Handle Basic Authentication
+
+    By default, credentials are sent only after a 401 or 403 challenge.
+    With preemptive=True, the Authorization header is attached to the
+    first request of URIs under a registered uri, which saves a round-trip.
+
+    Authorization headers are cached per scheme and registered base URI,
+    the cache is shared among all instances. A cached header is only
+    reused for URIs under the same base with the same scheme."""
+
+    # (scheme, (authority, path) of registered uri): header value
+    _auth_header_cache = {}  # type: Dict[tuple, str]
+    _auth_header_lock = threading.Lock()
+
+    def __init__(self, password_mgr=None, preemptive=False):
+        # type (urllib2.HTTPPasswordMgr, bool) -> None
+        urllib2.HTTPBasicAuthHandler.__init__(self, password_mgr)
+        self.preemptive = preemptive
+
+    @classmethod
+    def clear_auth_cache(cls):
+        # type () -> None
+        """Forget all cached Authorization headers"""
+        with cls._auth_header_lock:
+            cls._auth_header_cache.clear()
+
+    def get_auth_header(self, uri):
+        # type (str) -> str
+        """Return the Authorization header value for uri
+
+        Registered credentials are used first, then the header cached
+        for a registered base URI that uri is under, with the same scheme.
+
+        Args:
+            uri (str): URI to be requested
+
+        Returns:
+            str: Authorization header value, or None if nothing found
+        """
+        scheme = urlparse.urlsplit(uri).scheme
+        user, passwd = self.passwd.find_user_password(None, uri)
+        with HTTPBasicAuthHandler._auth_header_lock:
+            if user is None:
+                for (cached_scheme, base), auth in (
+                        HTTPBasicAuthHandler._auth_header_cache.items()):
+                    if cached_scheme == scheme and self._is_under(base, uri):
+                        return auth
+                return None
+            base = self._registered_base(uri)
+            auth = "Basic %s" % base64.b64encode(
+                    "%s:%s" % (user, passwd or ''))
+            HTTPBasicAuthHandler._auth_header_cache[(scheme, base)] = auth
+            return auth
+
+    def _is_under(self, base, uri):
+        # type (tuple, str) -> bool
+        """Whether uri is under base, which is a reduced registered uri"""
+        return any(
+                self.passwd.is_suburi(
+                        base, self.passwd.reduce_uri(uri, default_port))
+                for default_port in (True, False))
+
+    def _registered_base(self, uri):
+        # type (str) -> tuple
+        """Reduced registered uri that uri is under, like
+        find_user_password() looks it up"""
+        for uris in self.passwd.passwd.get(None, {}):
+            for base in uris:
+                if self._is_under(base, uri):
+                    return base
+        return None
+
+    def http_request(self, req):
+        """Attach the Authorization header before sending in preemptive
+        mode"""
+        if self.preemptive and not req.has_header(self.auth_header):
+            auth = self.get_auth_header(req.get_full_url())
+            if auth:
+                req.add_unredirected_header(self.auth_header, auth)
+        return req
+
+    https_request = http_request
 
     def http_error_401(  # pylint: disable=too-many-arguments,unused-argument
             self, req, fp, code, msg, headers):
@@ -287,6 +419,10 @@ class SshHost(object):
             '--update', '--compress', '--exclude', '*.core', '--stats',
             '--progress', '--archive', '--keep-dirlinks']
 
+    # Share SSH connections for this long after the last use, e.g. '10m'.
+    # Empty to disable.
+    CONTROL_PERSIST = os.getenv('ZANATA_SSH_CONTROL_PERSIST', '')
+
     def __init__(self, host, ssh_user=None, identity_file=None):
         # type (str, str, str) -> None
         self.host = host
@@ -296,6 +432,11 @@ class SshHost(object):
             self.opt_list = ['-i', identity_file]
         else:
             self.opt_list = []
+        if SshHost.CONTROL_PERSIST:
+            self.opt_list += [
+                    '-o', 'ControlMaster=auto',
+                    '-o', 'ControlPath=~/.ssh/zanata-%r@%h:%p',
+                    '-o', 'ControlPersist=' + SshHost.CONTROL_PERSIST]
 
         # Produce [user@]hostname
         self.user_host = "%s%s" % (
@@ -348,7 +489,8 @@ class SshHost(object):
         Returns:
             int: command exit status
         """
-        return exec_check_call(self._obtain_cmd_list(command, sudo))
+        with timed('ssh', self.host):
+            return exec_check_call(self._obtain_cmd_list(command, sudo))
 
     def run_check_output(self, command, sudo=False):
         # type (str, bool) -> str
@@ -361,7 +503,8 @@ class SshHost(object):
         Returns:
             str: stdout of command
         """
-        return exec_check_output(self._obtain_cmd_list(command, sudo))
+        with timed('ssh', self.host):
+            return exec_check_output(self._obtain_cmd_list(command, sudo))
 
     def run_chown(self, user, group, filename, options=None):
         # type (str, str, str, List[str]) -> int
@@ -394,7 +537,8 @@ class SshHost(object):
         cmd_list = ["/usr/bin/scp", "-p"] + self.opt_list + [
                 source_path,
                 "%s:%s" % (self.user_host, dest_path)]
-        exec_check_call(cmd_list)
+        with span("scp %s" % self.host):
+            exec_check_call(cmd_list)
 
     def rsync(self, src, dest, options=None):
         # type (str, str, List[Str]) -> None
@@ -407,40 +551,171 @@ class SshHost(object):
                     List of rsync options.
         """
         cmd_prefix = [SshHost.RSYNC_CMD] + SshHost.RSYNC_OPTIONS
-        if self.ssh_user:
-            ssh_cmd = "ssh -l {} {} {}".format(
-                    self.ssh_user,
-                    "" if not self.identity_file else "-i",
-                    "" if not self.identity_file else self.identity_file)
+        if self.ssh_user or SshHost.CONTROL_PERSIST:
+            ssh_cmd = " ".join(
+                    ['ssh'] +
+                    (['-l', self.ssh_user] if self.ssh_user else []) +
+                    self.opt_list)
             cmd_prefix += ["-e", ssh_cmd]
 
         if options:
             cmd_prefix += options
-        exec_check_call(cmd_prefix + [src, dest])
+        with timed('rsync', self.host):
+            exec_check_call(cmd_prefix + [src, dest])
+
+
+UploadResult = namedtuple(
+        'UploadResult', ['url', 'status', 'size', 'checksum', 'body'])
 
 
 class UrlHelper(object):
     """URL helper functions"""
 
-    def __init__(self, base_url, user, token):
-        """install the authentication handler."""
+    UPLOAD_CHUNK_SIZE = 128 * 1024  # 128 KiB
+
+    def __init__(self, base_url, user, token, preemptive_auth=False):
+        """install the authentication handler.
+
+        Args:
+            base_url (str): credentials are used for URLs under base_url
+            user (str): user name
+            token (str): password or API token
+            preemptive_auth (bool, optional): Defaults to False.
+                    Send credentials with the first request instead of
+                    waiting for a 401 or 403 challenge.
+        """
         self.base_url = base_url
-        auth_handler = HTTPBasicAuthHandler()
-        auth_handler.add_password(
-                realm=None,
-                uri=self.base_url,
-                user=user,
-                passwd=token)
-        opener = urllib2.build_opener(auth_handler)
+        self.auth_handler = HTTPBasicAuthHandler(preemptive=preemptive_auth)
+        if user:
+            self.auth_handler.add_password(
+                    realm=None,
+                    uri=self.base_url,
+                    user=user,
+                    passwd=token)
+        opener = urllib2.build_opener(self.auth_handler)
         # install it for all urllib2.urlopen calls
         urllib2.install_opener(opener)
 
+    def upload_file(  # pylint: disable=too-many-arguments,too-many-locals
+            self, url, src_file,
+            content_type='application/octet-stream',
+            method='POST', chunked=False,
+            checksum='sha256', chunk_size=UPLOAD_CHUNK_SIZE):
+        # type (str, str, str, str, bool, str, int) -> UploadResult
+        """Upload a file by streaming it from disk
+
+        The request body is read from src_file and sent chunk by chunk,
+        so the memory use does not depend on the file size.
+        The checksum is computed while sending.
+
+        Args:
+            url (str): URL to upload to
+            src_file (str): file to be uploaded
+            content_type (str, optional): Defaults to
+                    'application/octet-stream'.
+            method (str, optional): Defaults to 'POST'. HTTP method
+            chunked (bool, optional): Defaults to False.
+                    Use chunked transfer encoding instead of Content-Length
+            checksum (str, optional): Defaults to 'sha256'.
+                    hashlib algorithm name, or None to skip the checksum
+            chunk_size (int, optional): Defaults to UPLOAD_CHUNK_SIZE.
+
+        Returns:
+            UploadResult: url, HTTP status, bytes sent,
+                    hex digest of the content, and response body
+
+        Raises:
+            urllib2.HTTPError: When server responses with status >= 400
+        """
+        parsed = urlparse.urlsplit(url)
+        if parsed.scheme == 'https':
+            conn = httplib.HTTPSConnection(parsed.netloc)
+        else:
+            conn = httplib.HTTPConnection(parsed.netloc)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        digest = hashlib.new(checksum) if checksum else None
+        size = 0
+        logging.info("Uploading %s to %s", src_file, url)
+        with span("upload %s" % parsed.netloc):
+            try:
+                conn.putrequest(method, path)
+                conn.putheader('Content-Type', content_type)
+                auth = self.auth_handler.get_auth_header(url)
+                if auth:
+                    conn.putheader('Authorization', auth)
+                if chunked:
+                    conn.putheader('Transfer-Encoding', 'chunked')
+                else:
+                    conn.putheader(
+                            'Content-Length', str(os.path.getsize(src_file)))
+                conn.endheaders()
+
+                with open(src_file, 'rb') as in_file:
+                    while True:
+                        buf = in_file.read(chunk_size)
+                        if not buf:
+                            break
+                        if digest:
+                            digest.update(buf)
+                        size += len(buf)
+                        if chunked:
+                            conn.send("%x\r\n%s\r\n" % (len(buf), buf))
+                        else:
+                            conn.send(buf)
+                if chunked:
+                    conn.send("0\r\n\r\n")
+
+                response = conn.getresponse()
+                body = response.read()
+            finally:
+                conn.close()
+
+        if response.status >= 400:
+            raise urllib2.HTTPError(
+                    url, response.status, response.reason,
+                    response.msg, None)
+        return UploadResult(
+                url, response.status, size,
+                digest.hexdigest() if digest else None, body)
+
+    def upload_files(self, url_file_list, max_workers=4, **kwargs):
+        # type (List[Tuple[str, str]], int, Any) -> List[UploadResult]
+        """Upload multiple files concurrently
+
+        Args:
+            url_file_list (List[Tuple[str, str]]): (url, src_file) pairs
+            max_workers (int, optional): Defaults to 4.
+                    Maximum number of concurrent uploads.
+            kwargs (Any, optional): other arguments for upload_file
+
+        Returns:
+            List[UploadResult]: results in the same order as url_file_list
+
+        Raises:
+            urllib2.HTTPError: The first failed upload
+        """
+        if not url_file_list:
+            return []
+        pool = ThreadPool(min(max_workers, len(url_file_list)))
+        try:
+            return pool.map(
+                    bind(lambda u_f: self.upload_file(
+                            u_f[0], u_f[1], **kwargs)),
+                    url_file_list)
+        finally:
+            pool.close()
+            pool.join()
+
     @staticmethod
     def read(url):
         # type (str) -> str
         """Read URL"""
         logging.debug("Reading from %s", url)
-        return urllib2.urlopen(url).read()  # nosec
+        with span("read %s" % urlparse.urlparse(url).netloc):
+            return urllib2.urlopen(url).read()  # nosec
 
     @staticmethod
     def download_file(url, dest_file='', download_dir='.'):
@@ -463,21 +738,22 @@ class UrlHelper(object):
                 raise
 
         logging.info("Downloading to %s from %s", target_path, url)
-        response = urllib2.urlopen(url)  # nosec
-        chunk_count = 0
-        with open(target_path, 'wb') as out_file:
-            while True:
-                buf = response.read(chunk)
-                if not buf:
-                    break
-                out_file.write(buf)
-                chunk_count += 1
-                if chunk_count % 100 == 0:
-                    sys.stderr.write('#')
-                    sys.stderr.flush()
-                elif chunk_count % 10 == 0:
-                    sys.stderr.write('.')
-                    sys.stderr.flush()
+        with timed('download', urlparse.urlparse(url).netloc or None):
+            response = urllib2.urlopen(url)  # nosec
+            chunk_count = 0
+            with open(target_path, 'wb') as out_file:
+                while True:
+                    buf = response.read(chunk)
+                    if not buf:
+                        break
+                    out_file.write(buf)
+                    chunk_count += 1
+                    if chunk_count % 100 == 0:
+                        sys.stderr.write('#')
+                        sys.stderr.flush()
+                    elif chunk_count % 10 == 0:
+                        sys.stderr.write('.')
+                        sys.stderr.flush()
         return response
 
 
@@ -535,14 +811,16 @@ def working_directory(directory):
         os.chdir(curr_directory)
 
 
-def main():
+def main(argv=None):
+    # type (List[str]) -> None
     """Run as command line program"""
     parser = ZanataArgParser(__file__)
-    parser.add_methods_as_sub_commands(GitHelper)
+    parser.add_methods_as_sub_commands(GitHelper, lazy=True)
+    parser.add_batch_sub_command()
     parser.add_sub_command(
             'module-help', None,
             help='Show Python Module help')
-    args = parser.parse_all()
+    args = parser.parse_all(argv)
 
     if args.sub_command == 'module-help':
         help(sys.modules[__name__])
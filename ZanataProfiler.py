@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""ZanataProfiler -- Profile a code block
+
+Modes:
+    cprofile: deterministic profiling with cProfile,
+            writes pstats report sorted by sort_key.
+    sample: wall-clock sampling of all threads,
+            writes collapsed stacks that can be fed to flamegraph.pl
+
+Example:
+    with Profiler('sample', 'stacks.txt'):
+        run_something()
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import logging
+import os
+import sys
+import threading
+
+from collections import Counter
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+
+class Profiler(object):
+    """Context manager that profiles the enclosed block"""
+
+    MODES = ['cprofile', 'sample']
+    DEFAULT_OUTPUT = {
+            'cprofile': 'profile_stats.txt',
+            'sample': 'profile_stacks.txt'}
+
+    def __init__(
+            self, mode='cprofile', output=None,
+            sort_key='cumulative', interval=0.005):
+        # type (str, str, str, float) -> None
+        """New a Profiler
+
+        Args:
+            mode (str, optional): Defaults to 'cprofile'. One of MODES
+            output (str, optional): Defaults to DEFAULT_OUTPUT of the mode.
+                    Output file
+            sort_key (str, optional): Defaults to 'cumulative'.
+                    pstats sort key, cprofile mode only
+            interval (float, optional): Defaults to 0.005.
+                    Seconds between samples, sample mode only
+        """
+        if mode not in Profiler.MODES:
+            raise ValueError("Invalid profile mode: %s" % mode)
+        self.mode = mode
+        self.output = output or Profiler.DEFAULT_OUTPUT[mode]
+        self.sort_key = sort_key
+        self.interval = float(interval)
+        self.stack_counter = Counter()  # type: Counter
+        self._profile = None
+        self._stop_event = threading.Event()
+        self._sampler = None  # type: threading.Thread
+
+    def __enter__(self):
+        if self.mode == 'cprofile':
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = threading.Thread(
+                    target=self._sample, name='profile-sampler')
+            self._sampler.daemon = True
+            self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.mode == 'cprofile':
+            self._profile.disable()
+            self._write_stats()
+        else:
+            self._stop_event.set()
+            self._sampler.join()
+            self._write_collapsed_stacks()
+        logging.info("Profile %s written to %s", self.mode, self.output)
+        return False
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return "%s (%s:%d)" % (
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno)
+
+    def _sample(self):
+        """Record stacks of all other threads until stopped"""
+        own_ident = threading.current_thread().ident
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            # pylint: disable=protected-access
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(Profiler._frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread-%s" % ident))
+                self.stack_counter[';'.join(reversed(stack))] += 1
+
+    def _write_stats(self):
+        import pstats
+        with open(self.output, 'w') as out_file:
+            stats = pstats.Stats(self._profile, stream=out_file)
+            stats.strip_dirs().sort_stats(self.sort_key).print_stats()
+
+    def _write_collapsed_stacks(self):
+        with open(self.output, 'w') as out_file:
+            for stack, count in sorted(self.stack_counter.items()):
+                out_file.write("%s %d\n" % (stack, count))
+
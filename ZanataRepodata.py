@@ -0,0 +1,860 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""ZanataRepodata -- Read and update dnf/yum repository metadata
+
+ZanataRepodata reads repodata/repomd.xml and stream-parses the primary
+metadata with iterparse, so memory stays small even for big repositories.
+
+RepodataUpdater updates primary, filelists and other metadata of a
+repository incrementally: entries of unchanged packages are copied from
+the old metadata, RPM headers are only read for added or changed
+packages, and per package metadata is cached by the package checksum.
+
+Usage:
+    ZanataRepodata.py published top_dir
+    ZanataRepodata.py update repo_dir ...
+"""
+from __future__ import absolute_import, division, print_function
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import stat
+import sys
+import time
+
+from collections import Counter, namedtuple
+from xml.etree import cElementTree as ElementTree
+from xml.sax.saxutils import escape, quoteattr, unescape
+
+import ZanataRpmHeader as rh  # pylint: disable=E0401
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+    from typing import Dict, Iterator  # noqa: F401 # pylint: disable=W0611
+    from typing import Set  # noqa: F401 # pylint: disable=unused-import
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+REPO_NS = 'http://linux.duke.edu/metadata/repo'
+COMMON_NS = 'http://linux.duke.edu/metadata/common'
+RPM_NS = 'http://linux.duke.edu/metadata/rpm'
+FILELISTS_NS = 'http://linux.duke.edu/metadata/filelists'
+OTHER_NS = 'http://linux.duke.edu/metadata/other'
+
+METADATA_TYPES = ['primary', 'filelists', 'other']
+# Compression of metadata that _open_metadata() cannot read,
+# newer createrepo_c writes these
+UNSUPPORTED_COMPRESSION = ('.xz', '.bz2', '.zst')
+# Databases generated by createrepo are removed, as they would be stale
+STALE_TYPES = ['primary_db', 'filelists_db', 'other_db']
+
+# Header and signature tags only needed for repodata entries
+RPMTAG_SUMMARY = 1004
+RPMTAG_DESCRIPTION = 1005
+RPMTAG_BUILDTIME = 1006
+RPMTAG_BUILDHOST = 1007
+RPMTAG_SIZE = 1009
+RPMTAG_VENDOR = 1011
+RPMTAG_LICENSE = 1014
+RPMTAG_PACKAGER = 1015
+RPMTAG_GROUP = 1016
+RPMTAG_URL = 1020
+RPMTAG_OLDFILENAMES = 1027
+RPMTAG_FILEMODES = 1030
+RPMTAG_FILEFLAGS = 1037
+RPMTAG_ARCHIVESIZE = 1046
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_REQUIREFLAGS = 1048
+RPMTAG_REQUIRENAME = 1049
+RPMTAG_REQUIREVERSION = 1050
+RPMTAG_CONFLICTFLAGS = 1053
+RPMTAG_CONFLICTNAME = 1054
+RPMTAG_CONFLICTVERSION = 1055
+RPMTAG_CHANGELOGTIME = 1080
+RPMTAG_CHANGELOGNAME = 1081
+RPMTAG_CHANGELOGTEXT = 1082
+RPMTAG_OBSOLETENAME = 1090
+RPMTAG_PROVIDEFLAGS = 1112
+RPMTAG_PROVIDEVERSION = 1113
+RPMTAG_OBSOLETEFLAGS = 1114
+RPMTAG_OBSOLETEVERSION = 1115
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMSIGTAG_PAYLOADSIZE = 1007
+
+# Package elements of metadata, copied as is when the package is unchanged
+PACKAGE_RE = re.compile(r'<package[\s>].*?</package>', re.S)
+PKGID_RE = re.compile(r'<package\s[^>]*pkgid="([^"]*)"')
+CHECKSUM_RE = re.compile(r'<checksum[^>]*>\s*([^<\s]*)\s*</checksum>')
+LOCATION_RE = re.compile(r'<location\s[^>]*href=(["\'])(.*?)\1')
+
+Nevra = namedtuple('Nevra', ['name', 'epoch', 'version', 'release', 'arch'])
+
+
+def _ns(namespace, tag):
+    # type (str, str) -> str
+    return "{%s}%s" % (namespace, tag)
+
+
+def read_repomd(repo_dir):
+    # type (str) -> Dict[str, dict]
+    """Read repodata/repomd.xml
+
+    Args:
+        repo_dir (str): repository directory, which contains repodata/
+
+    Returns:
+        Dict[str, dict]: metadata type like 'primary' to
+                {'href', 'checksum', 'checksum_type', 'open_checksum',
+                'timestamp', 'size'}
+    """
+    tree = ElementTree.parse(os.path.join(repo_dir, 'repodata', 'repomd.xml'))
+    result = {}
+    for data in tree.getroot().findall(_ns(REPO_NS, 'data')):
+        checksum = data.find(_ns(REPO_NS, 'checksum'))
+        open_checksum = data.find(_ns(REPO_NS, 'open-checksum'))
+        timestamp = data.find(_ns(REPO_NS, 'timestamp'))
+        size = data.find(_ns(REPO_NS, 'size'))
+        result[data.get('type')] = {
+                'href': data.find(_ns(REPO_NS, 'location')).get('href'),
+                'checksum': checksum.text if checksum is not None else None,
+                'checksum_type': checksum.get('type')
+                if checksum is not None else None,
+                'open_checksum': open_checksum.text
+                if open_checksum is not None else None,
+                'timestamp': timestamp.text
+                if timestamp is not None else None,
+                'size': size.text if size is not None else None}
+    return result
+
+
+def _open_metadata(repo_dir, href):
+    """Open metadata file, decompress if needed"""
+    path = os.path.join(repo_dir, href)
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def iter_primary_packages(repo_dir):
+    # type (str) -> Iterator[Nevra]
+    """Yield Nevra of each package in primary metadata
+
+    Elements are cleared as soon as they are read.
+
+    Args:
+        repo_dir (str): repository directory, which contains repodata/
+
+    Raises:
+        ValueError: primary metadata is missing or compression
+                is not supported
+    """
+    primary = read_repomd(repo_dir).get('primary')
+    if not primary:
+        raise ValueError("No primary metadata in %s" % repo_dir)
+    if primary['href'].endswith(UNSUPPORTED_COMPRESSION):
+        raise ValueError("Unsupported compression: %s" % primary['href'])
+
+    package_tag = _ns(COMMON_NS, 'package')
+    name_tag = _ns(COMMON_NS, 'name')
+    arch_tag = _ns(COMMON_NS, 'arch')
+    version_tag = _ns(COMMON_NS, 'version')
+    with _open_metadata(repo_dir, primary['href']) as in_file:
+        context = ElementTree.iterparse(in_file, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end' or elem.tag != package_tag:
+                continue
+            version = elem.find(version_tag)
+            yield Nevra(
+                    elem.findtext(name_tag), version.get('epoch', '0'),
+                    version.get('ver'), version.get('rel'),
+                    elem.findtext(arch_tag))
+            elem.clear()
+            # Drop references from root to processed packages
+            root.clear()
+
+
+def find_repo_dirs(top_dir):
+    # type (str) -> List[str]
+    """Return directories under top_dir that contain repodata/repomd.xml"""
+    repo_dirs = []
+    for dirpath, dirnames, _ in os.walk(top_dir):
+        if os.path.isfile(os.path.join(dirpath, 'repodata', 'repomd.xml')):
+            repo_dirs.append(dirpath)
+        # Do not descend into repodata
+        dirnames[:] = [d for d in dirnames if d != 'repodata']
+    return sorted(repo_dirs)
+
+
+class NevraSet(frozenset):
+    """Set of Nevra, indexed by (name, version, release)
+    for lookups of any epoch or arch"""
+
+    def __new__(cls, nevras=()):
+        self = super(NevraSet, cls).__new__(cls, nevras)
+        self.nvrs = frozenset((n.name, n.version, n.release) for n in self)
+        return self
+
+
+def published_nevras(top_dir):
+    # type (str) -> NevraSet
+    """Return Nevra of all packages published in repositories under top_dir
+
+    Repositories whose metadata cannot be read are logged and skipped.
+    """
+    nevras = set()
+    for repo_dir in find_repo_dirs(top_dir):
+        try:
+            nevras.update(iter_primary_packages(repo_dir))
+        except (IOError, OSError, ValueError, SyntaxError) as e:
+            logging.warning("Skip repodata of %s: %s", repo_dir, e)
+    return NevraSet(nevras)
+
+
+def is_published(nevras, name, version, release):
+    # type (Set[Nevra], str, str, str) -> bool
+    """Whether name-version-release is in nevras, any epoch or arch
+
+    Other sets than NevraSet are indexed on each call."""
+    if not isinstance(nevras, NevraSet):
+        nevras = NevraSet(nevras)
+    return (name, version, release) in nevras.nvrs
+
+
+def _sha256_file(path):
+    # type (str) -> str
+    sha = hashlib.sha256()
+    with open(path, 'rb') as in_file:
+        for chunk in iter(lambda: in_file.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _text(value):
+    # type (Any) -> unicode
+    """Header value to unicode, first item of lists"""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if value is None:
+        return u''
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return u"%s" % value
+
+
+def _split_evr(evr):
+    # type (unicode) -> Tuple[unicode, unicode, unicode]
+    """Split [epoch:]version[-release]"""
+    epoch, _, ver_rel = evr.rpartition(u':')
+    ver, _, rel = ver_rel.partition(u'-')
+    return epoch or u'0', ver, rel or None
+
+
+def _dependency_entries(header, name_tag, flags_tag, version_tag):
+    # type (dict, int, int, int) -> unicode
+    """rpm:entry elements of a dependency type"""
+    flag_names = {2: u'LT', 4: u'GT', 8: u'EQ', 10: u'LE', 12: u'GE'}
+    names = header.get(name_tag) or []
+    flags = header.get(flags_tag) or [0] * len(names)
+    versions = header.get(version_tag) or [b''] * len(names)
+    entries = []
+    for name, flag, version in zip(names, flags, versions):
+        name = _text(name)
+        if name.startswith(u'rpmlib('):
+            continue
+        attrs = u"name=%s" % quoteattr(name)
+        flag_name = flag_names.get(flag & 0xe)
+        if flag_name and version:
+            epoch, ver, rel = _split_evr(_text(version))
+            attrs += u" flags=%s epoch=%s ver=%s" % (
+                    quoteattr(flag_name), quoteattr(epoch), quoteattr(ver))
+            if rel:
+                attrs += u" rel=%s" % quoteattr(rel)
+        entries.append(u"<rpm:entry %s/>" % attrs)
+    return u''.join(entries)
+
+
+def _file_entries(header):
+    # type (dict) -> List[Tuple[unicode, unicode]]
+    """(path, type) of package files, type is u'', u'dir' or u'ghost'"""
+    if RPMTAG_BASENAMES in header:
+        dirnames = header.get(RPMTAG_DIRNAMES) or []
+        paths = [
+                _text(dirnames[i]) + _text(b)
+                for i, b in zip(
+                        header.get(RPMTAG_DIRINDEXES) or [],
+                        header[RPMTAG_BASENAMES])]
+    else:
+        paths = [_text(p) for p in header.get(RPMTAG_OLDFILENAMES) or []]
+    modes = header.get(RPMTAG_FILEMODES) or [0] * len(paths)
+    flags = header.get(RPMTAG_FILEFLAGS) or [0] * len(paths)
+    files = []
+    for path, mode, flag in zip(paths, modes, flags):
+        if flag & 64:
+            files.append((path, u'ghost'))
+        elif stat.S_ISDIR(mode & 0xffff):
+            files.append((path, u'dir'))
+        else:
+            files.append((path, u''))
+    return files
+
+
+def _file_element(path, file_type):
+    # type (unicode, unicode) -> unicode
+    if file_type:
+        return u"<file type=%s>%s</file>" % (
+                quoteattr(file_type), escape(path))
+    return u"<file>%s</file>" % escape(path)
+
+
+def _is_primary_file(path):
+    # type (unicode) -> bool
+    """Files that are listed in primary, same rules as createrepo"""
+    return (path.startswith(u'/etc/') or u'bin/' in path or
+            path == u'/usr/lib/sendmail')
+
+
+def package_metadata(rpm_file, pkgid):
+    # type (str, str) -> dict
+    """Generate metadata of a package from its headers
+
+    Location, file time and package size are not included,
+    as they depend on where the file is, not its content.
+
+    Args:
+        rpm_file (str): RPM file
+        pkgid (str): sha256 of the RPM file
+
+    Returns:
+        dict: {'name', 'arch', 'version', 'primary_head', 'build_time',
+                'installed_size', 'archive_size', 'primary_format',
+                'filelists', 'other'}, XML snippets are unicode
+    """
+    headers = rh.read_headers(rpm_file)
+    header = headers.header
+    name = _text(header.get(rh.RPMTAG_NAME))
+    arch = _text(header.get(rh.RPMTAG_ARCH))
+    if not header.get(rh.RPMTAG_SOURCERPM):
+        arch = u'src'
+    epoch = header.get(rh.RPMTAG_EPOCH)
+    version = u"<version epoch=%s ver=%s rel=%s/>" % (
+            quoteattr(_text(epoch[0]) if epoch else u'0'),
+            quoteattr(_text(header.get(rh.RPMTAG_VERSION))),
+            quoteattr(_text(header.get(rh.RPMTAG_RELEASE))))
+    files = _file_entries(header)
+
+    primary_head = (
+            u"<name>%s</name><arch>%s</arch>%s"
+            u"<checksum type=\"sha256\" pkgid=\"YES\">%s</checksum>"
+            u"<summary>%s</summary><description>%s</description>"
+            u"<packager>%s</packager><url>%s</url>") % (
+                    escape(name), escape(arch), version, pkgid,
+                    escape(_text(header.get(RPMTAG_SUMMARY))),
+                    escape(_text(header.get(RPMTAG_DESCRIPTION))),
+                    escape(_text(header.get(RPMTAG_PACKAGER))),
+                    escape(_text(header.get(RPMTAG_URL))))
+    primary_format = u"<format>"
+    for tag, element in [
+            (RPMTAG_LICENSE, u'license'), (RPMTAG_VENDOR, u'vendor'),
+            (RPMTAG_GROUP, u'group'), (RPMTAG_BUILDHOST, u'buildhost'),
+            (rh.RPMTAG_SOURCERPM, u'sourcerpm')]:
+        primary_format += u"<rpm:%s>%s</rpm:%s>" % (
+                element, escape(_text(header.get(tag))), element)
+    primary_format += u"<rpm:header-range start=\"%d\" end=\"%d\"/>" % (
+            headers.header_start, headers.header_end)
+    for element, tags in [
+            (u'provides', (RPMTAG_PROVIDENAME, RPMTAG_PROVIDEFLAGS,
+                           RPMTAG_PROVIDEVERSION)),
+            (u'requires', (RPMTAG_REQUIRENAME, RPMTAG_REQUIREFLAGS,
+                           RPMTAG_REQUIREVERSION)),
+            (u'conflicts', (RPMTAG_CONFLICTNAME, RPMTAG_CONFLICTFLAGS,
+                            RPMTAG_CONFLICTVERSION)),
+            (u'obsoletes', (RPMTAG_OBSOLETENAME, RPMTAG_OBSOLETEFLAGS,
+                            RPMTAG_OBSOLETEVERSION))]:
+        entries = _dependency_entries(header, *tags)
+        if entries:
+            primary_format += u"<rpm:%s>%s</rpm:%s>" % (
+                    element, entries, element)
+    primary_format += u''.join(
+            _file_element(p, t) for p, t in files if _is_primary_file(p))
+    primary_format += u"</format>"
+
+    changelogs = zip(
+            header.get(RPMTAG_CHANGELOGNAME) or [],
+            header.get(RPMTAG_CHANGELOGTIME) or [],
+            header.get(RPMTAG_CHANGELOGTEXT) or [])
+    package_attrs = u"pkgid=%s name=%s arch=%s" % (
+            quoteattr(pkgid), quoteattr(name), quoteattr(arch))
+    archive_size = headers.signature.get(
+            RPMSIGTAG_PAYLOADSIZE) or header.get(RPMTAG_ARCHIVESIZE)
+    return {
+            'name': name, 'arch': arch, 'version': version,
+            'primary_head': primary_head,
+            'build_time': _text(header.get(RPMTAG_BUILDTIME)) or u'0',
+            'installed_size': _text(header.get(RPMTAG_SIZE)) or u'0',
+            'archive_size': _text(archive_size) or u'0',
+            'primary_format': primary_format,
+            'filelists': u"<package %s>%s%s</package>" % (
+                    package_attrs, version,
+                    u''.join(_file_element(p, t) for p, t in files)),
+            'other': u"<package %s>%s%s</package>" % (
+                    package_attrs, version, u''.join(
+                            u"<changelog author=%s date=\"%s\">%s</changelog>"
+                            % (quoteattr(_text(author)), date,
+                               escape(_text(text)))
+                            for author, date, text in changelogs))}
+
+
+class RepodataCache(object):
+    """Package metadata cache keyed by package sha256"""
+
+    def __init__(self, cache_dir=None):
+        # type (str) -> None
+        """
+        Args:
+            cache_dir (str, optional): Defaults to
+                    $XDG_CACHE_HOME/zanata-scripts/repodata
+        """
+        self.cache_dir = cache_dir or os.path.join(
+                os.getenv('XDG_CACHE_HOME', os.path.join(
+                        os.path.expanduser('~'), '.cache')),
+                'zanata-scripts', 'repodata')
+
+    def _path(self, pkgid):
+        return os.path.join(self.cache_dir, pkgid[:2], pkgid + '.json')
+
+    def get(self, pkgid):
+        # type (str) -> dict
+        """Return cached metadata, or None"""
+        try:
+            with open(self._path(pkgid), 'r') as in_file:
+                return json.load(in_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, pkgid, metadata):
+        # type (str, dict) -> None
+        """Store metadata, failures are ignored as it is only a cache"""
+        path = self._path(pkgid)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(tmp_path, 'w') as out_file:
+                json.dump(metadata, out_file)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logging.debug("Skip caching %s: %s", pkgid, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class RepodataUpdater(object):
+    """Update metadata of a repository in place, incrementally
+
+    Packages are matched with the existing primary metadata by location,
+    size and file time. Entries of unchanged packages are copied from the
+    existing metadata. Only new or changed packages are checksummed, and
+    their headers are read only when their metadata is not cached.
+    """
+
+    def __init__(self, repo_dir, cache=None):
+        # type (str, RepodataCache) -> None
+        """
+        Args:
+            repo_dir (str): repository directory, repodata/ is written here
+            cache (RepodataCache, optional): Defaults to RepodataCache()
+        """
+        self.repo_dir = repo_dir
+        self.repodata_dir = os.path.join(repo_dir, 'repodata')
+        self.cache = cache or RepodataCache()
+
+    def _old_packages(self):
+        # type () -> Dict[str, Tuple[str, int, int]]
+        """location href: (pkgid, size, file time) from existing primary
+
+        Empty if the primary cannot be read, so every package is read.
+        """
+        try:
+            primary = read_repomd(self.repo_dir).get('primary')
+        except (IOError, OSError, SyntaxError):
+            return {}
+        if not primary:
+            return {}
+        if primary['href'].endswith(UNSUPPORTED_COMPRESSION):
+            logging.info(
+                    "Unsupported compression: %s, read all packages",
+                    primary['href'])
+            return {}
+        try:
+            return self._read_old_primary(primary['href'])
+        except (IOError, OSError, SyntaxError) as e:
+            logging.warning(
+                    "Failed to read %s: %s, read all packages",
+                    primary['href'], e)
+            return {}
+
+    def _read_old_primary(self, href):
+        # type (str) -> Dict[str, Tuple[str, int, int]]
+        package_tag = _ns(COMMON_NS, 'package')
+        result = {}
+        with _open_metadata(self.repo_dir, href) as in_file:
+            context = ElementTree.iterparse(in_file, events=('start', 'end'))
+            _, root = next(context)
+            for event, elem in context:
+                if event != 'end' or elem.tag != package_tag:
+                    continue
+                checksum = elem.find(_ns(COMMON_NS, 'checksum'))
+                if checksum is not None and checksum.get('type') == 'sha256':
+                    result[elem.find(_ns(COMMON_NS, 'location')).get(
+                            'href')] = (
+                                    checksum.text,
+                                    int(elem.find(_ns(COMMON_NS, 'size')).get(
+                                            'package')),
+                                    int(elem.find(_ns(COMMON_NS, 'time')).get(
+                                            'file')))
+                elem.clear()
+                root.clear()
+        return result
+
+    def _rpm_files(self):
+        # type () -> List[str]
+        """RPM files relative to repo_dir, excluding nested repositories"""
+        rpm_files = []
+        for dirpath, dirnames, filenames in os.walk(self.repo_dir):
+            dirnames[:] = sorted(
+                    d for d in dirnames if d != 'repodata' and
+                    not os.path.isfile(os.path.join(
+                            dirpath, d, 'repodata', 'repomd.xml')))
+            rpm_files.extend(
+                    os.path.relpath(os.path.join(dirpath, f), self.repo_dir)
+                    for f in sorted(filenames) if f.endswith('.rpm'))
+        return rpm_files
+
+    def _package_metadata(self, href, pkgid):
+        # type (str, str) -> dict
+        """Metadata from cache or RPM headers, None if not readable"""
+        metadata = self.cache.get(pkgid)
+        if not metadata:
+            try:
+                metadata = package_metadata(
+                        os.path.join(self.repo_dir, href), pkgid)
+            except (rh.RpmHeaderError, ValueError) as e:
+                logging.warning("Skip %s: %s", href, e)
+                return None
+            self.cache.put(pkgid, metadata)
+        return metadata
+
+    def update(self, force=False):
+        # type (bool) -> dict
+        """Update repodata if packages are added, removed or changed
+
+        Args:
+            force (bool, optional): Defaults to False.
+                    Write metadata even if nothing is changed.
+
+        Returns:
+            dict: counts of 'added', 'removed', 'changed', 'unchanged',
+                    and 'written' (bool)
+        """
+        old = self._old_packages()
+        summary = {'added': 0, 'removed': 0, 'changed': 0, 'unchanged': 0}
+        # location href: pkgid of unchanged packages
+        kept = {}  # type: Dict[str, str]
+        packages = []
+        for href in self._rpm_files():
+            path = os.path.join(self.repo_dir, href)
+            st = os.stat(path)
+            old_entry = old.pop(href, None)
+            if old_entry and old_entry[1:] == (st.st_size, int(st.st_mtime)):
+                kept[href] = old_entry[0]
+                summary['unchanged'] += 1
+                continue
+            pkgid = _sha256_file(path)
+            summary['changed' if old_entry else 'added'] += 1
+            metadata = self._package_metadata(href, pkgid)
+            if metadata:
+                packages.append((href, pkgid, st, metadata))
+        summary['removed'] = len(old)
+
+        summary['written'] = bool(
+                force or summary['added'] or summary['removed'] or
+                summary['changed'] or not os.path.isfile(
+                        os.path.join(self.repodata_dir, 'repomd.xml')))
+        if summary['written']:
+            self._write(kept, packages)
+        logging.info(
+                "Repodata of %s: %d added, %d removed, %d changed, "
+                "%d unchanged%s", self.repo_dir, summary['added'],
+                summary['removed'], summary['changed'], summary['unchanged'],
+                '' if summary['written'] else ', not written')
+        return summary
+
+    def _kept_elements(self, old_repomd, kept):
+        # type (Dict[str, dict], Dict[str, str]) -> Dict[str, List[unicode]]
+        """Package elements of kept packages, copied from old metadata
+
+        Args:
+            old_repomd (Dict[str, dict]): from read_repomd()
+            kept (Dict[str, str]): location href: pkgid
+
+        Returns:
+            Dict[str, List[unicode]]: metadata type: package elements
+
+        Raises:
+            ValueError: old metadata is not readable or misses
+                    kept packages
+        """
+        result = {}
+        for metadata_type in METADATA_TYPES:
+            data = old_repomd.get(metadata_type)
+            if not data or data['href'].endswith(UNSUPPORTED_COMPRESSION):
+                raise ValueError("No readable %s metadata" % metadata_type)
+            with _open_metadata(self.repo_dir, data['href']) as in_file:
+                text = in_file.read().decode('utf-8')
+            wanted = set((pkgid, href) for href, pkgid in kept.items())
+            # filelists and other have no location, so entries are
+            # counted by pkgid
+            remaining = Counter(kept.values())
+            elements = []
+            for match in PACKAGE_RE.finditer(text):
+                element = match.group(0)
+                if metadata_type == 'primary':
+                    checksum = CHECKSUM_RE.search(element)
+                    location = LOCATION_RE.search(element)
+                    key = (checksum and checksum.group(1), location and
+                           unescape(location.group(2), {'&quot;': '"'}))
+                    if key not in wanted:
+                        continue
+                    wanted.discard(key)
+                    pkgid = key[0]
+                else:
+                    pkgid_match = PKGID_RE.search(element)
+                    pkgid = pkgid_match and pkgid_match.group(1)
+                    if not remaining[pkgid]:
+                        continue
+                remaining[pkgid] -= 1
+                elements.append(element + u'\n')
+            if len(elements) != len(kept):
+                raise ValueError("%s misses %d unchanged packages" % (
+                        data['href'], len(kept) - len(elements)))
+            result[metadata_type] = elements
+        return result
+
+    @staticmethod
+    def _primary_package(href, pkgid, st, metadata):
+        # type (str, str, os.stat_result, dict) -> unicode
+        return (u"<package type=\"rpm\">%s"
+                u"<time file=\"%d\" build=\"%s\"/>"
+                u"<size package=\"%d\" installed=\"%s\" archive=\"%s\"/>"
+                u"<location href=%s/>%s</package>\n") % (
+                        metadata['primary_head'], int(st.st_mtime),
+                        metadata['build_time'], st.st_size,
+                        metadata['installed_size'], metadata['archive_size'],
+                        quoteattr(href.decode('utf-8', 'replace')),
+                        metadata['primary_format'])
+
+    def _write_metadata_file(self, metadata_type, header, packages, footer):
+        # type (str, unicode, List[unicode], unicode) -> dict
+        """Write gzipped metadata to a temporary file
+
+        Returns:
+            dict: repomd data of the file, with 'tmp_path'
+        """
+        tmp_path = os.path.join(
+                self.repodata_dir, ".%s.%d.tmp" % (metadata_type, os.getpid()))
+        open_sha = hashlib.sha256()
+        open_size = 0
+        with open(tmp_path, 'wb') as raw_file:
+            gz_file = gzip.GzipFile(
+                    filename='', mode='wb', fileobj=raw_file, mtime=0)
+            for chunk in [header] + list(packages) + [footer]:
+                data = chunk.encode('utf-8')
+                open_sha.update(data)
+                open_size += len(data)
+                gz_file.write(data)
+            gz_file.close()
+        checksum = _sha256_file(tmp_path)
+        return {
+                'tmp_path': tmp_path,
+                'href': "repodata/%s-%s.xml.gz" % (checksum, metadata_type),
+                'checksum': checksum,
+                'open_checksum': open_sha.hexdigest(),
+                'size': os.path.getsize(tmp_path),
+                'open_size': open_size}
+
+    def _write(self, kept, packages):
+        # type (Dict[str, str], List[tuple]) -> None
+        """Write metadata files, then replace repomd.xml atomically
+
+        Args:
+            kept (Dict[str, str]): location href: pkgid of unchanged
+                    packages, their entries are copied from old metadata
+            packages (List[Tuple[str, str, os.stat_result, dict]]):
+                    (href, pkgid, stat, metadata) of added or changed
+                    packages
+        """
+        if not os.path.isdir(self.repodata_dir):
+            os.makedirs(self.repodata_dir)
+        try:
+            old_repomd = read_repomd(self.repo_dir)
+        except (IOError, OSError, SyntaxError):
+            old_repomd = {}
+        elements = {t: [] for t in METADATA_TYPES}
+        if kept:
+            try:
+                elements = self._kept_elements(old_repomd, kept)
+            except (IOError, OSError, ValueError) as e:
+                logging.warning(
+                        "Failed to copy unchanged packages: %s, "
+                        "read all packages", e)
+                unchanged = []
+                for href, pkgid in sorted(kept.items()):
+                    metadata = self._package_metadata(href, pkgid)
+                    if metadata:
+                        unchanged.append((href, pkgid, os.stat(
+                                os.path.join(self.repo_dir, href)), metadata))
+                packages = unchanged + packages
+        for href, pkgid, st, metadata in packages:
+            elements['primary'].append(RepodataUpdater._primary_package(
+                    href, pkgid, st, metadata))
+            elements['filelists'].append(metadata['filelists'] + u'\n')
+            elements['other'].append(metadata['other'] + u'\n')
+        count = len(elements['primary'])
+        header = u'<?xml version="1.0" encoding="UTF-8"?>\n'
+        new_data = {}
+        try:
+            new_data['primary'] = self._write_metadata_file(
+                    'primary',
+                    header + u"<metadata xmlns=\"%s\" xmlns:rpm=\"%s\" "
+                    u"packages=\"%d\">\n" % (COMMON_NS, RPM_NS, count),
+                    elements['primary'], u"</metadata>\n")
+            new_data['filelists'] = self._write_metadata_file(
+                    'filelists',
+                    header + u"<filelists xmlns=\"%s\" packages=\"%d\">\n" % (
+                            FILELISTS_NS, count),
+                    elements['filelists'], u"</filelists>\n")
+            new_data['other'] = self._write_metadata_file(
+                    'other',
+                    header + u"<otherdata xmlns=\"%s\" packages=\"%d\">\n" % (
+                            OTHER_NS, count),
+                    elements['other'], u"</otherdata>\n")
+            for data in new_data.values():
+                os.rename(data.pop('tmp_path'), os.path.join(
+                        self.repo_dir, data['href']))
+            self._write_repomd(new_data, old_repomd)
+        finally:
+            for data in new_data.values():
+                if 'tmp_path' in data and os.path.exists(data['tmp_path']):
+                    os.remove(data['tmp_path'])
+
+        # Remove metadata files that are no longer referenced
+        for metadata_type, data in old_repomd.items():
+            if metadata_type not in METADATA_TYPES + STALE_TYPES:
+                continue
+            if data['href'] in [d['href'] for d in new_data.values()]:
+                continue
+            old_path = os.path.join(self.repo_dir, data['href'])
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def _write_repomd(self, new_data, old_repomd):
+        # type (Dict[str, dict], Dict[str, dict]) -> None
+        """Write repomd.xml atomically, keep other types like group"""
+        now = int(time.time())
+        lines = [
+                '<?xml version="1.0" encoding="UTF-8"?>',
+                "<repomd xmlns=\"%s\" xmlns:rpm=\"%s\">" % (REPO_NS, RPM_NS),
+                "  <revision>%d</revision>" % now]
+        for metadata_type in METADATA_TYPES:
+            data = new_data[metadata_type]
+            lines += [
+                    "  <data type=\"%s\">" % metadata_type,
+                    "    <checksum type=\"sha256\">%s</checksum>" % (
+                            data['checksum']),
+                    "    <open-checksum type=\"sha256\">%s</open-checksum>"
+                    % data['open_checksum'],
+                    "    <location href=%s/>" % quoteattr(data['href']),
+                    "    <timestamp>%d</timestamp>" % now,
+                    "    <size>%d</size>" % data['size'],
+                    "    <open-size>%d</open-size>" % data['open_size'],
+                    "  </data>"]
+        for metadata_type, data in sorted(old_repomd.items()):
+            if metadata_type in METADATA_TYPES + STALE_TYPES:
+                continue
+            lines += ["  <data type=%s>" % quoteattr(metadata_type)]
+            if data['checksum']:
+                lines += ["    <checksum type=%s>%s</checksum>" % (
+                        quoteattr(data['checksum_type']), data['checksum'])]
+            if data['open_checksum']:
+                lines += [
+                        "    <open-checksum type=%s>%s</open-checksum>" % (
+                                quoteattr(data['checksum_type']),
+                                data['open_checksum'])]
+            lines += ["    <location href=%s/>" % quoteattr(data['href'])]
+            if data['timestamp']:
+                lines += ["    <timestamp>%s</timestamp>" % data['timestamp']]
+            if data['size']:
+                lines += ["    <size>%s</size>" % data['size']]
+            lines += ["  </data>"]
+        lines.append("</repomd>")
+
+        repomd_path = os.path.join(self.repodata_dir, 'repomd.xml')
+        tmp_path = "%s.%d.tmp" % (repomd_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as out_file:
+                out_file.write('\n'.join(lines) + '\n')
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            os.rename(tmp_path, repomd_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def main(argv=None):
+    # type (List[str]) -> None
+    """Run as command line program"""
+    from ZanataArgParser import ZanataArgParser  # pylint: disable=E0401
+    parser = ZanataArgParser(__file__, description=__doc__)
+    parser.add_sub_command(
+            'published',
+            [('top_dir', {'type': str, 'help': 'Directory to scan'})],
+            help='List packages in repositories under top_dir')
+    parser.add_sub_command(
+            'update',
+            [
+                    ('--force', {
+                            'action': 'store_true',
+                            'help': 'Write metadata even if nothing changed'}),
+                    ('--cache-dir', {
+                            'type': str, 'default': None,
+                            'help': 'Package metadata cache directory'}),
+                    ('repo_dirs', {
+                            'type': str, 'nargs': '+',
+                            'help': 'Repository directories'})],
+            help='Update repodata incrementally')
+    args = parser.parse_all(argv)
+    if args.sub_command == 'update':
+        cache = RepodataCache(args.cache_dir)
+        with parser.profiling():
+            for repo_dir in args.repo_dirs:
+                RepodataUpdater(repo_dir, cache).update(args.force)
+        return
+    with parser.profiling():
+        nevras = published_nevras(args.top_dir)
+    for nevra in sorted(nevras):
+        print("%s-%s%s-%s.%s" % (
+                nevra.name,
+                nevra.epoch + ':' if nevra.epoch not in (None, '0') else '',
+                nevra.version, nevra.release, nevra.arch))
+
+
+if __name__ == '__main__':
+    main()
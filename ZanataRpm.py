@@ -19,23 +19,233 @@ It defines classes_and_methods
 from __future__ import absolute_import, division, print_function
 
 import datetime
+import glob
+import json
 import locale
 import logging
 import re
 import os
+import shlex
 import sys
+import tempfile
+import time
+
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
 
 from ZanataArgParser import ZanataArgParser  # pylint: disable=import-error
 from ZanataFunctions import CLIException
+from ZanataTrace import bind
 
 try:
     from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+    from typing import Dict, Tuple  # noqa: F401 # pylint: disable=W0611
+    from typing import Iterator  # noqa: F401 # pylint: disable=W0611
 except ImportError:
     sys.stderr.write("python typing module is not installed" + os.linesep)
 
 locale.setlocale(locale.LC_ALL, 'C')
 
 
+SpecToken = namedtuple(
+        'SpecToken', ['kind', 'name', 'value', 'package', 'section'])
+
+
+class RpmSpecTokenizer(object):
+    """Classify RPM spec lines one by one
+
+    Each line is classified as one of following SpecToken kind:
+        tag: tag definition in preamble of main package or sub-package,
+                name is tag name, value is tag value.
+        section: section start like %prep and %files,
+                name is section name, value is section argument.
+        macro: %define or %global, name is macro name,
+                value is macro body.
+        text: everything else.
+
+    package of a token is None for main package, otherwise the argument of
+    %package, like 'devel' or '-n other-name'.
+    """
+    TAG_RE = re.compile(r"([A-Z][A-Za-z0-9]*)(?:\(([^)]*)\))?:\s*(.+)")
+    SECTION_RE = re.compile(
+            r"%(package|description|prep|build|install|check|clean|files"
+            r"|changelog|pre|post|preun|postun|pretrans|posttrans"
+            r"|verifyscript|trigger[a-z]*)(?:\s+(.*))?$")
+    MACRO_RE = re.compile(r"%(?:define|global)\s+(\w+)(?:\([^)]*\))?\s+(.*)")
+
+    def __init__(self):
+        # Section None means preamble
+        self.section = None  # type: str
+        self.package = None  # type: str
+
+    def feed(self, line):
+        # type (str) -> SpecToken
+        """Classify a line, line should be right stripped"""
+        if line.startswith('%'):
+            matched = RpmSpecTokenizer.MACRO_RE.match(line)
+            if matched:
+                return SpecToken(
+                        'macro', matched.group(1), matched.group(2),
+                        self.package, self.section)
+            matched = RpmSpecTokenizer.SECTION_RE.match(line)
+            if matched:
+                self.section = matched.group(1)
+                arg = (matched.group(2) or '').strip()
+                words = arg.split()
+                if self.section == 'package':
+                    self.package = arg
+                elif '-n' in words[:-1]:
+                    # like %files -n other-name
+                    self.package = '-n ' + words[words.index('-n') + 1]
+                elif words and not words[0].startswith('-'):
+                    # like %files devel
+                    self.package = words[0]
+                else:
+                    self.package = None
+                return SpecToken(
+                        'section', self.section, arg,
+                        self.package, self.section)
+        elif self.section in (None, 'package'):
+            matched = RpmSpecTokenizer.TAG_RE.match(line)
+            if matched:
+                # Tag with qualifier, like Requires(post)
+                name = matched.group(1) if not matched.group(2) else (
+                        "%s(%s)" % (matched.group(1), matched.group(2)))
+                return SpecToken(
+                        'tag', name, matched.group(3),
+                        self.package, self.section)
+        return SpecToken('text', None, line, self.package, self.section)
+
+
+class ChangelogTemplate(object):
+    """Changelog entry header with date and maintainer resolved once"""
+
+    def __init__(self, date=None, email=None):
+        # type (str, str) -> None
+        """
+        Args:
+            date (str, optional): Defaults to today, like 'Mon Jan 01 2018'
+            email (str, optional): Defaults to env MAINTAINER_EMAIL,
+                    or noreply@zanata.org
+        """
+        self.header = "* %s %s " % (
+                date or datetime.datetime.now().strftime("%a %b %d %Y"),
+                email or os.getenv('MAINTAINER_EMAIL', 'noreply@zanata.org'))
+
+    def format(self, version, release='1', changes=None):
+        # type (str, str, List[str]) -> str
+        """Return changelog entry
+
+        Args:
+            version (str): package version
+            release (str, optional): Defaults to '1'. package release,
+                    macros such as %{?dist} are removed
+            changes (List[str], optional): Defaults to
+                    ['Upgrade to upstream version <version>'].
+
+        Returns:
+            str: changelog entry
+        """
+        release = re.sub(r"%\{?\??dist\}?", '', release)
+        return "%s%s-%s\n%s\n" % (
+                self.header, version, release, ''.join(
+                        "- %s\n" % c for c in (changes or [
+                                "Upgrade to upstream version %s" % (
+                                        version)])).rstrip('\n'))
+
+
+class SpecEdit(object):
+    """Edit operation applied to a spec line by line
+
+    Subclasses override apply(), which receives the SpecToken and the
+    line (with line ending), and returns lines to be written.
+    Attribute changed should be set when the output differs.
+    """
+
+    def __init__(self):
+        self.changed = False
+
+    def apply(self, token, line):
+        # type (SpecToken, str) -> List[str]
+        """Return lines to be written for this line"""
+        return [line]
+
+
+class SetTagEdit(SpecEdit):
+    """Set value of a tag"""
+
+    def __init__(self, tag, value, package=None):
+        # type (str, str, str) -> None
+        super(SetTagEdit, self).__init__()
+        self.tag = tag
+        self.value = value
+        self.package = package
+        # Value of first matched tag before edit
+        self.old_value = None  # type: str
+
+    def apply(self, token, line):
+        if (token.kind != 'tag' or token.name != self.tag or
+                token.package != self.package):
+            return [line]
+        if self.old_value is None:
+            self.old_value = token.value
+        if token.value == self.value:
+            return [line]
+        self.changed = True
+        matched = re.match(r"^([^:]+:\s*)", line)
+        return [matched.group(1) + self.value + os.linesep]
+
+
+class BumpReleaseEdit(SpecEdit):
+    """Increase the leading number of Release of main package"""
+
+    def __init__(self):
+        super(BumpReleaseEdit, self).__init__()
+        self.release = None  # type: str
+
+    def apply(self, token, line):
+        if (self.changed or token.kind != 'tag' or
+                token.name != 'Release' or token.package is not None):
+            return [line]
+        matched = RpmSpec.LEADING_NUMBER_RE.match(token.value)
+        if not matched:
+            raise ValueError(
+                    "Release %s does not start with a number" % token.value)
+        self.release = "%d%s" % (int(matched.group(1)) + 1, matched.group(2))
+        self.changed = True
+        return [line[:line.index(token.value)] + self.release + os.linesep]
+
+
+class ChangelogEntryEdit(SpecEdit):
+    """Insert changelog entry at the top of %changelog"""
+
+    def __init__(self, entry, when=None):
+        # type (str, Any) -> None
+        """
+        Args:
+            entry (str): changelog entry, which may contain newlines,
+                    or callable that returns the entry
+            when (callable, optional): Defaults to None.
+                    Only insert when when() returns True
+        """
+        super(ChangelogEntryEdit, self).__init__()
+        self.entry = entry
+        self.when = when
+
+    def apply(self, token, line):
+        if (self.changed or token.kind != 'section' or
+                token.name != 'changelog'):
+            return [line]
+        if self.when and not self.when():
+            return [line]
+        self.changed = True
+        if not line.endswith('\n'):
+            # %changelog is the last line
+            line += os.linesep
+        entry = self.entry() if callable(self.entry) else self.entry
+        return [line, entry + os.linesep]
+
+
 class RpmSpec(object):
     """
     RPM Spec
@@ -44,6 +254,10 @@ class RpmSpec(object):
     # We only interested in these tags
     TAGS = ['Name', 'Version', 'Release']
 
+    MACRO_REF_RE = re.compile(
+            r"%(?:\{([!?]{0,2})(\w+)(?::([^}]*))?\}|(\w+))")
+    LEADING_NUMBER_RE = re.compile(r"^(\d+)(.*)$")
+
     def __init__(self, **kwargs):
         # type (Any) -> None
         """
@@ -52,29 +266,36 @@ class RpmSpec(object):
         for v in kwargs:
             setattr(self, v, kwargs.get(v))
         self.content = []
-
-    def parse_spec_tag(self, line):
-        # type (str) -> None
-        """Parse the tag value from line if the line looks like
-        spec tag definition, otherwise do nothing"""
-
-        s = line.rstrip()
-
-        matched = re.match(r"([A-Z][A-Za-z]*):\s*(.+)", s)
-        if matched:
-            if matched.group(1) in RpmSpec.TAGS:
-
-                tag = matched.group(1)
-                if not hasattr(self, tag):
+        # (package, tag): line indexes in content
+        self.tag_index = {}  # type: Dict[Tuple[str, str], List[int]]
+        # [section name, section argument, line index]
+        self.section_index = []  # type: List[list]
+        # macro name: [body, line index]
+        self.macro_index = OrderedDict()  # type: Dict[str, list]
+
+    def _index_token(self, line_idx, token):
+        # type (int, SpecToken) -> None
+        """Add token to indexes"""
+        if token.kind == 'tag':
+            self.tag_index.setdefault(
+                    (token.package, token.name), []).append(line_idx)
+            if token.package is None and token.name in RpmSpec.TAGS:
+                if not hasattr(self, token.name):
                     # Only use the first match
-                    setattr(self, tag, matched .group(2))
-        return s
+                    setattr(self, token.name, token.value)
+        elif token.kind == 'section':
+            self.section_index.append([token.name, token.value, line_idx])
+        elif token.kind == 'macro':
+            self.macro_index[token.name] = [token.value, line_idx]
 
     @classmethod
     def init_from_file(cls, spec_file):
         # type (str) -> None
         """Init from existing spec file
 
+        Spec file is read once, tags, sections and macros are indexed
+        by their line indexes in self.content.
+
         Args:
             spec_file (str): RPM spec file
 
@@ -86,14 +307,172 @@ class RpmSpec(object):
         """
         try:
             with open(spec_file, 'r') as in_file:
-                self = cls()
-                self.content = [
-                        self.parse_spec_tag(l)
-                        for l in in_file.readlines()]
+                return cls.init_from_lines(in_file)
         except OSError as e:
             raise e
+
+    @classmethod
+    def init_from_lines(cls, lines):
+        # type (Iterator[str]) -> RpmSpec
+        """Init from lines of spec, such as content.splitlines()"""
+        self = cls()
+        tokenizer = RpmSpecTokenizer()
+        for line in lines:
+            line = line.rstrip()
+            self._index_token(len(self.content), tokenizer.feed(line))
+            self.content.append(line)
         return self
 
+    def get_tag(self, tag, package=None, expand=False):
+        # type (str, str, bool) -> str
+        """Get the value of first tag definition
+
+        Args:
+            tag (str): tag name like 'Version'
+            package (str, optional): Defaults to None, the main package.
+                    %package argument like 'devel' or '-n other-name'
+            expand (bool, optional): Defaults to False. Expand macros
+
+        Returns:
+            str: tag value, or None if tag is not defined
+        """
+        line_indexes = self.tag_index.get((package, tag))
+        if not line_indexes:
+            return None
+        value = self.content[line_indexes[0]].split(':', 1)[1].strip()
+        return self.expand_macros(value) if expand else value
+
+    def get_sections(self, name):
+        # type (str) -> List[list]
+        """Return [name, argument, line index] of sections with given name
+        """
+        return [sec for sec in self.section_index if sec[0] == name]
+
+    def expand_macros(self, value, extra_macros=None, depth=10):
+        # type (str, Dict[str, str], int) -> str
+        """Expand macros in value
+
+        Macros defined by %define and %global, and name, version and
+        release from the main package tags are supported,
+        as well as the conditional forms %{?macro}, %{!?macro:value}
+        and %{?macro:value}.
+        Unknown macros are left as is.
+
+        Args:
+            value (str): string that contains macros
+            extra_macros (Dict[str, str], optional): Defaults to None.
+                    Additional macros such as {'dist': '.el7'}
+            depth (int, optional): Defaults to 10. Max recursive expansion
+
+        Returns:
+            str: expanded string
+        """
+        macros = {
+                t.lower(): getattr(self, t) for t in RpmSpec.TAGS
+                if hasattr(self, t)}
+        macros.update({k: v[0] for k, v in self.macro_index.items()})
+        if extra_macros:
+            macros.update(extra_macros)
+
+        def _replace(matched):
+            flags, name, alt = matched.group(1, 2, 3)
+            if not name:
+                name = matched.group(4)
+                if name not in macros:
+                    return matched.group(0)
+                return macros[name]
+            defined = name in macros
+            if '!' in flags:
+                return (alt or '') if not defined else ''
+            if '?' in flags:
+                if alt is not None:
+                    return alt if defined else ''
+                return macros.get(name, '')
+            return macros[name] if defined else matched.group(0)
+
+        for _ in range(depth):
+            expanded = RpmSpec.MACRO_REF_RE.sub(_replace, value)
+            if expanded == value:
+                break
+            value = expanded
+        return value
+
+    def _insert_lines(self, line_idx, lines):
+        # type (int, List[str]) -> None
+        """Insert lines before line_idx and shift the indexes after it"""
+        self.content[line_idx:line_idx] = lines
+        shift = len(lines)
+        for indexes in self.tag_index.values():
+            indexes[:] = [i + shift if i >= line_idx else i for i in indexes]
+        for sec in self.section_index:
+            if sec[2] >= line_idx:
+                sec[2] += shift
+        for macro in self.macro_index.values():
+            if macro[1] >= line_idx:
+                macro[1] += shift
+
+    def set_tag(self, tag, value, package=None):
+        # type (str, str, str) -> bool
+        """Set value of a tag, only the indexed lines are touched
+
+        Args:
+            tag (str): tag name like 'Version'
+            value (str): new value
+            package (str, optional): Defaults to None, the main package.
+
+        Returns:
+            bool: False if the tag is not defined
+        """
+        line_indexes = self.tag_index.get((package, tag))
+        if not line_indexes:
+            return False
+        for idx in line_indexes:
+            # Keep the spaces between tag and value
+            matched = re.match(r"^([^:]+:\s*)", self.content[idx])
+            self.content[idx] = matched.group(1) + value
+        if package is None and tag in RpmSpec.TAGS:
+            setattr(self, tag, value)
+        return True
+
+    def bump_release(self):
+        # type () -> str
+        """Increase the leading number of Release, like 1%{?dist}
+        to 2%{?dist}
+
+        Returns:
+            str: new release
+        """
+        matched = RpmSpec.LEADING_NUMBER_RE.match(getattr(self, 'Release'))
+        if not matched:
+            raise ValueError(
+                    "Release %s does not start with a number" % getattr(
+                            self, 'Release'))
+        release = "%d%s" % (int(matched.group(1)) + 1, matched.group(2))
+        self.set_tag('Release', release)
+        return release
+
+    def add_changelog_entry(self, entry):
+        # type (str) -> bool
+        """Insert changelog entry at the top of %changelog
+
+        Args:
+            entry (str): changelog entry, which may contain newlines
+
+        Returns:
+            bool: False if there is no %changelog section
+        """
+        changelogs = self.get_sections('changelog')
+        if not changelogs:
+            return False
+        self._insert_lines(changelogs[0][2] + 1, [entry])
+        return True
+
+    @staticmethod
+    def version_changelog_entry(version):
+        # type (str) -> str
+        """Changelog entry for upgrading to version"""
+        return ChangelogTemplate().format(version)
+
     def update_version(self, version):
         # type (str) -> bool
         """Update to new version
@@ -105,37 +484,83 @@ class RpmSpec(object):
             logging.warning("Spec file is already with version %s", version)
             return False
 
-        setattr(self, 'Version', version)
+        self.set_tag('Version', version)
+        self.add_changelog_entry(RpmSpec.version_changelog_entry(version))
+        return True
 
-        # Update content
-        new_content = []
-        for line in self.content:
-            matched = re.match(r"^Version:(\s*)(.+)", line)
-            if matched:
-                new_content.append(
-                        "Version:{}{}".format(matched.group(1), version))
-                continue
+    @staticmethod
+    def transform_file(spec_file, edits):
+        # type (str, List[SpecEdit]) -> bool
+        """Stream spec_file through edits
 
-            changelog_matched = re.match("^%changelog", line)
-            if changelog_matched:
-                now = datetime.datetime.now().strftime("%a %b %d %Y")
-                changelog_item = (
-                        "* {date} {email} {version}-1\n"
-                        "- Upgrade to upstream version {version}\n".format(
-                                date=now,
-                                email=os.getenv(
-                                        'MAINTAINER_EMAIL',
-                                        'noreply@zanata.org'),
-                                version=version))
-                new_content.append(line)
-                new_content.append(changelog_item)
-                continue
+        The spec is read line by line, so memory does not grow with the
+        file size. Output goes to a temporary file in the same directory,
+        which then atomically replaces spec_file. If nothing is changed,
+        or an error occurs, spec_file is left untouched.
 
-            new_content.append(line)
+        Args:
+            spec_file (str): RPM spec file
+            edits (List[SpecEdit]): edits applied in order,
+                    each edit gets the output lines of the previous one
 
-        setattr(self, 'content', new_content)
+        Raises:
+            OSError e: File error
+
+        Returns:
+            bool: True if spec_file is changed
+        """
+        # Unique per call, as bulk_update may run it from several threads
+        fd, tmp_path = tempfile.mkstemp(
+                suffix='.tmp', prefix=os.path.basename(spec_file) + '.',
+                dir=os.path.dirname(os.path.abspath(spec_file)))
+        tokenizer = RpmSpecTokenizer()
+        try:
+            with open(spec_file, 'r') as in_file:
+                with os.fdopen(fd, 'w') as out_file:
+                    for line in in_file:
+                        token = tokenizer.feed(line.rstrip())
+                        lines = [line]
+                        for edit in edits:
+                            lines = [
+                                    out for l in lines
+                                    for out in edit.apply(token, l)]
+                        out_file.writelines(lines)
+                    out_file.flush()
+                    os.fsync(out_file.fileno())
+            if not any(edit.changed for edit in edits):
+                os.remove(tmp_path)
+                return False
+            os.chmod(tmp_path, os.stat(spec_file).st_mode & 0o7777)
+            os.rename(tmp_path, spec_file)
+        except Exception:
+            logging.error("Failed to transform %s", spec_file)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
         return True
 
+    @staticmethod
+    def stream_update_version(spec_file, version):
+        # type (str, str) -> bool
+        """Update spec_file to new version without loading it whole
+
+        Args:
+            spec_file (str): RPM spec file
+            version (str): new version to be set
+
+        Returns:
+            bool: False if the spec file is already with version
+        """
+        set_version = SetTagEdit('Version', version)
+        changed = RpmSpec.transform_file(spec_file, [
+                set_version,
+                ChangelogEntryEdit(
+                        RpmSpec.version_changelog_entry(version),
+                        when=lambda: set_version.changed)])
+        if not changed:
+            logging.warning("Spec file is already with version %s", version)
+        return changed
+
     def write_to_file(self, spec_file):
         """Write the spec to file
 
@@ -157,7 +582,147 @@ class RpmSpec(object):
         return "\n".join(getattr(self, 'content'))
 
 
-def _parse():
+BulkUpdateResult = namedtuple(
+        'BulkUpdateResult',
+        ['spec_file', 'status', 'version', 'release', 'elapsed', 'error'])
+
+
+def read_bulk_manifest(manifest_file):
+    # type (str) -> List[dict]
+    """Read bulk update manifest
+
+    Manifest is either a JSON list of objects with keys
+    spec_file, version, release (optional) and changelog (optional,
+    list of change lines), or a text file with one spec per line:
+        spec_file version [release [change ...]]
+    Text lines are split like shell, and # starts a comment.
+    release can be a number like '2%{?dist}', or 'bump' to increase it.
+
+    Relative spec_file is relative to the manifest directory.
+
+    Args:
+        manifest_file (str): manifest file, '-' for stdin
+
+    Returns:
+        List[dict]: entries
+    """
+    if manifest_file == '-':
+        text = sys.stdin.read()
+        base_dir = os.getcwd()
+    else:
+        with open(manifest_file, 'r') as in_file:
+            text = in_file.read()
+        base_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    if text.lstrip().startswith('['):
+        entries = [
+                {str(k): v for k, v in entry.items()}
+                for entry in json.loads(text)]
+    else:
+        entries = []
+        for line in text.splitlines():
+            words = shlex.split(line, comments=True)
+            if not words:
+                continue
+            if len(words) < 2:
+                raise CLIException(
+                        "Manifest line needs spec_file and version: " + line)
+            entries.append({
+                    'spec_file': words[0], 'version': words[1],
+                    'release': words[2] if len(words) > 2 else None,
+                    'changelog': words[3:] or None})
+    for entry in entries:
+        entry['spec_file'] = os.path.join(base_dir, entry['spec_file'])
+    return entries
+
+
+def _bulk_update_one(entry, template):
+    # type (dict, ChangelogTemplate) -> BulkUpdateResult
+    """Apply one manifest entry by streaming the spec file"""
+    start = time.time()
+    spec_file = entry['spec_file']
+    version = entry['version']
+    release = entry.get('release')
+    edits = [SetTagEdit('Version', version)]
+    if release == 'bump':
+        bump = BumpReleaseEdit()
+        edits.append(bump)
+        get_release = lambda: bump.release  # noqa: E731
+    elif release:
+        edits.append(SetTagEdit('Release', release))
+        get_release = lambda: release  # noqa: E731
+    else:
+        get_release = lambda: '1'  # noqa: E731
+    edits.append(ChangelogEntryEdit(
+            lambda: template.format(
+                    version, get_release(), entry.get('changelog')),
+            when=lambda: any(e.changed for e in edits[:-1])))
+    try:
+        changed = RpmSpec.transform_file(spec_file, edits)
+    except Exception as e:  # pylint: disable=broad-except
+        logging.error("Failed to update %s: %s", spec_file, e)
+        return BulkUpdateResult(
+                spec_file, 'failed', version, release,
+                time.time() - start, str(e))
+    return BulkUpdateResult(
+            spec_file, 'updated' if changed else 'unchanged',
+            version, get_release() if changed else release,
+            time.time() - start, None)
+
+
+def bulk_update(entries, jobs=4, template=None):
+    # type (List[dict], int, ChangelogTemplate) -> List[BulkUpdateResult]
+    """Update many spec files concurrently
+
+    Args:
+        entries (List[dict]): entries like those from read_bulk_manifest
+        jobs (int, optional): Defaults to 4. Number of worker threads
+        template (ChangelogTemplate, optional): Defaults to
+                ChangelogTemplate(). Shared by all entries
+
+    Returns:
+        List[BulkUpdateResult]: results in the same order as entries
+    """
+    if not entries:
+        return []
+    template = template or ChangelogTemplate()
+    # Entries of the same spec file are applied in order by one worker,
+    # otherwise concurrent read-modify-rename would lose updates
+    groups = OrderedDict()  # type: Dict[str, List[int]]
+    for index, entry in enumerate(entries):
+        groups.setdefault(
+                os.path.realpath(entry['spec_file']), []).append(index)
+    results = [None] * len(entries)  # type: List[BulkUpdateResult]
+
+    def _update_group(indexes):
+        for index in indexes:
+            results[index] = _bulk_update_one(entries[index], template)
+
+    pool = ThreadPool(max(1, min(jobs, len(groups))))
+    try:
+        pool.map(bind(_update_group), list(groups.values()))
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def print_bulk_summary(results):
+    # type (List[BulkUpdateResult]) -> None
+    """Print per file summary"""
+    for result in results:
+        print("%-9s %8.1f ms  %s %s%s" % (
+                result.status, result.elapsed * 1000, result.spec_file,
+                result.version,
+                ": " + result.error if result.error else ''))
+    logging.info(
+            "Bulk update: %d updated, %d unchanged, %d failed",
+            len([r for r in results if r.status == 'updated']),
+            len([r for r in results if r.status == 'unchanged']),
+            len([r for r in results if r.status == 'failed']))
+
+
+def _parser():
     parser = ZanataArgParser(__file__)
     parser.add_sub_command(
             'update-version',
@@ -165,6 +730,9 @@ def _parse():
                     ('--force -f', {
                             'action': 'store_true',
                             'help': 'Force overwritten'}),
+                    ('--stream', {
+                            'action': 'store_true',
+                            'help': 'Edit line by line in constant memory'}),
                     ('spec_file', {
                             'type': str,
                             'help': 'spec file'}),
@@ -172,19 +740,63 @@ def _parse():
                             'type': str,
                             'help': 'new version'})],
             help=RpmSpec.__doc__)
-    return parser.parse_all()
-
-
-def main():
+    parser.add_sub_command(
+            'bulk-update',
+            [
+                    ('-m --manifest', {
+                            'type': str, 'default': None,
+                            'help': 'Manifest file, see read_bulk_manifest'}),
+                    ('-g --glob', {
+                            'type': str, 'default': None,
+                            'help': 'Spec files pattern, used with --version'
+                                    ', like "specs/*.spec"'}),
+                    ('--version', {
+                            'type': str, 'default': None,
+                            'help': 'New version for --glob'}),
+                    ('--release', {
+                            'type': str, 'default': None,
+                            'help': 'New release for --glob, or "bump"'}),
+                    ('-j --jobs', {
+                            'type': int, 'default': 4,
+                            'help': 'Number of concurrent updates'})],
+            help='Update many spec files concurrently')
+    return parser
+
+
+def main(argv=None):
+    # type (List[str]) -> None
     """Run as command line program"""
-    args = _parse()
+    parser = _parser()
+    args = parser.parse_all(argv)
     if args.sub_command == 'help':
         help(sys.modules[__name__])
     else:
         if args.sub_command == 'update-version':
-            instance = RpmSpec.init_from_file(args.spec_file)
-            instance.update_version(args.version)
-            instance.write_to_file(args.spec_file)
+            with parser.profiling():
+                if args.stream:
+                    RpmSpec.stream_update_version(
+                            args.spec_file, args.version)
+                else:
+                    instance = RpmSpec.init_from_file(args.spec_file)
+                    instance.update_version(args.version)
+                    instance.write_to_file(args.spec_file)
+        elif args.sub_command == 'bulk-update':
+            if args.manifest:
+                entries = read_bulk_manifest(args.manifest)
+            elif args.glob and args.version:
+                entries = [
+                        {'spec_file': f, 'version': args.version,
+                         'release': args.release}
+                        for f in sorted(glob.glob(args.glob))]
+            else:
+                raise CLIException(
+                        "Either --manifest or --glob with --version"
+                        " is required")
+            with parser.profiling():
+                results = bulk_update(entries, args.jobs)
+            print_bulk_summary(results)
+            if any(r.status == 'failed' for r in results):
+                sys.exit(1)
         else:
             raise CLIException("No known sub command %s" % args.sub_command)
 
@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""ZanataRpmHeader -- Read RPM package headers
+
+ZanataRpmHeader parses the lead, signature header and header of
+built .rpm files without rpm or docker. Files are memory mapped, so only
+pages of the header region are read, not the payload.
+
+RPM file layout:
+    lead (96 bytes), signature header (padded to 8 bytes),
+    header, payload
+
+Each header is:
+    magic (8e ad e8 01), 4 reserved bytes, index count, data size,
+    index entries (tag, type, offset, count), data
+
+Usage:
+    ZanataRpmHeader.py info rpm_file ...
+    ZanataRpmHeader.py scan top_dir [name [version]]
+"""
+from __future__ import absolute_import, division, print_function
+
+import binascii
+import logging
+import mmap
+import os
+import struct
+import sys
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+    from typing import Dict, Tuple  # noqa: F401 # pylint: disable=W0611
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+LEAD_MAGIC = b'\xed\xab\xee\xdb'
+LEAD_SIZE = 96
+HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+HEADER_INTRO = struct.Struct('>4s4xII')
+INDEX_ENTRY = struct.Struct('>iiii')
+
+# Header data types
+RPM_INT16_TYPE = 3
+RPM_INT32_TYPE = 4
+RPM_INT64_TYPE = 5
+RPM_STRING_TYPE = 6
+RPM_BIN_TYPE = 7
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+# Header tags
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_ARCH = 1022
+RPMTAG_SOURCERPM = 1044
+RPMTAG_PAYLOADDIGEST = 5092
+RPMTAG_PAYLOADDIGESTALGO = 5093
+
+# Signature tags
+RPMSIGTAG_SHA1 = 269
+RPMSIGTAG_SHA256 = 273
+RPMSIGTAG_MD5 = 1004
+
+# Values of RPMTAG_PAYLOADDIGESTALGO
+DIGEST_ALGOS = {
+        1: 'md5', 2: 'sha1', 8: 'sha256', 9: 'sha384', 10: 'sha512'}
+
+
+class RpmHeaderError(Exception):
+    """File is not a valid RPM package"""
+    pass
+
+
+class RpmPackage(namedtuple('RpmPackage', [
+        'path', 'name', 'epoch', 'version', 'release', 'arch',
+        'sourcerpm', 'payload_digest', 'payload_digest_algo',
+        'header_digests', 'size'])):
+    """Package information read from RPM header
+
+    epoch is None if not set. arch is 'src' for source packages.
+    header_digests is a dict from the signature header, like
+    {'sha256': '...', 'sha1': '...', 'md5': '...'}.
+    """
+    __slots__ = ()
+
+    @property
+    def nevra(self):
+        # type () -> str
+        """name-[epoch:]version-release.arch"""
+        return "%s-%s.%s" % (self.name, self.evr, self.arch)
+
+    @property
+    def evr(self):
+        # type () -> str
+        """[epoch:]version-release"""
+        return "%s%s-%s" % (
+                "%d:" % self.epoch if self.epoch is not None else '',
+                self.version, self.release)
+
+
+def _parse_header(buf, offset):
+    # type (mmap.mmap, int) -> Tuple[Dict[int, Any], int]
+    """Parse header at offset
+
+    Returns:
+        Tuple[Dict[int, Any], int]: tag values, and offset after the header
+    """
+    intro = buf[offset:offset + HEADER_INTRO.size]
+    if len(intro) < HEADER_INTRO.size:
+        raise RpmHeaderError("Truncated header at %d" % offset)
+    magic, index_count, data_size = HEADER_INTRO.unpack(intro)
+    if magic != HEADER_MAGIC:
+        raise RpmHeaderError("Bad header magic at %d" % offset)
+    index_start = offset + HEADER_INTRO.size
+    data_start = index_start + index_count * INDEX_ENTRY.size
+    end = data_start + data_size
+    if end > len(buf):
+        raise RpmHeaderError("Truncated header at %d" % offset)
+    data = buf[data_start:end]
+
+    values = {}
+    try:
+        for i in range(index_count):
+            tag, data_type, data_offset, count = INDEX_ENTRY.unpack_from(
+                    buf, index_start + i * INDEX_ENTRY.size)
+            values[tag] = _decode_value(data, data_type, data_offset, count)
+    except (struct.error, ValueError) as e:
+        # Index entry points outside of data
+        raise RpmHeaderError("Corrupt header at %d: %s" % (offset, e))
+    return values, end
+
+
+def _decode_value(data, data_type, offset, count):
+    # type (str, int, int, int) -> Any
+    """Decode a header value, unsupported types are returned as None"""
+    if data_type in (RPM_STRING_TYPE, RPM_STRING_ARRAY_TYPE,
+                     RPM_I18NSTRING_TYPE):
+        strings = []
+        for _ in range(count if data_type != RPM_STRING_TYPE else 1):
+            end = data.index(b'\0', offset)
+            strings.append(data[offset:end])
+            offset = end + 1
+        return strings[0] if data_type == RPM_STRING_TYPE else strings
+    if data_type == RPM_BIN_TYPE:
+        return data[offset:offset + count]
+    int_formats = {
+            RPM_INT16_TYPE: 'h', RPM_INT32_TYPE: 'i', RPM_INT64_TYPE: 'q'}
+    if data_type in int_formats:
+        return list(struct.unpack_from(
+                ">%d%s" % (count, int_formats[data_type]), data, offset))
+    return None
+
+
+RpmHeaders = namedtuple(
+        'RpmHeaders', ['signature', 'header', 'header_start', 'header_end',
+                       'size'])
+
+
+def read_headers(rpm_file):
+    # type (str) -> RpmHeaders
+    """Read all tags of signature header and header of an RPM file
+
+    Args:
+        rpm_file (str): RPM file
+
+    Raises:
+        RpmHeaderError: Not a valid RPM file
+        IOError: File error
+
+    Returns:
+        RpmHeaders: tag values of signature and header,
+                byte range of header, and file size
+    """
+    with open(rpm_file, 'rb') as in_file:
+        size = os.fstat(in_file.fileno()).st_size
+        if size < LEAD_SIZE:
+            raise RpmHeaderError("%s is too small for an RPM" % rpm_file)
+        buf = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if buf[:4] != LEAD_MAGIC:
+                raise RpmHeaderError("%s has no RPM lead" % rpm_file)
+            signature, offset = _parse_header(buf, LEAD_SIZE)
+            # Signature header is padded to 8 bytes
+            offset += (8 - offset % 8) % 8
+            header, end = _parse_header(buf, offset)
+        finally:
+            buf.close()
+    return RpmHeaders(signature, header, offset, end, size)
+
+
+def read_package(rpm_file):
+    # type (str) -> RpmPackage
+    """Read package information from an RPM file
+
+    Args:
+        rpm_file (str): RPM file
+
+    Raises:
+        RpmHeaderError: Not a valid RPM file
+        IOError: File error
+
+    Returns:
+        RpmPackage: package information
+    """
+    signature, header, _, _, size = read_headers(rpm_file)
+
+    header_digests = {}
+    if RPMSIGTAG_SHA256 in signature:
+        header_digests['sha256'] = signature[RPMSIGTAG_SHA256]
+    if RPMSIGTAG_SHA1 in signature:
+        header_digests['sha1'] = signature[RPMSIGTAG_SHA1]
+    if RPMSIGTAG_MD5 in signature:
+        header_digests['md5'] = binascii.hexlify(signature[RPMSIGTAG_MD5])
+
+    payload_digest = header.get(RPMTAG_PAYLOADDIGEST)
+    algo = header.get(RPMTAG_PAYLOADDIGESTALGO)
+    sourcerpm = header.get(RPMTAG_SOURCERPM)
+    epoch = header.get(RPMTAG_EPOCH)
+    return RpmPackage(
+            path=rpm_file,
+            name=header.get(RPMTAG_NAME),
+            epoch=epoch[0] if epoch else None,
+            version=header.get(RPMTAG_VERSION),
+            release=header.get(RPMTAG_RELEASE),
+            # Source packages do not have SOURCERPM
+            arch=header.get(RPMTAG_ARCH) if sourcerpm else 'src',
+            sourcerpm=sourcerpm,
+            payload_digest=payload_digest[0] if payload_digest else None,
+            payload_digest_algo=DIGEST_ALGOS.get(
+                    algo[0] if algo else None),
+            header_digests=header_digests,
+            size=size)
+
+
+class RpmIndex(object):
+    """Index of RPM packages by name"""
+
+    def __init__(self, packages=None):
+        # type (List[RpmPackage]) -> None
+        self.packages = {}  # type: Dict[str, List[RpmPackage]]
+        for pkg in packages or []:
+            self.add(pkg)
+
+    def add(self, pkg):
+        # type (RpmPackage) -> None
+        """Add a package"""
+        self.packages.setdefault(pkg.name, []).append(pkg)
+
+    def find(self, name, version=None, release=None, arch=None):
+        # type (str, str, str, str) -> List[RpmPackage]
+        """Find packages that match all given fields"""
+        return [
+                p for p in self.packages.get(name, [])
+                if (version is None or p.version == version) and
+                (release is None or p.release == release) and
+                (arch is None or p.arch == arch)]
+
+    def has_version(self, name, version, release=None):
+        # type (str, str, str) -> bool
+        """Whether the version of package name exists"""
+        return bool(self.find(name, version, release))
+
+    def versions(self, name):
+        # type (str) -> List[str]
+        """Sorted distinct versions of package name"""
+        return sorted({p.version for p in self.packages.get(name, [])})
+
+    def __len__(self):
+        return sum(len(pkgs) for pkgs in self.packages.values())
+
+    def __iter__(self):
+        for name in sorted(self.packages):
+            for pkg in self.packages[name]:
+                yield pkg
+
+
+def scan_dir(top_dir, jobs=8):
+    # type (str, int) -> RpmIndex
+    """Read all .rpm files under top_dir concurrently
+
+    Invalid RPM files are logged and skipped.
+
+    Args:
+        top_dir (str): directory to scan
+        jobs (int, optional): Defaults to 8. Number of reader threads
+
+    Returns:
+        RpmIndex: index of the packages
+    """
+    rpm_files = [
+            os.path.join(dirpath, f)
+            for dirpath, _, filenames in os.walk(top_dir)
+            for f in filenames if f.endswith('.rpm')]
+    if not rpm_files:
+        return RpmIndex()
+
+    def _read(rpm_file):
+        try:
+            return read_package(rpm_file)
+        except (RpmHeaderError, IOError, ValueError) as e:
+            logging.warning("Skip %s: %s", rpm_file, e)
+            return None
+
+    pool = ThreadPool(max(1, min(jobs, len(rpm_files))))
+    try:
+        packages = pool.map(_read, rpm_files)
+    finally:
+        pool.close()
+        pool.join()
+    return RpmIndex([p for p in packages if p])
+
+
+def main(argv=None):
+    # type (List[str]) -> None
+    """Run as command line program"""
+    from ZanataArgParser import ZanataArgParser  # pylint: disable=E0401
+    parser = ZanataArgParser(__file__, description=__doc__)
+    parser.add_sub_command(
+            'info',
+            [
+                    ('rpm_files', {
+                            'type': str, 'nargs': '+',
+                            'help': 'RPM files'})],
+            help='Show package information')
+    parser.add_sub_command(
+            'scan',
+            [
+                    ('-j --jobs', {
+                            'type': int, 'default': 8,
+                            'help': 'Number of reader threads'}),
+                    ('top_dir', {
+                            'type': str, 'help': 'Directory to scan'}),
+                    ('name', {
+                            'type': str, 'nargs': '?', 'default': None,
+                            'help': 'Only show this package'}),
+                    ('version', {
+                            'type': str, 'nargs': '?', 'default': None,
+                            'help': 'Exit 1 if this version does not exist'})],
+            help='List packages under a directory')
+    args = parser.parse_all(argv)
+    if args.sub_command == 'info':
+        for rpm_file in args.rpm_files:
+            pkg = read_package(rpm_file)
+            print("%s\t%s\t%s:%s\t%s" % (
+                    pkg.nevra, pkg.sourcerpm or '-',
+                    pkg.payload_digest_algo or '-',
+                    pkg.payload_digest or '-', pkg.path))
+    else:
+        with parser.profiling():
+            index = scan_dir(args.top_dir, args.jobs)
+        packages = index.find(args.name, args.version) if args.name else (
+                list(index))
+        for pkg in packages:
+            print("%s\t%s" % (pkg.nevra, pkg.path))
+        if args.version and not packages:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,14 +21,29 @@ Requires:
 """
 from __future__ import absolute_import, division, print_function
 
+import hashlib
+import json
 import logging
 import os
+import Queue
+import shutil
+import subprocess  # nosec
 import sys
+import threading
+import time
+
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
 
 from ZanataArgParser import ZanataArgParser  # pylint: disable=E0401
-from ZanataFunctions import GitHelper, SshHost, WORK_ROOT
-from ZanataFunctions import mkdir_p, working_directory
-from ZanataFunctions import exec_check_call, exec_check_output
+from ZanataDocker import DockerClient, DockerError, ImagePool
+from ZanataRpm import RpmSpec
+from ZanataRepodata import published_nevras, is_published
+from ZanataRepodata import find_repo_dirs, RepodataUpdater
+from ZanataTimings import TimingStore, format_seconds, predict, timed
+from ZanataTrace import bind, span
+from ZanataFunctions import CLIException, GitHelper, SshHost, WORK_ROOT
+from ZanataFunctions import PrefixLoggerAdapter, UrlHelper, mkdir_p
 
 try:
     # We need to import 'List' and 'Any' for mypy to work
@@ -36,9 +51,323 @@ try:
 except ImportError:
     sys.stderr.write("python typing module is not installed" + os.linesep)
 
-PROFILE = 0
-
 LOCAL_DIR = os.path.join(WORK_ROOT, 'dnf', 'zanata')
+BUILDER_IMAGE = 'docker.io/zanata/centos-repo-builder'
+PLATFORM_GIT_URL = 'https://github.com/zanata/zanata-platform.git'
+# Source tarballs shared by all builds and runs
+TARBALL_CACHE_DIR = os.path.join(
+        os.getenv('XDG_CACHE_HOME', os.path.join(
+                os.path.expanduser('~'), '.cache')),
+        'zanata-scripts', 'tarballs')
+
+
+def spec_sources(spec, version):
+    # type (RpmSpec, str) -> List[Tuple[str, str]]
+    """Return [file name, source] of the Source tags of the main package,
+    expanded with the given version"""
+    result = []
+    for (package, tag), _ in sorted(spec.tag_index.items()):
+        if package is not None or not tag.startswith('Source'):
+            continue
+        source = spec.expand_macros(spec.get_tag(tag), {'version': version})
+        result.append((os.path.basename(source), source))
+    return result
+
+
+def prefetch_sources(sources, tarball_dir, jobs=4):
+    # type (List[Tuple[str, str]], str, int) -> List[str]
+    """Download [file name, URL] sources that are not in tarball_dir yet
+
+    Downloads run concurrently. Each file is downloaded to a temporary
+    name and renamed, so a partial download is never used.
+
+    Returns:
+        List[str]: names of downloaded files
+    """
+    missing = [
+            (name, url) for name, url in sources
+            if '://' in url and
+            not os.path.isfile(os.path.join(tarball_dir, name))]
+    if not missing:
+        return []
+    mkdir_p(tarball_dir)
+
+    def _download(source):
+        name, url = source
+        tmp_name = "%s.%d.%d.tmp" % (
+                name, os.getpid(), threading.current_thread().ident)
+        tmp_path = os.path.join(tarball_dir, tmp_name)
+        try:
+            UrlHelper.download_file(url, tmp_name, tarball_dir)
+            os.rename(tmp_path, os.path.join(tarball_dir, name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name
+
+    pool = ThreadPool(max(1, min(jobs, len(missing))))
+    try:
+        return pool.map(bind(_download), missing)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def sha256_file(path):
+    # type (str) -> str
+    """Hex SHA-256 of the file content"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as in_file:
+        for chunk in iter(lambda: in_file.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+PlanTarball = namedtuple('PlanTarball', ['name', 'url', 'sha256'])
+PlanImage = namedtuple('PlanImage', ['dist_ver', 'name', 'image_id'])
+
+
+class ReleasePlan(namedtuple('ReleasePlan', [
+        'spec_file', 'version', 'dist_versions', 'tarball_dir',
+        'tarballs', 'images'])):
+    """Inputs of a release, resolved once and shared by all stages
+
+    Fields:
+        spec_file (str): RPM spec file, relative to local_dir
+        version (str): resolved package version
+        dist_versions (Tuple[str]): target distribution versions
+        tarball_dir (str): shared tarball directory
+        tarballs (Tuple[PlanTarball]): sha256 is None if not downloaded
+        images (Tuple[PlanImage]): image_id is None if not pulled
+    """
+    __slots__ = ()
+
+    def tasks(self):
+        # type () -> OrderedDict
+        """Task name: names of the tasks it depends on"""
+        result = OrderedDict()
+        result['fetch-tarballs'] = ()
+        for dist in self.dist_versions:
+            result["pull-el%s" % dist] = ()
+            result["image-el%s" % dist] = ()
+            result["build-el%s" % dist] = (
+                    "pull-el%s" % dist, "image-el%s" % dist, 'fetch-tarballs')
+            result["push-el%s" % dist] = ("build-el%s" % dist,)
+        result['push-base'] = tuple(
+                "push-el%s" % dist for dist in self.dist_versions)
+        return result
+
+    def task_inputs(self):
+        # type () -> Dict[str, Any]
+        """Task name: its inputs resolved in this plan,
+        i.e. tarball checksums and builder image IDs"""
+        result = {'fetch-tarballs': dict(
+                (t.name, t.sha256) for t in self.tarballs)}
+        for image in self.images:
+            result["image-el%s" % image.dist_ver] = image.image_id
+        return result
+
+    def __str__(self):
+        lines = [
+                "Spec file: %s" % self.spec_file,
+                "Version: %s" % self.version,
+                "Dists: %s" % ', '.join(self.dist_versions),
+                "Tarball dir: %s" % self.tarball_dir,
+                "Tarballs:"]
+        lines += ["    %s %s %s" % (
+                t.name, t.url, t.sha256 or '(not downloaded)')
+                  for t in self.tarballs]
+        lines.append("Images:")
+        lines += ["    el%s %s %s" % (
+                i.dist_ver, i.name, i.image_id or '(not pulled)')
+                  for i in self.images]
+        lines.append("Tasks:")
+        lines += ["    %s%s" % (name, (
+                " <- " + ', '.join(deps)) if deps else '')
+                  for name, deps in self.tasks().items()]
+        return '\n'.join(lines)
+
+
+def run_tasks(tasks, workers, keep_going=False, on_abort=None):
+    # type (OrderedDict, int, bool, Any) -> Dict[str, Exception]
+    """Run tasks as soon as the tasks they depend on have succeeded
+
+    Args:
+        tasks (OrderedDict): name: (names of dependencies, callable)
+        workers (int): Number of concurrent tasks
+        keep_going (bool, optional): Defaults to False.
+                Keep running independent tasks when a task fails.
+                Otherwise no task is started after the first failure.
+        on_abort (callable, optional): Defaults to None.
+                Called once at the first failure, if not keep_going.
+
+    Returns:
+        Dict[str, Exception]: failed task name: exception.
+                Tasks not run because of a failure are not included.
+    """
+    done = Queue.Queue()
+    pending = OrderedDict(tasks)
+    succeeded = set()
+    errors = OrderedDict()
+    running = 0
+    pool = ThreadPool(max(1, workers))
+
+    def _run(name, func):
+        try:
+            with span(name):
+                func()
+            done.put((name, None))
+        except Exception as e:  # pylint: disable=broad-except
+            done.put((name, e))
+
+    try:
+        while True:
+            if not errors or keep_going:
+                for name, (deps, func) in list(pending.items()):
+                    if all(d in succeeded for d in deps):
+                        del pending[name]
+                        running += 1
+                        pool.apply_async(bind(_run), (name, func))
+            if not running:
+                break
+            name, error = done.get()
+            running -= 1
+            if error is None:
+                succeeded.add(name)
+                continue
+            logging.error("Task %s failed: %s", name, error)
+            if not errors and not keep_going and on_abort:
+                on_abort()
+            errors[name] = error
+    finally:
+        pool.close()
+        pool.join()
+    return errors
+
+
+class RunCheckpoint(object):
+    """Completed tasks of an 'all' run, keyed by its arguments
+
+    Each task is recorded with the size, mtime and SHA-256 of its output
+    files, and with the inputs it resolved, like tarball checksums
+    and builder image IDs. A recorded task is still complete if all its
+    outputs are unchanged, its inputs match the ones in the current
+    plan, and all the tasks it depends on are complete.
+    """
+
+    def __init__(self, key, local_dir=LOCAL_DIR, checkpoint_dir=None):
+        # type (str, str, str) -> None
+        """
+        Args:
+            key (str): from inputs_key()
+            local_dir (str, optional): Defaults to LOCAL_DIR.
+                    Output paths are relative to it.
+            checkpoint_dir (str, optional): Defaults to
+                    WORK_ROOT/checkpoints
+        """
+        self.local_dir = local_dir
+        self.checkpoint_file = os.path.join(
+                checkpoint_dir or os.path.join(WORK_ROOT, 'checkpoints'),
+                "rpm-repo-%s.json" % key)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def inputs_key(spec_file, version, dist_versions, tarball_dir):
+        # type (str, str, List[str], str) -> str
+        """Digest of run arguments, known before the plan is resolved"""
+        sha = hashlib.sha256()
+        sha.update(json.dumps(
+                [spec_file, version, list(dist_versions), tarball_dir]))
+        return sha.hexdigest()[:16]
+
+    def _load(self):
+        # type () -> dict
+        try:
+            with open(self.checkpoint_file, 'r') as in_file:
+                return json.load(in_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def clear(self):
+        # type () -> None
+        """Forget all completed tasks"""
+        with self._lock:
+            if os.path.exists(self.checkpoint_file):
+                os.remove(self.checkpoint_file)
+
+    def complete(self, task, outputs=None, inputs=None):
+        # type (str, List[str], Any) -> None
+        """Record task as complete
+
+        Args:
+            task (str): task name
+            outputs (List[str], optional): Defaults to None.
+                    Output files, relative to local_dir
+            inputs (Any, optional): Defaults to None.
+                    JSON serializable inputs resolved by the task
+        """
+        manifest = []
+        for path in outputs or []:
+            full_path = os.path.join(self.local_dir, path)
+            st = os.stat(full_path)
+            manifest.append([
+                    path, st.st_size, int(st.st_mtime),
+                    sha256_file(full_path)])
+        with self._lock:
+            tasks = self._load()
+            tasks[task] = {
+                    'completed': time.time(), 'outputs': manifest,
+                    'inputs': inputs}
+            mkdir_p(os.path.dirname(self.checkpoint_file))
+            tmp_path = "%s.%d.tmp" % (self.checkpoint_file, os.getpid())
+            with open(tmp_path, 'w') as out_file:
+                json.dump(tasks, out_file)
+            os.rename(tmp_path, self.checkpoint_file)
+
+    def _outputs_valid(self, outputs):
+        # type (List[List]) -> bool
+        """Whether outputs are unchanged.
+
+        Checksum is only computed when the mtime differs."""
+        for path, size, mtime, checksum in outputs:
+            full_path = os.path.join(self.local_dir, path)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                return False
+            if st.st_size != size:
+                return False
+            if (int(st.st_mtime) != mtime and
+                    sha256_file(full_path) != checksum):
+                return False
+        return True
+
+    def completed(self, tasks, inputs=None):
+        # type (OrderedDict, Dict[str, Any]) -> Set[str]
+        """Names of complete tasks
+
+        Args:
+            tasks (OrderedDict): name: names of dependencies,
+                    dependencies come first
+            inputs (Dict[str, Any], optional): Defaults to None.
+                    name: current inputs, from ReleasePlan.task_inputs()
+        """
+        recorded = self._load()
+        result = set()
+        for name, deps in tasks.items():
+            if name not in recorded:
+                continue
+            if not all(d in result for d in deps):
+                continue
+            if not self._outputs_valid(recorded[name]['outputs']):
+                logging.info("Outputs of %s are changed, redo it", name)
+                continue
+            if (inputs and name in inputs and
+                    recorded[name].get('inputs') != inputs[name]):
+                logging.info("Inputs of %s are changed, redo it", name)
+                continue
+            result.add(name)
+        return result
 
 
 class RpmRepoHost(SshHost):
@@ -61,6 +390,49 @@ class RpmRepoHost(SshHost):
         setattr(args, 'host', RpmRepoHost.FEDORAPEOPLE_HOST)
         return super(RpmRepoHost, cls).init_from_parsed_args(args)
 
+    # rsync patterns of per-dist subtrees, and of build work directories
+    DIST_EXCLUDE = '/epel-*'
+    WORK_DIR_EXCLUDE = '/.el*-build'
+
+    @staticmethod
+    def _dist_versions(dist_versions):
+        # type (Any) -> List[str]
+        if not dist_versions:
+            return ["7", "6"]
+        elif isinstance(dist_versions, str):
+            return dist_versions.split(',')
+        return dist_versions
+
+    @staticmethod
+    def _resolve_version(version):
+        # type (str) -> str
+        if version == 'auto':
+            return GitHelper.detect_remote_repo_latest_version(
+                    'platform-', PLATFORM_GIT_URL)
+        return version
+
+    @staticmethod
+    def _release_images(images):
+        # type (ImagePool) -> None
+        """Stop pulling, then remove stale builder images"""
+        images.close()
+        try:
+            images.gc(BUILDER_IMAGE)
+        except (DockerError, IOError, OSError) as e:
+            logging.warning("Failed to remove stale images: %s", e)
+
+    @staticmethod
+    def _protect_build_outputs(dest_dir):
+        # type (str) -> List[str]
+        """rsync options that keep outputs in build cache under dest_dir
+        from --delete, so a re-run after a failed push reuses them"""
+        options = []
+        for path in BuildCache().output_paths():
+            rel_path = os.path.relpath(path, dest_dir)
+            if not rel_path.startswith(os.pardir + os.sep):
+                options += ['--filter', 'protect /' + rel_path]
+        return options
+
     def pull(self):
         # type (str) -> None
         """Pull from remote directory
@@ -68,28 +440,165 @@ class RpmRepoHost(SshHost):
         mkdir_p(self.local_dir)
         src_dir = os.path.join(self.remote_host_dir, '')
         logging.info("Pull from %s to %s", src_dir, self.local_dir)
-        self.rsync(src_dir, self.local_dir, ['--delete'])
+        with timed('pull'):
+            self.rsync(src_dir, self.local_dir, [
+                    '--delete'] + RpmRepoHost._protect_build_outputs(
+                            self.local_dir))
+
+    def pull_base(self):
+        # type () -> None
+        """Pull remote directory except the per-dist subtrees"""
+        mkdir_p(self.local_dir)
+        src_dir = os.path.join(self.remote_host_dir, '')
+        logging.info("Pull base from %s to %s", src_dir, self.local_dir)
+        with timed('pull', 'base'):
+            self.rsync(src_dir, self.local_dir, [
+                    '--delete', '--exclude', RpmRepoHost.DIST_EXCLUDE,
+                    '--exclude', RpmRepoHost.WORK_DIR_EXCLUDE])
+
+    def pull_dist(self, dist_ver):
+        # type (str) -> None
+        """Pull the subtree epel-<dist_ver> from remote directory
 
-    def update_epel_repos(
+        A subtree that is not in remote directory yet is skipped.
+        """
+        sub_dir = "epel-%s" % dist_ver
+        src_dir = os.path.join(self.remote_host_dir, sub_dir, '')
+        dest_dir = os.path.join(self.local_dir, sub_dir)
+        mkdir_p(dest_dir)
+        logging.info("Pull from %s to %s", src_dir, dest_dir)
+        try:
+            with timed('pull', "el%s" % dist_ver):
+                self.rsync(src_dir, dest_dir, [
+                        '--delete'] + RpmRepoHost._protect_build_outputs(
+                                dest_dir))
+        except subprocess.CalledProcessError as e:
+            logging.warning("Skip pulling %s: %s", src_dir, e)
+
+    def push_dist(self, dist_ver):
+        # type (str) -> None
+        """Push the subtree epel-<dist_ver> to remote directory"""
+        sub_dir = "epel-%s" % dist_ver
+        src_dir = os.path.join(self.local_dir, sub_dir, '')
+        dest_dir = os.path.join(self.remote_host_dir, sub_dir)
+        logging.info("Push from %s to %s", src_dir, dest_dir)
+        with timed('push', "el%s" % dist_ver):
+            self.rsync(src_dir, dest_dir, ['--delete'])
+
+    def push_base(self):
+        # type () -> None
+        """Push local files except the per-dist subtrees"""
+        src_dir = os.path.join(self.local_dir, '')
+        logging.info("Push base from %s to %s", src_dir, self.remote_host_dir)
+        with timed('push', 'base'):
+            self.rsync(src_dir, self.remote_host_dir, [
+                    '--delete', '--exclude', RpmRepoHost.DIST_EXCLUDE,
+                    '--exclude', RpmRepoHost.WORK_DIR_EXCLUDE])
+
+    def update_epel_repos(  # pylint: disable=too-many-arguments
             self, spec_file, version='auto',
-            tarball_dir=None, dist_versions=None):
+            tarball_dir=None, dist_versions=None, jobs=1, keep_going=False):
         """Update all EPEL repositories
 
+        With jobs > 1, distributions are built concurrently.
+        Each build then works on its own copy of spec_file,
+        its output lines are prefixed with the distribution like [el7],
+        and the updated spec_file is copied back from a build that ran
+        when all builds succeed.
+
         Args:
             spec_file (str): RPM spec file
-            tarball_dir (str): Default to None.
-                    Tarballs are downloaded to this directory.
-                    If not specified, it downloads inside container,
-                    which you cannot reused.
+            tarball_dir (str): Default to TARBALL_CACHE_DIR.
+                    Source tarballs are downloaded to this directory
+                    on the host once, then it is mounted read-only
+                    into every build container.
+            dist_versions (List[str]): Defaults to ["7", "6"].
+                    List of distrion versions to update,
+                    or comma separated string like "7,6".
+            jobs (int): Defaults to 1. Number of concurrent builds
+            keep_going (bool): Defaults to False.
+                    Continue other builds when one fails, and report all
+                    failures at the end. Otherwise running builds are
+                    stopped at the first failure.
+
+        Raises:
+            CLIException: When any build fails
+        """
+        dist_versions = RpmRepoHost._dist_versions(dist_versions)
+        # Resolve once rather than in every build
+        version = RpmRepoHost._resolve_version(version)
+
+        jobs = max(1, min(int(jobs), len(dist_versions)))
+        images = ImagePool()
+        elrepos = [
+                ElRepo(dist, self.local_dir, concurrent=jobs > 1,
+                       images=images)
+                for dist in dist_versions]
+        # Pull builder images in background while sources are downloaded
+        images.prefetch([elrepo.image for elrepo in elrepos])
+        tarball_dir = tarball_dir or TARBALL_CACHE_DIR
+        spec = RpmSpec.init_from_file(os.path.join(self.local_dir, spec_file))
+        prefetch_sources(spec_sources(spec, version), tarball_dir)
+        abort = threading.Event()
+        errors = []
+        errors_lock = threading.Lock()
+
+        def _build(elrepo):
+            if abort.is_set():
+                elrepo.logger.warning("Cancelled")
+                return False
+            elrepo.logger.info("Update EL%s repo", elrepo.dist_ver)
+            try:
+                return elrepo.build_and_update(
+                        spec_file, version, tarball_dir,
+                        tarballs_readonly=True)
+            except Exception as e:  # pylint: disable=broad-except
+                elrepo.logger.error("Failed: %s", e)
+                with errors_lock:
+                    errors.append((elrepo, e))
+                if not keep_going and not abort.is_set():
+                    abort.set()
+                    if elrepo.concurrent:
+                        for other in elrepos:
+                            if other is not elrepo:
+                                other.cancel()
+                return False
+
+        try:
+            if jobs == 1:
+                built = [_build(elrepo) for elrepo in elrepos]
+            else:
+                pool = ThreadPool(jobs)
+                try:
+                    built = pool.map(bind(_build), elrepos)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            RpmRepoHost._release_images(images)
+
+        if errors:
+            if jobs == 1 and len(errors) == 1 and not keep_going:
+                # Same as sequential behavior
+                raise errors[0][1]
+            raise CLIException("Failed to update %s" % ', '.join(
+                    "EL%s (%s)" % (r.dist_ver, e) for r, e in errors))
+        built_elrepos = [e for e, b in zip(elrepos, built) if b]
+        if jobs > 1 and built_elrepos:
+            built_elrepos[0].copy_back_spec(spec_file)
+
+    def update_repodata(self, dist_versions=None):
+        """Update repodata of local EPEL repositories incrementally
+
+        Only added, removed or changed packages are read,
+        instead of regenerating metadata of the whole repository.
+
+        Args:
             dist_versions (List[str]): Defaults to ["7", "6"].
                     List of distrion versions to update.
         """
-        if not dist_versions:
-            dist_versions = ["7", "6"]
-        for dist in dist_versions:
-            logging.info("Update EL%s repo", dist)
-            elrepo = ElRepo(dist, self.local_dir)
-            elrepo.build_and_update(spec_file, version, tarball_dir)
+        for dist in RpmRepoHost._dist_versions(dist_versions):
+            ElRepo(dist, self.local_dir).update_repodata()
 
     def push(self):
         # type (str) -> None
@@ -97,10 +606,208 @@ class RpmRepoHost(SshHost):
         """
         src_dir = os.path.join(self.local_dir, '')
         logging.info("Push from %s to %s", src_dir, self.remote_host_dir)
-        self.rsync(src_dir, self.remote_host_dir, ['--delete'])
+        with timed('push'):
+            self.rsync(src_dir, self.remote_host_dir, [
+                    '--delete', '--exclude', RpmRepoHost.WORK_DIR_EXCLUDE])
+
+    def plan_release(
+            self, spec_file, version='auto', dist_versions=None,
+            tarball_dir=None, images=None):
+        # type (str, str, Any, str, ImagePool) -> ReleasePlan
+        """Resolve the release inputs once
 
-    def all(self, spec_file, version='auto'):
-        """Run the full cycle
+        Nothing is downloaded or pulled, tarball checksums and image IDs
+        are only filled in when they are already local.
+
+        Args:
+            spec_file (str): RPM spec file, relative to local_dir
+            version (str, optional): Defaults to 'auto'.
+            dist_versions (List[str]): Defaults to ["7", "6"].
+            tarball_dir (str, optional): Defaults to TARBALL_CACHE_DIR.
+                    Shared directory that tarballs are downloaded to.
+            images (ImagePool, optional): Defaults to ImagePool().
+        """
+        version = RpmRepoHost._resolve_version(version)
+        dist_versions = tuple(RpmRepoHost._dist_versions(dist_versions))
+        tarball_dir = tarball_dir or TARBALL_CACHE_DIR
+        images = images or ImagePool()
+        spec = RpmSpec.init_from_file(os.path.join(self.local_dir, spec_file))
+        tarballs = []
+        for name, url in spec_sources(spec, version):
+            path = os.path.join(tarball_dir, name)
+            tarballs.append(PlanTarball(
+                    name, url,
+                    sha256_file(path) if os.path.isfile(path) else None))
+        plan_images = []
+        for dist in dist_versions:
+            name = "%s:%s" % (BUILDER_IMAGE, dist)
+            try:
+                image = images.client.image_inspect(name)
+            except (DockerError, IOError, OSError):
+                image = None
+            plan_images.append(PlanImage(
+                    dist, name, str(image['Id']) if image else None))
+        return ReleasePlan(
+                spec_file, version, dist_versions, tarball_dir,
+                tuple(tarballs), tuple(plan_images))
+
+    @staticmethod
+    def fetch_tarballs(plan):
+        # type (ReleasePlan) -> None
+        """Download the missing tarballs of plan to its tarball_dir once,
+        instead of in each build container"""
+        with timed('fetch', 'tarballs'):
+            prefetch_sources(
+                    [(t.name, t.url) for t in plan.tarballs],
+                    plan.tarball_dir)
+
+    @staticmethod
+    def _pin_image(images, elrepo):
+        # type (ImagePool, ElRepo) -> str
+        with timed('image', "el%s" % elrepo.dist_ver):
+            return images.pin(elrepo.image)
+
+    @staticmethod
+    def format_prediction(plan, store=None):
+        # type (ReleasePlan, TimingStore) -> str
+        """Predicted duration of plan tasks from the timing history
+
+        Task names are '<stage>-<target>', like the timing records.
+        """
+        total, estimates = predict(
+                plan.tasks(), lambda name: tuple(name.split('-', 1)),
+                (store or TimingStore()).read())
+        lines = ["Predicted duration: %s" % format_seconds(total)]
+        lines += ["    %-16s %s" % (name, format_seconds(seconds))
+                  for name, seconds in estimates.items()]
+        return '\n'.join(lines)
+
+    def run_plan(  # pylint: disable=too-many-arguments,too-many-locals
+            self, plan, jobs=1, keep_going=False, images=None,
+            checkpoint=None):
+        # type (ReleasePlan, int, bool, ImagePool, RunCheckpoint) -> None
+        """Run the tasks of plan, each as soon as its dependencies are done
+
+        Each distribution is pulled, built, and pushed as soon as
+        its build finishes, while other distributions are still
+        being pulled or built. The base directory, with the updated
+        spec file, is pushed last.
+
+        Args:
+            plan (ReleasePlan): resolved release inputs
+            jobs (int): Defaults to 1. Number of concurrent builds.
+                    Other tasks overlap with builds regardless.
+            keep_going (bool): Defaults to False.
+                    Continue other distributions when one fails.
+            images (ImagePool, optional): Defaults to ImagePool().
+            checkpoint (RunCheckpoint, optional): Defaults to None.
+                    Tasks complete in it are skipped,
+                    and tasks done are recorded in it.
+
+        Raises:
+            CLIException: When any task fails
+        """
+        images = images or ImagePool()
+        elrepos = OrderedDict(
+                (dist, ElRepo(dist, self.local_dir, concurrent=True,
+                              images=images))
+                for dist in plan.dist_versions)
+        build_slots = threading.Semaphore(max(1, int(jobs)))
+        # Distributions whose build ran, so their private spec is current
+        built_dists = set()
+
+        def _build(elrepo):
+            with build_slots:
+                rpms_before = elrepo.snapshot_rpms()
+                built = elrepo.build_and_update(
+                        plan.spec_file, plan.version, plan.tarball_dir,
+                        tarballs_readonly=True)
+            outputs = [
+                    path for path, stat in elrepo.snapshot_rpms().items()
+                    if rpms_before.get(path) != stat]
+            if built:
+                built_dists.add(elrepo.dist_ver)
+                outputs.append(os.path.join(
+                        self.local_dir, elrepo.work_dir,
+                        os.path.basename(plan.spec_file)))
+            return [os.path.relpath(p, self.local_dir) for p in outputs]
+
+        def _push_base():
+            # Builds completed in a previous run have their private spec
+            # validated by checkpoint
+            for dist, elrepo in elrepos.items():
+                if dist in built_dists or "build-el%s" % dist in completed:
+                    elrepo.copy_back_spec(plan.spec_file)
+                    break
+            self.push_base()
+
+        actions = {
+                'fetch-tarballs': lambda: RpmRepoHost.fetch_tarballs(plan),
+                'push-base': _push_base}
+        for dist, elrepo in elrepos.items():
+            actions["pull-el%s" % dist] = (
+                    lambda d=dist: self.pull_dist(d))
+            actions["image-el%s" % dist] = (
+                    lambda e=elrepo: RpmRepoHost._pin_image(images, e))
+            actions["build-el%s" % dist] = lambda e=elrepo: _build(e)
+            actions["push-el%s" % dist] = (
+                    lambda d=dist: self.push_dist(d))
+
+        def _abort():
+            for elrepo in elrepos.values():
+                elrepo.cancel()
+
+        def _resolved_inputs(name, result):
+            # Same as plan.task_inputs() of a plan resolved after the task
+            if name == 'fetch-tarballs':
+                return dict(
+                        (t.name, sha256_file(os.path.join(
+                                plan.tarball_dir, t.name)))
+                        for t in plan.tarballs)
+            if name.startswith('image-'):
+                return result
+            return None
+
+        def _checkpointed(name):
+            def _run():
+                result = actions[name]()
+                if checkpoint:
+                    checkpoint.complete(
+                            name, result if isinstance(result, list)
+                            else None, _resolved_inputs(name, result))
+            return _run
+
+        plan_tasks = plan.tasks()
+        completed = checkpoint.completed(
+                plan_tasks, plan.task_inputs()) if checkpoint else set()
+        for name in completed:
+            logging.info("Skip %s, completed in previous run", name)
+        tasks = OrderedDict(
+                (name, (tuple(d for d in deps if d not in completed),
+                        _checkpointed(name)))
+                for name, deps in plan_tasks.items()
+                if name not in completed)
+        try:
+            errors = run_tasks(tasks, 3 * len(elrepos) + 1, keep_going, _abort)
+        finally:
+            RpmRepoHost._release_images(images)
+        if errors:
+            raise CLIException("Failed to update: %s" % ', '.join(
+                    "%s (%s)" % (name, e) for name, e in errors.items()))
+
+    def all(  # pylint: disable=too-many-arguments,too-many-locals
+            self, spec_file, version='auto', dist_versions=None, jobs=1,
+            keep_going=False, tarball_dir=None, plan=False, resume=False):
+        """Run the full cycle as a pipeline
+
+        The version is resolved while the base directory (everything
+        but the epel-<N> subtrees) is pulled. Then the release inputs
+        are resolved into a plan, which is run by run_plan().
+
+        Completed tasks are checkpointed under WORK_ROOT/checkpoints,
+        keyed by the arguments, so a failed run can be resumed.
+        Tasks whose tarball checksums or builder image IDs differ
+        from the resolved plan are run again.
 
         Args:
             spec_file (str): RPM spec file
@@ -108,10 +815,208 @@ class RpmRepoHost(SshHost):
                     packages.
             dist_versions (List[str]): Defaults to ["7", "6"].
                     List of distrion versions to update.
+            jobs (int): Defaults to 1. Number of concurrent builds.
+                    Pulls and pushes overlap with builds regardless.
+            keep_going (bool): Defaults to False.
+                    Continue other distributions when one fails.
+            tarball_dir (str): Default to TARBALL_CACHE_DIR.
+                    Tarballs are downloaded to this directory once,
+                    while subtrees are pulled.
+            plan (bool): Defaults to False.
+                    Only print the plan from the local files,
+                    without pulling, building or pushing.
+            resume (bool): Defaults to False.
+                    Skip the tasks completed by a previous run
+                    with the same inputs, if their outputs are unchanged.
+
+        Raises:
+            CLIException: When any distribution fails
+        """
+        images = ImagePool()
+        if plan:
+            release_plan = self.plan_release(
+                    spec_file, version, dist_versions, tarball_dir, images)
+            print(release_plan)
+            print(RpmRepoHost.format_prediction(release_plan))
+            return
+        if resume:
+            # Inputs key needs the version before the pull
+            version = RpmRepoHost._resolve_version(version)
+        pool = ThreadPool(1)
+        try:
+            version_result = pool.apply_async(
+                    bind(RpmRepoHost._resolve_version), (version,))
+            checkpoint = None
+            if resume:
+                checkpoint = self._checkpoint(
+                        spec_file, version, dist_versions, tarball_dir)
+            if checkpoint and checkpoint.completed({'pull-base': ()}):
+                logging.info("Skip pull-base, completed in previous run")
+            else:
+                self.pull_base()
+            version = version_result.get()
+        finally:
+            pool.close()
+            pool.join()
+        if not checkpoint:
+            checkpoint = self._checkpoint(
+                    spec_file, version, dist_versions, tarball_dir)
+            checkpoint.clear()
+        checkpoint.complete('pull-base')
+        release_plan = self.plan_release(
+                spec_file, version, dist_versions, tarball_dir, images)
+        # Pull builder images in background while subtrees are pulled
+        images.prefetch([image.name for image in release_plan.images])
+        self.run_plan(release_plan, jobs, keep_going, images, checkpoint)
+
+    def _checkpoint(self, spec_file, version, dist_versions, tarball_dir):
+        # type (str, str, Any, str) -> RunCheckpoint
+        return RunCheckpoint(RunCheckpoint.inputs_key(
+                spec_file, version, RpmRepoHost._dist_versions(dist_versions),
+                tarball_dir or TARBALL_CACHE_DIR), self.local_dir)
+
+
+class BuildCache(object):
+    """Build outputs keyed by a digest of the build inputs
+
+    An entry is a hit only when all its output files are still present
+    with the recorded size and mtime. Entries older than max_age_days,
+    and the least recently used entries beyond max_entries, are evicted.
+    """
+    DEFAULT_MAX_AGE_DAYS = 30
+    DEFAULT_MAX_ENTRIES = 100
+
+    # Serialize access among concurrent builds
+    _lock = threading.Lock()
+
+    def __init__(self, cache_file=None, max_age_days=None, max_entries=None):
+        # type (str, float, int) -> None
+        """
+        Args:
+            cache_file (str, optional): Defaults to
+                    $XDG_CACHE_HOME/zanata-scripts/build-cache.json
+            max_age_days (float, optional): Defaults to env
+                    ZANATA_BUILD_CACHE_MAX_AGE_DAYS or DEFAULT_MAX_AGE_DAYS
+            max_entries (int, optional): Defaults to env
+                    ZANATA_BUILD_CACHE_MAX_ENTRIES or DEFAULT_MAX_ENTRIES
+        """
+        self.cache_file = cache_file or os.path.join(
+                os.getenv('XDG_CACHE_HOME', os.path.join(
+                        os.path.expanduser('~'), '.cache')),
+                'zanata-scripts', 'build-cache.json')
+        self.max_age = 86400 * float(max_age_days or os.getenv(
+                'ZANATA_BUILD_CACHE_MAX_AGE_DAYS',
+                BuildCache.DEFAULT_MAX_AGE_DAYS))
+        self.max_entries = int(max_entries or os.getenv(
+                'ZANATA_BUILD_CACHE_MAX_ENTRIES',
+                BuildCache.DEFAULT_MAX_ENTRIES))
+
+    @staticmethod
+    def input_key(spec_content, version, tarball_checksums, image_digest):
+        # type (str, str, List[List[str]], str) -> str
+        """Digest of build inputs
+
+        Args:
+            spec_content (str): spec file content, before or after
+                    the build updates it
+            version (str): requested version
+            tarball_checksums (List[List[str]]): [file name, sha256]
+            image_digest (str): builder image ID
+        """
+        sha = hashlib.sha256()
+        sha.update(json.dumps(
+                [spec_content, version, sorted(tarball_checksums),
+                 image_digest]))
+        return sha.hexdigest()
+
+    def _load(self):
+        # type () -> dict
+        try:
+            with open(self.cache_file, 'r') as in_file:
+                return json.load(in_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        # type (dict) -> None
+        """Evict then save entries atomically"""
+        now = time.time()
+        entries = {
+                k: v for k, v in entries.items()
+                if now - v['created'] <= self.max_age}
+        for key in sorted(
+                entries, key=lambda k: entries[k]['last_used'],
+                reverse=True)[self.max_entries:]:
+            del entries[key]
+        tmp_path = "%s.%d.tmp" % (self.cache_file, os.getpid())
+        try:
+            mkdir_p(os.path.dirname(self.cache_file))
+            with open(tmp_path, 'w') as out_file:
+                json.dump(entries, out_file)
+            os.rename(tmp_path, self.cache_file)
+        except (IOError, OSError) as e:
+            logging.debug("Skip saving build cache: %s", e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _outputs_present(outputs):
+        # type (List[List]) -> bool
+        for path, size, mtime in outputs:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if st.st_size != size or int(st.st_mtime) != mtime:
+                return False
+        return True
+
+    def lookup(self, key):
+        # type (str) -> List[List]
+        """Return [path, size, mtime] of outputs, or None if missed"""
+        with BuildCache._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if not entry:
+                return None
+            if (time.time() - entry['created'] > self.max_age or
+                    not BuildCache._outputs_present(entry['outputs'])):
+                del entries[key]
+                self._save(entries)
+                return None
+            entry['last_used'] = time.time()
+            self._save(entries)
+            return entry['outputs']
+
+    def output_paths(self):
+        # type () -> List[str]
+        """Output paths of entries that are not expired"""
+        with BuildCache._lock:
+            entries = self._load()
+        now = time.time()
+        return sorted(set(
+                output[0] for entry in entries.values()
+                if now - entry['created'] <= self.max_age
+                for output in entry['outputs']))
+
+    def store(self, key, outputs, image_digest=None):
+        # type (str, List[List], str) -> None
+        """Store [path, size, mtime] of outputs
+
+        Args:
+            key (str): input key
+            outputs (List[List]): [path, size, mtime] of outputs
+            image_digest (str, optional): Defaults to None.
+                    Digest of the builder image, recorded for reference
         """
-        self.pull()
-        self.update_epel_repos(spec_file, version)
-        self.push()
+        now = time.time()
+        with BuildCache._lock:
+            entries = self._load()
+            entries[key] = {
+                    'created': now, 'last_used': now, 'outputs': outputs}
+            if image_digest:
+                entries[key]['image_digest'] = image_digest
+            self._save(entries)
 
 
 class ElRepo(object):  # pylint: disable=too-few-public-methods
@@ -122,24 +1027,192 @@ class ElRepo(object):  # pylint: disable=too-few-public-methods
     x86_64, i386, noarch, src
     """
 
-    def __init__(self, dist_ver, local_dir=LOCAL_DIR):
-        # type (str) -> None
+    # Serialize writes to shared files in local_dir among builds
+    shared_write_lock = threading.Lock()
+
+    def __init__(
+            self, dist_ver, local_dir=LOCAL_DIR, concurrent=False,
+            build_cache=None, docker=None, images=None):
+        # type (str, str, bool, BuildCache, DockerClient, ImagePool) -> None
         """New an ElRepo given distribution version
 
         Args:
             dist_ver (str): Distribution version like "7" or "6"
             loca_dir (str, optional): Defaults to LOCAL_DIR. Local directory
+            concurrent (bool, optional): Defaults to False.
+                    Whether other ElRepo builds run at the same time.
+                    If True, the build uses its own copy of spec file,
+                    and the container output is logged with prefix.
+            build_cache (BuildCache, optional): Defaults to BuildCache().
+            docker (DockerClient, optional): Defaults to DockerClient().
+            images (ImagePool, optional): Defaults to ImagePool(docker).
+                    Builder image is pinned by ID in it.
         """
         self.dist_ver = dist_ver
         self.local_dir = local_dir
+        self.build_cache = build_cache or BuildCache()
+        self.docker = docker or DockerClient()
+        self.images = images or ImagePool(self.docker)
+        self.image = "%s:%s" % (BUILDER_IMAGE, dist_ver)
+        self.dist_dir = os.path.join(local_dir, "epel-%s" % dist_ver)
+        self.concurrent = concurrent
+        self.container_name = "zanata-el-%s-builder" % dist_ver
+        self.logger = PrefixLoggerAdapter(
+                logging.getLogger(), {'prefix': "el%s" % dist_ver})
+        # Relative to local_dir
+        self.work_dir = ".el%s-build" % dist_ver
+        self.cancelled = False
 
-    def build_and_update(self, spec_file, version=None, tarball_dir=None):
-        # type (str, str, str) -> None
+    def _private_spec(self, spec_file):
+        # type (str) -> str
+        """Copy spec_file to work_dir, return the path relative to local_dir
+        """
+        work_dir = os.path.join(self.local_dir, self.work_dir)
+        mkdir_p(work_dir)
+        private_spec = os.path.join(self.work_dir, os.path.basename(spec_file))
+        with ElRepo.shared_write_lock:
+            shutil.copy2(
+                    os.path.join(self.local_dir, spec_file),
+                    os.path.join(self.local_dir, private_spec))
+        return private_spec
+
+    def _remove_private_spec(self, spec_file):
+        # type (str) -> None
+        """Remove the private spec left by an earlier build"""
+        private_spec = os.path.join(
+                self.local_dir, self.work_dir, os.path.basename(spec_file))
+        if os.path.exists(private_spec):
+            os.remove(private_spec)
+
+    def copy_back_spec(self, spec_file):
+        # type (str) -> None
+        """Replace spec_file with the copy updated by a concurrent build"""
+        private_spec = os.path.join(
+                self.local_dir, self.work_dir, os.path.basename(spec_file))
+        if not os.path.exists(private_spec):
+            return
+        target = os.path.join(self.local_dir, spec_file)
+        with ElRepo.shared_write_lock:
+            tmp_path = "%s.%d.tmp" % (target, os.getpid())
+            shutil.copy2(private_spec, tmp_path)
+            os.rename(tmp_path, target)
+
+    def cancel(self):
+        # type () -> None
+        """Stop the build container if it is running"""
+        self.cancelled = True
+        try:
+            self.docker.container_stop(self.container_name)
+        except (DockerError, IOError, OSError) as e:
+            self.logger.debug("Failed to stop container: %s", e)
+
+    def is_published(self, spec_file, version):
+        # type (str, str) -> bool
+        """Whether the package version of spec_file is in the repodata
+
+        Name and release are read from spec_file,
+        with %{dist} set to .el<dist_ver>.
+        Repodata is stream-parsed, no container is needed.
+
+        Args:
+            spec_file (str): RPM spec file, relative to local_dir
+            version (str): package version
+        """
+        if not os.path.isdir(self.dist_dir):
+            return False
+        spec = RpmSpec.init_from_file(
+                os.path.join(self.local_dir, spec_file))
+        name = spec.get_tag('Name', expand=True)
+        release = spec.expand_macros(
+                getattr(spec, 'Release'), {'dist': ".el%s" % self.dist_ver})
+        return is_published(
+                published_nevras(self.dist_dir), name, version, release)
+
+    def _import_outputs(self, output_dir):
+        # type (str) -> None
+        """Move RPMs built into output_dir to the same place in local_dir,
+        then remove output_dir"""
+        for dirpath, dirnames, filenames in os.walk(output_dir):
+            dirnames[:] = [d for d in dirnames if d != 'repodata']
+            for f in filenames:
+                if not f.endswith('.rpm'):
+                    continue
+                path = os.path.join(dirpath, f)
+                target = os.path.join(
+                        self.local_dir, os.path.relpath(path, output_dir))
+                mkdir_p(os.path.dirname(target))
+                os.rename(path, target)
+        shutil.rmtree(output_dir)
+
+    def update_repodata(self):
+        # type () -> None
+        """Update repodata of repositories under dist_dir incrementally"""
+        if not os.path.isdir(self.dist_dir):
+            logging.warning("%s does not exist", self.dist_dir)
+            return
+        for repo_dir in find_repo_dirs(self.dist_dir) or [self.dist_dir]:
+            RepodataUpdater(repo_dir).update()
+
+    def _image_digest(self):
+        # type () -> str
+        """ID of the pinned builder image, or None if it cannot be pulled"""
+        try:
+            return self.images.pin(self.image)
+        except (DockerError, IOError, OSError) as e:
+            self.logger.warning("Builder image is unavailable: %s", e)
+            return None
+
+    def build_inputs_key(self, spec_content, version, tarball_dir=None):
+        # type (str, str, str) -> str
+        """Digest of spec content, version, source tarballs and builder image
+
+        Source tarballs are the Source tags of the spec, expanded with
+        the requested version, that exist in tarball_dir.
+
+        Returns:
+            str: key for BuildCache, or None if the image is not pulled
+        """
+        image_digest = self._image_digest()
+        if not image_digest:
+            return None
+        tarball_checksums = []
+        if tarball_dir:
+            spec = RpmSpec.init_from_lines(spec_content.splitlines())
+            for name, _ in spec_sources(spec, version):
+                tarball = os.path.join(tarball_dir, name)
+                if os.path.isfile(tarball):
+                    tarball_checksums.append([name, sha256_file(tarball)])
+        return BuildCache.input_key(
+                spec_content, version, tarball_checksums, image_digest)
+
+    def snapshot_rpms(self):
+        # type () -> Dict[str, List]
+        """path: [path, size, mtime] of RPM files in dist_dir"""
+        result = {}
+        for dirpath, _, filenames in os.walk(self.dist_dir):
+            for f in filenames:
+                if f.endswith('.rpm'):
+                    path = os.path.join(dirpath, f)
+                    st = os.stat(path)
+                    result[path] = [path, st.st_size, int(st.st_mtime)]
+        return result
+
+    def build_and_update(  # pylint: disable=too-many-arguments
+            self, spec_file, version=None, tarball_dir=None, force=False,
+            tarballs_readonly=False):
+        # type (str, str, str, bool, bool) -> bool
         """build RPM and update yum repo
 
         This program uses docker container,
         docker.io/zanata/centos-repo-builder,
-        to update the repository.
+        to build RPMs into a staging directory in work_dir.
+        RPMs are then moved to dist_dir, and its repodata is updated
+        incrementally by RepodataUpdater, instead of createrepo
+        over the whole repository.
+
+        The build is skipped if the version is already published
+        in the repodata, or if the build cache has still present outputs
+        built from the same inputs, unless force is True.
 
         Args:
             spec_file (str): RPM spec file.
@@ -147,71 +1220,140 @@ class ElRepo(object):  # pylint: disable=too-few-public-methods
             version (str, optional): Defaults to None.
             tarball_dir ([type], optional): Defaults to None.
                     tarballs are downloaded to this directory.
+            force (bool, optional): Defaults to False.
+                    Build even if the version is already published
+                    or built.
+            tarballs_readonly (bool, optional): Defaults to False.
+                    Mount tarball_dir read-only and shared with other
+                    containers, as tarballs are already downloaded.
+
+        Returns:
+            bool: True if the build ran, False if it is skipped.
+                    The private spec of a skipped build is removed,
+                    so a stale one is not copied back.
+        """
+        with span("build_and_update el%s" % self.dist_ver):
+            return self._build_and_update(
+                    spec_file, version, tarball_dir, force, tarballs_readonly)
+
+    def _build_and_update(  # pylint: disable=too-many-arguments
+            self, spec_file, version, tarball_dir, force, tarballs_readonly):
+        # type (str, str, str, bool, bool) -> bool
+        if self.concurrent:
+            self._remove_private_spec(spec_file)
+        if version == 'auto':
+            version = GitHelper.detect_remote_repo_latest_version(
+                    'platform-', PLATFORM_GIT_URL)
+        if version and not force and self.is_published(spec_file, version):
+            self.logger.info(
+                    "Version %s is already published in EL%s, skip build",
+                    version, self.dist_ver)
+            return False
+        with open(os.path.join(self.local_dir, spec_file), 'r') as in_file:
+            # Read before the build updates it
+            spec_content = in_file.read()
+        if not force:
+            key = self.build_inputs_key(spec_content, version, tarball_dir)
+            if key and self.build_cache.lookup(key):
+                self.logger.info(
+                        "Version %s is already built for EL%s, skip build",
+                        version, self.dist_ver)
+                # Pulled repodata may not have the cached outputs
+                self.update_repodata()
+                return False
+
+        if self.concurrent:
+            spec_file = self._private_spec(spec_file)
+        rpms_before = self.snapshot_rpms()
+        # Relative to local_dir, so the container createrepo only
+        # indexes the new RPMs
+        output_dir = os.path.join(self.work_dir, 'output')
+        if os.path.isdir(os.path.join(self.local_dir, output_dir)):
+            shutil.rmtree(os.path.join(self.local_dir, output_dir))
+        mkdir_p(os.path.join(self.local_dir, output_dir))
+        volume_name = "zanata-el-%s-repo" % self.dist_ver
+        with ElRepo.shared_write_lock:
+            self.docker.ensure_volume(volume_name)
+
+        binds = [
+                "{}:/repo:Z".format(volume_name),
+                "{}:/repo_host_dir:Z".format(self.local_dir),
+                "{}:/output_dir:Z".format(self.local_dir)]
+        if tarball_dir and tarballs_readonly:
+            binds.append("%s:/rpmbuild/SOURCES:ro,z" % tarball_dir)
+        elif tarball_dir:
+            binds.append("%s:/rpmbuild/SOURCES:Z" % tarball_dir)
+
+        cmd = ["-S", "/repo_host_dir/", "-D", "/output_dir/%s/" % output_dir]
+        if version:
+            self.logger.info(
+                    "Update specfile %s to vesrsion %s ", spec_file, version)
+            cmd += ['-u', version]
+        cmd.append(spec_file)
+
+        if self.cancelled:
+            raise CLIException("EL%s build is cancelled" % self.dist_ver)
+        log_line = None
+        if self.concurrent:
+            def log_line(_, line):
+                self.logger.info("%s", line)
+        with timed('build', "el%s" % self.dist_ver):
+            status = self.docker.run(
+                    self.images.pin(self.image), cmd, self.container_name,
+                    binds, log_line)
+        if status:
+            raise CLIException("EL%s build exited with %d" % (
+                    self.dist_ver, status))
+        self._import_outputs(os.path.join(self.local_dir, output_dir))
+        self.update_repodata()
+        with open(os.path.join(self.local_dir, spec_file), 'r') as in_file:
+            # A re-run reads the spec as updated by this build
+            updated_spec_content = in_file.read()
+        self._store_build_outputs(
+                [spec_content, updated_spec_content], version, tarball_dir,
+                rpms_before)
+        return True
+
+    def _store_build_outputs(
+            self, spec_contents, version, tarball_dir, rpms_before):
+        # type (List[str], str, str, Dict[str, List]) -> None
+        """Record RPMs added or changed by the build in build cache
+
+        Outputs are stored under the key of each spec content,
+        as the build updates the spec in place.
         """
-        docker_cmd = '/usr/bin/docker'
-        with working_directory(self.local_dir):
-            volume_name = "zanata-el-%s-repo" % self.dist_ver
-            vols = exec_check_output([
-                    docker_cmd, 'volume', 'ls', '-q']).split('\n')
-            if volume_name not in vols:
-                exec_check_call([
-                        docker_cmd, 'volume', 'create', '--name', volume_name])
-
-            docker_run_cmd = [
-                    docker_cmd, "run", "--rm", "--name",
-                    "zanata-el-{}-builder".format(self.dist_ver),
-                    "-v", "{}:/repo:Z".format(volume_name),
-                    "-v", "{}:/repo_host_dir:Z".format(self.local_dir),
-                    "-v", "{}:/output_dir:Z".format(self.local_dir)]
-
-            if tarball_dir:
-                docker_run_cmd += [
-                        "-v", "%s:/rpmbuild/SOURCES:Z" % tarball_dir]
-
-            docker_run_cmd += [
-                    "docker.io/zanata/centos-repo-builder:{}".format(
-                            self.dist_ver),
-                    "-S", "/repo_host_dir/",
-                    "-D", "/repo_host_dir/"]
-
-            if version:
-                if version == 'auto':
-                    version = GitHelper.detect_remote_repo_latest_version(
-                            'platform-',
-                            'https://github.com/zanata/zanata-platform.git')
-                logging.info(
-                        "Update specfile %s to vesrsion %s ",
-                        spec_file, version)
-                docker_run_cmd += ['-u', version]
-
-            docker_run_cmd.append(spec_file)
-            exec_check_call(docker_run_cmd)
+        outputs = [
+                v for k, v in sorted(self.snapshot_rpms().items())
+                if rpms_before.get(k) != v]
+        if not outputs:
+            return
+        image_digest = None
+        for spec_content in sorted(set(spec_contents)):
+            # Key is computed again, as tarballs may be downloaded
+            # by the build
+            key = self.build_inputs_key(spec_content, version, tarball_dir)
+            if not key:
+                continue
+            if not image_digest:
+                image_digest = self.images.digest(self.image)
+                self.logger.info("Built with image %s", image_digest)
+            self.build_cache.store(key, outputs, image_digest)
 
 
 def main(argv=None):
-    # type (dict) -> None
+    # type (List[str]) -> None
     """Run as command line program"""
-    if not argv:
+    if argv is None:
         argv = sys.argv[1:]
     parser = ZanataArgParser(__file__)
     parser.add_env('RPM_REPO_SSH_USER', dest='ssh_user')
     parser.add_env('RPM_REPO_SSH_IDENTITY_FILE', dest='identity_file')
     parser.add_methods_as_sub_commands(
-            RpmRepoHost, "pull|push|update_.*|all")
+            RpmRepoHost, "pull|push|update_.*|all", lazy=True)
+    parser.add_batch_sub_command()
     args = parser.parse_all(argv)
     parser.run_sub_command(args)
 
 
 if __name__ == '__main__':
-    if PROFILE:
-        import cProfile
-        import pstats
-        profile_filename = 'ZanataRpmRepo_profile.txt'
-        cProfile.run('main()', profile_filename)
-        statsfile = open("profile_stats.txt", "wb")
-        p = pstats.Stats(profile_filename, stream=statsfile)
-        stats = p.strip_dirs().sort_stats('cumulative')
-        stats.print_stats()
-        statsfile.close()
-        sys.exit(0)
     main()
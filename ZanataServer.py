@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+"""ZanataServer -- Run sub-commands in a warm long-lived process
+
+The server imports the tool modules once, then runs sub-command
+invocations received from a local Unix socket, so the interpreter start-up,
+module import, read_env, and caches such as HTTP credentials and shared
+SSH connections are paid only once.
+
+Usage:
+    ZanataServer.py serve [--socket PATH] [module ...]
+    ZanataServer.py call [--socket PATH] module [sub-command args ...]
+
+The client is thin: it only forwards argv, current directory and
+environment, then streams back stdout, stderr and exit status.
+
+Requests are run one at a time, because stdout and stderr
+(file descriptor 1 and 2) of the server are redirected to the client.
+
+Only os.environ is swapped to the client environment. Module level
+settings, such as WORK_ROOT, LOCAL_DIR, TARBALL_CACHE_DIR and
+SshHost.CONTROL_PERSIST, keep the values read when the server started.
+So requests whose SNAPSHOT_ENV differ from the server are refused;
+restart the server with the new environment instead.
+
+The client sends its whole environment, including credentials,
+so both sides refuse to run unless the socket directory is owned by
+the current user with mode 0700, and the peer of the socket runs as
+the current user.
+
+Protocol:
+    Request is a JSON line: {"module", "argv", "cwd", "env"}
+    Response is a sequence of frames: 1 byte type, 4 bytes big-endian
+    length, then payload. Types are 'O' (stdout), 'E' (stderr) and
+    'X' (exit status, as decimal string), which is the last frame.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import errno
+import importlib
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+import traceback
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+# Modules that can be served, they have main(argv)
+DEFAULT_MODULES = ['ZanataFunctions', 'ZanataRpm', 'ZanataRpmRepo']
+
+# Environment that module level settings are read from at import
+SNAPSHOT_ENV = ['WORK_ROOT', 'XDG_CACHE_HOME']
+
+FRAME_HEADER = struct.Struct('>cI')
+PIPE_CHUNK = 64 * 1024
+# Python 2 socket module does not define it, this is the Linux value
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+
+class UnsafeSocketError(Exception):
+    """Socket directory or peer is not private to the current user"""
+    pass
+
+
+def default_socket_path():
+    # type () -> str
+    """Socket path from env ZANATA_SERVER_SOCKET,
+    or server.sock in a user private directory"""
+    if os.getenv('ZANATA_SERVER_SOCKET'):
+        return os.environ['ZANATA_SERVER_SOCKET']
+    runtime_dir = os.getenv(
+            'XDG_RUNTIME_DIR', "/tmp/zanata-server-%d" % os.getuid())
+    return os.path.join(runtime_dir, 'zanata-server.sock')
+
+
+def check_socket_dir(socket_dir):
+    # type (str) -> None
+    """Check socket_dir is a directory owned by us with mode 0700
+
+    Raises:
+        UnsafeSocketError: Otherwise, as another local user could have
+                created it to receive the requests
+    """
+    st = os.lstat(socket_dir)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+            stat.S_IMODE(st.st_mode) != 0o700):
+        raise UnsafeSocketError(
+                "%s must be a directory owned by uid %d with mode 0700" % (
+                        socket_dir, os.getuid()))
+
+
+def check_peer(conn):
+    # type (socket.socket) -> None
+    """Check the other end of the Unix socket runs as us
+
+    Raises:
+        UnsafeSocketError: When the peer runs as another user
+    """
+    _, uid, _ = struct.unpack('3i', conn.getsockopt(
+            socket.SOL_SOCKET, SO_PEERCRED, struct.calcsize('3i')))
+    if uid != os.getuid():
+        raise UnsafeSocketError("Socket peer runs as uid %d" % uid)
+
+
+def _send_frame(conn, frame_type, payload):
+    # type (socket.socket, str, str) -> None
+    conn.sendall(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+
+
+def _recv_exact(conn, size):
+    # type (socket.socket, int) -> str
+    buf = b''
+    while len(buf) < size:
+        data = conn.recv(size - len(buf))
+        if not data:
+            raise EOFError("Server closed connection")
+        buf += data
+    return buf
+
+
+def call(module, argv, socket_path=None):
+    # type (str, List[str], str) -> int
+    """Run a sub-command in the server
+
+    Args:
+        module (str): tool module name, such as ZanataRpmRepo
+        argv (List[str]): command line arguments of the tool
+        socket_path (str, optional): Defaults to default_socket_path().
+
+    Returns:
+        int: exit status of the sub-command
+
+    Raises:
+        UnsafeSocketError: When the socket is not private to us
+    """
+    socket_path = socket_path or default_socket_path()
+    check_socket_dir(os.path.dirname(os.path.abspath(socket_path)))
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+        check_peer(conn)
+        conn.sendall(json.dumps({
+                'module': module, 'argv': argv,
+                'cwd': os.getcwd(), 'env': dict(os.environ)}) + '\n')
+        outputs = {b'O': sys.stdout, b'E': sys.stderr}
+        while True:
+            frame_type, size = FRAME_HEADER.unpack(
+                    _recv_exact(conn, FRAME_HEADER.size))
+            payload = _recv_exact(conn, size)
+            if frame_type == b'X':
+                return int(payload)
+            outputs[frame_type].write(payload)
+            outputs[frame_type].flush()
+    finally:
+        conn.close()
+
+
+class SubCommandServer(object):
+    """Serve sub-command invocations over a Unix socket"""
+
+    def __init__(self, socket_path=None, modules=None):
+        # type (str, List[str]) -> None
+        """New a server and import the modules
+
+        Args:
+            socket_path (str, optional): Defaults to default_socket_path().
+            modules (List[str], optional): Defaults to DEFAULT_MODULES.
+                    Modules that can be called.
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.snapshot_env = {k: os.getenv(k) for k in SNAPSHOT_ENV}
+        # Keep SSH connections open among requests
+        os.environ.setdefault('ZANATA_SSH_CONTROL_PERSIST', '10m')
+        self.modules = {
+                m: importlib.import_module(m)
+                for m in (modules or DEFAULT_MODULES)}
+        self.server_socket = None  # type: socket.socket
+
+    def serve_forever(self):
+        # type () -> None
+        """Accept and run requests until interrupted
+
+        Raises:
+            UnsafeSocketError: When the socket directory is not private
+        """
+        socket_dir = os.path.dirname(os.path.abspath(self.socket_path))
+        if not os.path.lexists(socket_dir):
+            os.makedirs(socket_dir, 0o700)
+        check_socket_dir(socket_dir)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.server_socket.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self.server_socket.listen(16)
+        logging.info(
+                "Serving %s on %s",
+                ', '.join(sorted(self.modules)), self.socket_path)
+        try:
+            while True:
+                conn, _ = self.server_socket.accept()
+                try:
+                    check_peer(conn)
+                    self.handle(conn)
+                except (UnsafeSocketError, socket.error) as e:
+                    logging.error("Refuse connection: %s", e)
+                finally:
+                    conn.close()
+        finally:
+            self.server_socket.close()
+            os.remove(self.socket_path)
+
+    def handle(self, conn):
+        # type (socket.socket) -> None
+        """Run one request and stream the result back
+
+        Failures, such as a malformed request or a closed client,
+        are only logged, so the server keeps serving other clients.
+        """
+        try:
+            self._handle(conn)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Failed to handle request: %s", e)
+            try:
+                _send_frame(conn, b'E', "Bad request: %s\n" % e)
+                _send_frame(conn, b'X', b'2')
+            except (IOError, OSError):
+                pass
+
+    def _handle(self, conn):
+        # type (socket.socket) -> None
+        request_line = b''
+        while not request_line.endswith(b'\n'):
+            data = conn.recv(PIPE_CHUNK)
+            if not data:
+                raise EOFError("Client closed connection")
+            request_line += data
+        request = json.loads(request_line)
+        module = self.modules.get(request['module'])
+        if not module:
+            _send_frame(
+                    conn, b'E',
+                    "Module %s is not served\n" % request['module'])
+            _send_frame(conn, b'X', b'2')
+            return
+        changed = [
+                k for k in SNAPSHOT_ENV
+                if request['env'].get(k) != self.snapshot_env[k]]
+        if changed:
+            _send_frame(
+                    conn, b'E',
+                    "%s differ from the server, restart the server\n" % (
+                            ', '.join(changed)))
+            _send_frame(conn, b'X', b'2')
+            return
+
+        logging.debug(
+                "Run %s %s", request['module'], ' '.join(request['argv']))
+        status = SubCommandServer._run_redirected(
+                conn, module.main,
+                [a.encode('utf-8') for a in request['argv']],
+                request['cwd'], request['env'])
+        _send_frame(conn, b'X', str(status))
+
+    @staticmethod
+    def _pump(read_fd, frame_type, conn, send_lock):
+        """Forward data from pipe to client until EOF"""
+        try:
+            while True:
+                data = os.read(read_fd, PIPE_CHUNK)
+                if not data:
+                    break
+                with send_lock:
+                    _send_frame(conn, frame_type, data)
+        except (IOError, OSError) as e:
+            if e.errno != errno.EPIPE:
+                raise
+        finally:
+            os.close(read_fd)
+
+    @staticmethod
+    def _run_redirected(conn, func, argv, cwd, env):
+        # type (socket.socket, Any, List[str], str, dict) -> int
+        """Run func(argv) with stdout, stderr, cwd and env of the client"""
+        saved_cwd = os.getcwd()
+        saved_env = dict(os.environ)
+        saved_fds = [os.dup(1), os.dup(2)]
+        pumps = []
+        send_lock = threading.Lock()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, frame_type in [(1, b'O'), (2, b'E')]:
+            read_fd, write_fd = os.pipe()
+            os.dup2(write_fd, fd)
+            os.close(write_fd)
+            pump = threading.Thread(
+                    target=SubCommandServer._pump,
+                    args=(read_fd, frame_type, conn, send_lock))
+            pump.daemon = True
+            pump.start()
+            pumps.append(pump)
+
+        status = 0
+        try:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(
+                    {k.encode('utf-8'): v.encode('utf-8')
+                     for k, v in env.items()})
+            func(argv)
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                status = e.code
+            elif e.code:
+                sys.stderr.write("%s\n" % e.code)
+                status = 1
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+            os.chdir(saved_cwd)
+            for pump in pumps:
+                # Background children may still hold the pipe
+                pump.join(5)
+        return status
+
+
+def main(argv=None):
+    # type (List[str]) -> None
+    """Run as command line program"""
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # Thin client: skip building the parser
+    if argv and argv[0] == 'call':
+        socket_path = None
+        argv = argv[1:]
+        if argv and argv[0] in ['-s', '--socket']:
+            socket_path = argv[1]
+            argv = argv[2:]
+        if not argv:
+            sys.exit("Usage: %s call [--socket PATH] module [args ...]" % (
+                    sys.argv[0]))
+        try:
+            sys.exit(call(argv[0], argv[1:], socket_path))
+        except UnsafeSocketError as e:
+            sys.exit(str(e))
+
+    from ZanataArgParser import ZanataArgParser  # pylint: disable=E0401
+    parser = ZanataArgParser(__file__, description=__doc__)
+    parser.add_sub_command(
+            'serve',
+            [
+                    ('-s --socket', {
+                            'type': str, 'default': None,
+                            'help': 'Unix socket path. Default: '
+                                    '$ZANATA_SERVER_SOCKET or '
+                                    '$XDG_RUNTIME_DIR/zanata-server.sock'}),
+                    ('modules', {
+                            'type': str, 'nargs': '*',
+                            'help': 'Modules to serve. Default: %s' % (
+                                    ' '.join(DEFAULT_MODULES))})],
+            help='Start the server')
+    parser.add_sub_command(
+            'call',
+            [
+                    ('-s --socket', {
+                            'type': str, 'default': None,
+                            'help': 'Unix socket path'}),
+                    ('module', {'type': str, 'help': 'Module to call'}),
+                    ('args', {
+                            'type': str, 'nargs': '*',
+                            'help': 'Arguments of the module'})],
+            help='Run a sub-command in the server')
+    args = parser.parse_all(argv)
+    try:
+        if args.sub_command == 'call':
+            sys.exit(call(args.module, args.args, args.socket))
+        SubCommandServer(args.socket, args.modules).serve_forever()
+    except UnsafeSocketError as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""ZanataTimings -- Historical stage timings
+
+Tools record how long each stage (pull, build per dist, push,
+download, ssh) takes, as one JSON line per stage appended to
+a local file, so it stays cheap to write and safe to append from
+concurrent threads and processes.
+
+The file is taken from env ZANATA_TIMINGS_FILE, otherwise
+$XDG_CACHE_HOME/zanata-scripts/timings.jsonl. Set ZANATA_TIMINGS_FILE
+to an empty string to disable recording.
+
+Example:
+    with timed('build', 'el7'):
+        build()
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import contextmanager
+
+from ZanataTrace import critical_path, span  # pylint: disable=E0401
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+    from typing import Dict, Tuple  # noqa: F401 # pylint: disable=W0611
+    from typing import Iterator  # noqa: F401 # pylint: disable=W0611
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+# Identifies the records of this process
+RUN_ID = "%s-%d" % (time.strftime('%Y%m%dT%H%M%S'), os.getpid())
+TOOL = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+
+# Number of recent records compared with older records for trend
+TREND_WINDOW = 5
+
+TimingRecord = namedtuple(
+        'TimingRecord',
+        ['run', 'tool', 'stage', 'target', 'start', 'duration', 'ok'])
+
+
+def default_timings_file():
+    # type () -> str
+    """Timings file from env, None if recording is disabled"""
+    timings_file = os.getenv('ZANATA_TIMINGS_FILE')
+    if timings_file is not None:
+        return timings_file or None
+    return os.path.join(
+            os.getenv('XDG_CACHE_HOME', os.path.join(
+                    os.path.expanduser('~'), '.cache')),
+            'zanata-scripts', 'timings.jsonl')
+
+
+class TimingStore(object):
+    """Append-only store of TimingRecord"""
+
+    _lock = threading.Lock()
+
+    def __init__(self, timings_file=None):
+        # type (str) -> None
+        """
+        Args:
+            timings_file (str, optional): Defaults to
+                    default_timings_file()
+        """
+        self.timings_file = timings_file or default_timings_file()
+
+    def append(self, record):
+        # type (TimingRecord) -> None
+        """Append record; failures are only logged"""
+        if not self.timings_file:
+            return
+        line = json.dumps(record._asdict(), sort_keys=True) + '\n'
+        try:
+            timings_dir = os.path.dirname(self.timings_file)
+            if timings_dir and not os.path.isdir(timings_dir):
+                os.makedirs(timings_dir)
+            with TimingStore._lock:
+                # Single write with O_APPEND, so lines do not interleave
+                fd = os.open(
+                        self.timings_file,
+                        os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line)
+                finally:
+                    os.close(fd)
+        except (IOError, OSError) as e:
+            logging.debug("Skip recording timing: %s", e)
+
+    def read(self, tool=None):
+        # type (str) -> List[TimingRecord]
+        """Return records in file order, broken lines are skipped"""
+        if not self.timings_file or not os.path.exists(self.timings_file):
+            return []
+        result = []
+        with open(self.timings_file, 'r') as in_file:
+            for line in in_file:
+                try:
+                    record = TimingRecord(**json.loads(line))
+                except (ValueError, TypeError):
+                    continue
+                if tool is None or record.tool == tool:
+                    result.append(record)
+        return result
+
+
+@contextmanager
+def timed(stage, target=None, store=None):
+    # type (str, str, TimingStore) -> Iterator
+    """Record the duration of the enclosed block, which is also
+    traced as a span
+
+    Args:
+        stage (str): like 'pull', 'build', 'push', 'download', 'ssh'
+        target (str, optional): Defaults to None. like 'el7' or host name
+        store (TimingStore, optional): Defaults to TimingStore()
+    """
+    start = time.time()
+    ok = False
+    try:
+        with span(stage if target is None else "%s %s" % (stage, target)):
+            yield
+        ok = True
+    finally:
+        (store or TimingStore()).append(TimingRecord(
+                RUN_ID, TOOL, stage, target, start,
+                round(time.time() - start, 3), ok))
+
+
+def percentile(values, pct):
+    # type (List[float], float) -> float
+    """Nearest-rank percentile, None if values is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def stage_stats(records):
+    # type (List[TimingRecord]) -> OrderedDict
+    """Statistics of successful records per (stage, target)
+
+    Returns:
+        OrderedDict: (stage, target): dict of count, p50, p90, max,
+                and trend, which is the ratio of the median of the
+                latest TREND_WINDOW records to the median of older ones,
+                or None if there are not enough records.
+    """
+    durations = defaultdict(list)
+    for record in sorted(records, key=lambda r: r.start):
+        if record.ok:
+            durations[(record.stage, record.target)].append(record.duration)
+    result = OrderedDict()
+    for key in sorted(durations, key=lambda k: (k[0], k[1] or '')):
+        values = durations[key]
+        trend = None
+        if len(values) > TREND_WINDOW:
+            older = percentile(values[:-TREND_WINDOW], 50)
+            if older:
+                trend = percentile(values[-TREND_WINDOW:], 50) / older
+        result[key] = {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'max': max(values),
+                'trend': trend}
+    return result
+
+
+def group_runs(records):
+    # type (List[TimingRecord]) -> OrderedDict
+    """run: records of the run, runs are ordered by start time"""
+    runs = OrderedDict()
+    for record in sorted(records, key=lambda r: r.start):
+        runs.setdefault(record.run, []).append(record)
+    return runs
+
+
+def predict(tasks, task_stage, records):
+    # type (OrderedDict, Any, List[TimingRecord]) -> Tuple[float, dict]
+    """Predict run duration from the median of past durations
+
+    Tasks without history of the same target fall back to the same
+    stage of any target, otherwise they are assumed to take no time.
+
+    Args:
+        tasks (OrderedDict): task name: names of dependencies,
+                dependencies come first
+        task_stage (callable): task name -> (stage, target)
+        records (List[TimingRecord]): history
+
+    Returns:
+        Tuple[float, dict]: predicted seconds of the critical path,
+                and task name: predicted seconds, or None if unknown
+    """
+    stats = stage_stats(records)
+    by_stage = defaultdict(list)
+    for record in records:
+        if record.ok:
+            by_stage[record.stage].append(record.duration)
+    estimates = OrderedDict()
+    finish = {}
+    for name, deps in tasks.items():
+        stage, target = task_stage(name)
+        if (stage, target) in stats:
+            estimates[name] = stats[(stage, target)]['p50']
+        else:
+            estimates[name] = percentile(by_stage.get(stage, []), 50)
+        finish[name] = (estimates[name] or 0) + max(
+                [finish[d] for d in deps] or [0])
+    return max(finish.values() or [0]), estimates
+
+
+def format_seconds(seconds):
+    # type (float) -> str
+    """Like '1m05s', or '-' if seconds is None"""
+    if seconds is None:
+        return '-'
+    minutes, sec = divmod(int(round(seconds)), 60)
+    return "%dm%02ds" % (minutes, sec) if minutes else "%ds" % sec
+
+
+def report(records, last=5):
+    # type (List[TimingRecord], int) -> str
+    """Report of stage statistics and critical paths of the last runs"""
+    lines = ["%-16s %-24s %5s %8s %8s %8s %7s" % (
+            'STAGE', 'TARGET', 'COUNT', 'P50', 'P90', 'MAX', 'TREND')]
+    for (stage, target), stat in stage_stats(records).items():
+        lines.append("%-16s %-24s %5d %8s %8s %8s %7s" % (
+                stage, target or '-', stat['count'],
+                format_seconds(stat['p50']), format_seconds(stat['p90']),
+                format_seconds(stat['max']),
+                "%+.0f%%" % ((stat['trend'] - 1) * 100)
+                if stat['trend'] else '-'))
+    for run, run_records in list(group_runs(records).items())[-last:]:
+        start = min(r.start for r in run_records)
+        end = max(r.start + r.duration for r in run_records)
+        lines.append('')
+        lines.append("Run %s (%s): %s%s" % (
+                run, run_records[0].tool, format_seconds(end - start),
+                '' if all(r.ok for r in run_records) else ', failed'))
+        for record in critical_path(run_records):
+            lines.append("    %8s %s%s%s" % (
+                    format_seconds(record.duration), record.stage,
+                    ' ' + record.target if record.target else '',
+                    '' if record.ok else ' (failed)'))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    # type (List[str]) -> None
+    """Run as command line program"""
+    from ZanataArgParser import ZanataArgParser  # pylint: disable=E0401
+    parser = ZanataArgParser(__file__, description=__doc__)
+    parser.add_sub_command(
+            'report',
+            [
+                    ('-f --timings-file', {
+                            'type': str, 'default': None,
+                            'help': 'Timings file'}),
+                    ('-t --tool', {
+                            'type': str, 'default': None,
+                            'help': 'Only records of this tool'}),
+                    ('-n --last', {
+                            'type': int, 'default': 5,
+                            'help': 'Number of recent runs to show'})],
+            help='Show stage percentiles, trends and critical paths')
+    args = parser.parse_all(argv)
+    records = TimingStore(args.timings_file).read(args.tool)
+    print(report(records, args.last))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""ZanataTrace -- Hierarchical spans exported as Chrome trace
+
+Spans nest within a thread. bind() carries the current span into
+worker threads, and trace_env() carries it into subprocesses, so the
+spans of a whole run form one tree.
+
+Tracing starts with start(), or --trace of ZanataArgParser
+(env ZANATA_TRACE). At exit the root process writes the trace file in
+Chrome trace event format, which can be opened in chrome://tracing or
+https://ui.perfetto.dev, and logs the critical path. Subprocesses write
+their spans to '<trace file>.<pid>.part', which the root merges.
+
+Example:
+    with span('push'):
+        push()
+"""
+from __future__ import absolute_import, division, print_function
+
+import atexit
+import glob
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+    from typing import Dict, Iterator  # noqa: F401 # pylint: disable=W0611
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+TRACE_ENV = 'ZANATA_TRACE'
+# pid:tid:span id of the span that started this process
+TRACE_PARENT_ENV = 'ZANATA_TRACE_PARENT'
+
+# Records within this many seconds are considered back to back
+CRITICAL_PATH_SLACK = 1.0
+
+Span = namedtuple('Span', [
+        'name', 'id', 'parent', 'pid', 'tid', 'thread', 'start', 'duration',
+        'ok'])
+
+
+def critical_path(records):
+    # type (List[Any]) -> List[Any]
+    """Chain of records that determined the total duration
+
+    Records are anything with start and duration, like Span.
+    Records nested in a longer record, like an ssh call inside a pull,
+    are left out. Starting from the record that ended last,
+    each step goes back to the record that ended last before
+    the current one started.
+    """
+    records = [
+            r for r in records if not any(
+                    o.duration > r.duration and o.start <= r.start and
+                    o.start + o.duration >= r.start + r.duration
+                    for o in records)]
+    if not records:
+        return []
+    current = max(records, key=lambda r: r.start + r.duration)
+    path = [current]
+    while True:
+        candidates = [
+                r for r in records
+                if r.start + r.duration <= current.start +
+                CRITICAL_PATH_SLACK and r.start < current.start]
+        if not candidates:
+            break
+        current = max(candidates, key=lambda r: r.start + r.duration)
+        path.append(current)
+    path.reverse()
+    return path
+
+
+class Tracer(object):
+    """Collects the spans of this process"""
+
+    def __init__(self, trace_file, parent=None):
+        # type (str, str) -> None
+        """
+        Args:
+            trace_file (str): Chrome trace file written by the root process
+            parent (str, optional): Defaults to None.
+                    pid:tid:span id from TRACE_PARENT_ENV,
+                    this process is a subprocess of a traced process if
+                    the pid is not ours.
+        """
+        self.trace_file = os.path.abspath(trace_file)
+        self.pid = os.getpid()
+        self.root_parent = None  # type: tuple
+        if parent:
+            parent_pid, parent_tid, span_id = parent.split(':', 2)
+            if int(parent_pid) != self.pid:
+                self.root_parent = (int(parent_pid), int(parent_tid), span_id)
+        self.spans = []  # type: List[Span]
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def is_root(self):
+        # type () -> bool
+        """Whether this process writes the trace file"""
+        return self.root_parent is None
+
+    def stack(self):
+        # type () -> List[tuple]
+        """(pid, tid, span id) of the open spans of the current thread"""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = [self.root_parent] if (
+                    self.root_parent) else []
+        return self._local.stack
+
+    def new_id(self):
+        # type () -> str
+        """Span ID unique across processes"""
+        return "%d.%d" % (self.pid, next(self._ids))
+
+    def add(self, span_record):
+        # type (Span) -> None
+        """Add a finished span"""
+        with self._lock:
+            self.spans.append(span_record)
+
+    def _read_parts(self):
+        # type () -> List[Span]
+        """Spans written by subprocesses, part files are removed"""
+        result = []
+        for part_file in glob.glob(self.trace_file + '.*.part'):
+            try:
+                with open(part_file, 'r') as in_file:
+                    result += [Span(**s) for s in json.load(in_file)]
+                os.remove(part_file)
+            except (IOError, OSError, ValueError, TypeError) as e:
+                logging.warning("Skip trace part %s: %s", part_file, e)
+        return result
+
+    @staticmethod
+    def chrome_events(spans):
+        # type (List[Span]) -> List[dict]
+        """Complete events of spans, with flow events linking spans
+        to parents in other threads or processes"""
+        events = []
+        by_id = {s.id: s for s in spans}
+        threads = {}
+        for flow_id, s in enumerate(spans, 1):
+            threads[(s.pid, s.tid)] = s.thread
+            events.append({
+                    'name': s.name, 'cat': 'zanata', 'ph': 'X',
+                    'ts': int(s.start * 1e6), 'dur': int(s.duration * 1e6),
+                    'pid': s.pid, 'tid': s.tid,
+                    'args': {'id': s.id, 'parent': s.parent, 'ok': s.ok}})
+            parent = by_id.get(s.parent)
+            if parent and (parent.pid, parent.tid) != (s.pid, s.tid):
+                events.append({
+                        'name': 'spawn', 'cat': 'zanata', 'ph': 's',
+                        'id': flow_id, 'ts': int(s.start * 1e6),
+                        'pid': parent.pid, 'tid': parent.tid})
+                events.append({
+                        'name': 'spawn', 'cat': 'zanata', 'ph': 'f',
+                        'bp': 'e', 'id': flow_id, 'ts': int(s.start * 1e6),
+                        'pid': s.pid, 'tid': s.tid})
+        for (pid, tid), name in sorted(threads.items()):
+            events.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                    'tid': tid, 'args': {'name': name}})
+        return events
+
+    @staticmethod
+    def summary(spans):
+        # type (List[Span]) -> str
+        """Critical path of the span tree, as indented lines"""
+        children = defaultdict(list)
+        ids = set(s.id for s in spans)
+        for s in spans:
+            children[s.parent if s.parent in ids else None].append(s)
+        lines = []
+
+        def _expand(records, depth):
+            for record in critical_path(records):
+                lines.append("%s%8.3fs %s%s" % (
+                        '    ' * depth, record.duration, record.name,
+                        '' if record.ok else ' (failed)'))
+                _expand(children[record.id], depth + 1)
+
+        _expand(children[None], 0)
+        return '\n'.join(lines)
+
+    def write(self):
+        # type () -> None
+        """Write the trace file, or the part file of a subprocess"""
+        with self._lock:
+            spans = list(self.spans)
+        try:
+            if not self.is_root:
+                part_file = "%s.%d.part" % (self.trace_file, self.pid)
+                with open(part_file, 'w') as out_file:
+                    json.dump([s._asdict() for s in spans], out_file)
+                return
+            spans += self._read_parts()
+            with open(self.trace_file, 'w') as out_file:
+                json.dump({
+                        'traceEvents': Tracer.chrome_events(spans),
+                        'displayTimeUnit': 'ms'}, out_file)
+        except (IOError, OSError) as e:
+            logging.warning("Failed to write trace: %s", e)
+            return
+        logging.info(
+                "Trace written to %s, critical path:\n%s",
+                self.trace_file, Tracer.summary(spans))
+
+
+_tracer = None  # type: Tracer
+_start_lock = threading.Lock()
+
+
+def start(trace_file):
+    # type (str) -> Tracer
+    """Start tracing, the trace is written at exit
+
+    Starting again does nothing.
+    """
+    global _tracer  # pylint: disable=global-statement
+    with _start_lock:
+        if _tracer is None:
+            _tracer = Tracer(trace_file, os.getenv(TRACE_PARENT_ENV))
+            # Inherited by subprocesses which are not started
+            # with trace_env()
+            os.environ[TRACE_ENV] = _tracer.trace_file
+            os.environ[TRACE_PARENT_ENV] = "%d:%d:" % (
+                    _tracer.pid, threading.current_thread().ident)
+            atexit.register(_tracer.write)
+    return _tracer
+
+
+def is_tracing():
+    # type () -> bool
+    """Whether start() has been called"""
+    return _tracer is not None
+
+
+@contextmanager
+def span(name):
+    # type (str) -> Iterator[str]
+    """Record the enclosed block as a span of the current span,
+    yield the span ID, or None if not tracing"""
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    stack = tracer.stack()
+    span_id = tracer.new_id()
+    parent = stack[-1][2] if stack else None
+    thread = threading.current_thread()
+    stack.append((tracer.pid, thread.ident, span_id))
+    start_time = time.time()
+    ok = False
+    try:
+        yield span_id
+        ok = True
+    finally:
+        stack.pop()
+        tracer.add(Span(
+                name, span_id, parent or None, tracer.pid, thread.ident,
+                thread.name, start_time, time.time() - start_time, ok))
+
+
+def bind(func):
+    # type (Any) -> Any
+    """Return func that runs under the current span in any thread,
+    for functions passed to thread pools"""
+    tracer = _tracer
+    if tracer is None:
+        return func
+    stack = tracer.stack()
+    parent = stack[-1] if stack else None
+
+    def _run(*args, **kwargs):
+        thread_stack = tracer.stack()
+        depth = len(thread_stack)
+        if parent:
+            thread_stack.append(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            del thread_stack[depth:]
+    return _run
+
+
+def trace_env(env=None):
+    # type (Dict[str, str]) -> Dict[str, str]
+    """Environment for a subprocess to continue the current span,
+    None if not tracing
+
+    Args:
+        env (Dict[str, str], optional): Defaults to os.environ.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return env
+    stack = tracer.stack()
+    result = dict(os.environ if env is None else env)
+    result[TRACE_ENV] = tracer.trace_file
+    if stack:
+        result[TRACE_PARENT_ENV] = "%d:%d:%s" % stack[-1]
+    return result
+
+
+# Subprocess of a traced process
+if os.getenv(TRACE_ENV) and os.getenv(TRACE_PARENT_ENV, '').split(
+        ':', 1)[0] not in ('', str(os.getpid())):
+    start(os.environ[TRACE_ENV])
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""Benchmark the start-up cost of the Python entry points
+
+For each entry point, this measures:
+    * cold start wall time (median of several runs)
+    * import cost, broken down per module like 'python -X importtime'
+    * peak RSS
+
+Entry points run in a stub environment: HOME, WORK_ROOT and caches are
+in a temporary directory, external commands in PATH are stubs,
+and HTTP(S) proxies point to a closed port, so nothing touches the network.
+
+Results are compared against the committed baseline (baseline.json),
+which also defines the regression thresholds.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import json
+import os
+import shutil
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+SCRIPT_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+sys.path.insert(0, SCRIPT_DIR)
+
+# pylint: disable=wrong-import-position,import-error
+from ZanataArgParser import ZanataArgParser  # noqa: E402
+
+try:
+    from typing import List, Any  # noqa: F401 # pylint: disable=unused-import
+except ImportError:
+    sys.stderr.write("python typing module is not installed" + os.linesep)
+
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# name: script and arguments. Arguments should not need network.
+# '--help' builds every lazy sub-command parser, so a real sub-command
+# is also measured to time the lazy path.
+ENTRY_POINTS = {
+        'ZanataArgParser': ['ZanataArgParser.py'],
+        'ZanataFunctions': ['ZanataFunctions.py', '--help'],
+        'ZanataRpm': ['ZanataRpm.py', '--help'],
+        'ZanataRpmRepo': ['ZanataRpmRepo.py', '--help'],
+        'ZanataRpmRepo.update_repodata': [
+                'ZanataRpmRepo.py', 'update_repodata']}
+
+STUB_COMMANDS = ['curl', 'docker', 'git', 'rsync', 'scp', 'ssh', 'wget']
+
+# Executed in child process to time every import,
+# records are (depth, module, self_seconds, cumulative_seconds)
+IMPORT_TIMER = r'''
+import __builtin__, json, os, resource, runpy, sys, time
+_orig_import = __builtin__.__import__
+_records = []
+_stack = []
+
+
+def _timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return _orig_import(name, *args, **kwargs)
+    depth = len(_stack)
+    _stack.append(0.0)
+    start = time.time()
+    try:
+        return _orig_import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        child = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        _records.append((depth, name, elapsed - child, elapsed))
+
+
+__builtin__.__import__ = _timed_import
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+_status = 0
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit as e:
+    _status = e.code
+with open(os.environ['ZANATA_BENCH_REPORT'], 'w') as report:
+    json.dump({
+        'imports': _records,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+        report)
+sys.exit(_status)
+'''
+
+
+class StubEnvironment(object):
+    """Temporary environment that keeps entry points off the network"""
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='zanata-bench-')
+        bin_dir = os.path.join(self.root, 'bin')
+        os.mkdir(bin_dir)
+        for cmd in STUB_COMMANDS:
+            stub = os.path.join(bin_dir, cmd)
+            with open(stub, 'w') as out_file:
+                out_file.write("#!/bin/sh\necho stub %s \"$@\" >&2\n" % cmd)
+            os.chmod(stub, 0o755)
+
+        self.env = dict(os.environ)
+        self.env.update({
+                'HOME': self.root,
+                'WORK_ROOT': os.path.join(self.root, 'work'),
+                'XDG_CACHE_HOME': os.path.join(self.root, 'cache'),
+                'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+                'http_proxy': 'http://127.0.0.1:9',
+                'https_proxy': 'http://127.0.0.1:9',
+                'no_proxy': '',
+                'LOGGING_NO_COLOR': '1'})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        shutil.rmtree(self.root)
+
+
+def _run_once(cmd_list, env):
+    # type (List[str], dict) -> Tuple[float, int]
+    """Run command, return wall time in ms and peak RSS in KiB
+
+    Raises:
+        CalledProcessError: When command exit status is not 0,
+                so a crashing entry point does not count as fast
+    """
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        proc = subprocess.Popen(  # nosec
+                cmd_list, env=env, cwd=SCRIPT_DIR,
+                stdout=devnull, stderr=devnull)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = (time.time() - start) * 1000
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd_list)
+    return elapsed, rusage.ru_maxrss
+
+
+def _median(values):
+    # type (List[float]) -> float
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[mid]
+    return (ordered[mid - 1] + ordered[mid]) / 2
+
+
+def measure_entry(name, env, repeat):
+    # type (str, dict, int) -> dict
+    """Measure one entry point"""
+    cmd_list = [sys.executable] + ENTRY_POINTS[name]
+
+    # Warm up OS file cache and signature tables
+    _run_once(cmd_list, env)
+    runs = [_run_once(cmd_list, env) for _ in range(repeat)]
+
+    report_file = os.path.join(env['HOME'], "%s-imports.json" % name)
+    import_env = dict(env, ZANATA_BENCH_REPORT=report_file)
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(  # nosec
+                [sys.executable, '-c', IMPORT_TIMER] + ENTRY_POINTS[name],
+                env=import_env, cwd=SCRIPT_DIR,
+                stdout=devnull, stderr=devnull)
+    with open(report_file, 'r') as in_file:
+        report = json.load(in_file)
+
+    return {
+            'wall_ms': round(_median([r[0] for r in runs]), 1),
+            'import_ms': round(sum(
+                    r[3] for r in report['imports'] if r[0] == 0) * 1000, 1),
+            'peak_rss_kb': max(r[1] for r in runs),
+            'imports': report['imports']}
+
+
+def print_imports(name, result, top=15):
+    # type (str, dict, int) -> None
+    """Print the import breakdown like 'python -X importtime'"""
+    print("%s: import time (top %d by cumulative)" % (name, top))
+    print("%12s | %12s | %s" % ('self [us]', 'cumulative', 'imported package'))
+    for depth, module, self_sec, cumulative in sorted(
+            result['imports'], key=lambda r: r[3], reverse=True)[:top]:
+        print("%12d | %12d | %s%s" % (
+                self_sec * 1000000, cumulative * 1000000,
+                '  ' * depth, module))
+
+
+def compare(results, baseline):
+    # type (dict, dict) -> List[str]
+    """Return regression messages against baseline"""
+    thresholds = baseline['thresholds']
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline['entries'].get(name)
+        if not base:
+            continue
+        for key in ['wall_ms', 'import_ms', 'peak_rss_kb']:
+            limit = base[key] * thresholds['ratio'] + thresholds[
+                    'slack_kb' if key == 'peak_rss_kb' else 'slack_ms']
+            if result[key] > limit:
+                regressions.append("%s %s: %s > %s (baseline %s)" % (
+                        name, key, result[key], round(limit, 1), base[key]))
+    return regressions
+
+
+def main():
+    """Run as command line program"""
+    parser = ZanataArgParser(__file__)
+    parser.add_common_argument(
+            '-n', '--repeat', type=int, default=10,
+            help='Number of timed runs per entry point')
+    parser.add_common_argument(
+            '-e', '--entry', action='append', choices=sorted(ENTRY_POINTS),
+            help='Entry point to measure, default all')
+    parser.add_sub_command(
+            'run', None,
+            help='Measure and compare against baseline')
+    parser.add_sub_command(
+            'update-baseline', None,
+            help='Measure and write result as new baseline')
+    parser.add_sub_command(
+            'imports', None,
+            help='Show import time breakdown')
+    args = parser.parse_all()
+
+    with open(BASELINE_FILE, 'r') as in_file:
+        baseline = json.load(in_file)
+
+    results = {}
+    with StubEnvironment() as stub:
+        for name in args.entry or sorted(ENTRY_POINTS):
+            results[name] = measure_entry(name, stub.env, args.repeat)
+            print("%-16s wall %7.1f ms  import %7.1f ms  peak RSS %7d KiB" % (
+                    name, results[name]['wall_ms'],
+                    results[name]['import_ms'],
+                    results[name]['peak_rss_kb']))
+
+    if args.sub_command == 'imports':
+        for name in sorted(results):
+            print_imports(name, results[name])
+    elif args.sub_command == 'update-baseline':
+        for name in results:
+            baseline['entries'][name] = {
+                    k: v for k, v in results[name].items() if k != 'imports'}
+        with open(BASELINE_FILE, 'w') as out_file:
+            json.dump(
+                    baseline, out_file, indent=4, sort_keys=True,
+                    separators=(',', ': '))
+            out_file.write('\n')
+    else:
+        regressions = compare(results, baseline)
+        for msg in regressions:
+            print("REGRESSION: " + msg, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,17 @@
 
 from __future__ import (absolute_import, division, print_function)
 
+import Queue  # pylint: disable=E0401
 import StringIO  # pylint: disable=E0401
+import json
+import logging
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 import ZanataArgParser  # pylint: disable=E0401
+import ZanataTrace  # pylint: disable=E0401
 
 
 def _convert_unicode_str(dictionary):
@@ -105,5 +111,275 @@ class ZanataArgParserTestCase(unittest.TestCase):
         self.assertEqual(home, env_dict['home'])
 
 
+class _SubCommands(object):
+    """Sub-commands for testing"""
+    @classmethod
+    def init_from_parsed_args(cls, args):  # pylint: disable=unused-argument
+        """Init from command line arguments"""
+        return cls()
+
+    @staticmethod
+    def build(spec_file, version='auto'):
+        """Build package
+
+        Longer description"""
+        return (spec_file, version)
+
+    @staticmethod
+    def push():
+        """Push package"""
+        return 'pushed'
+
+
+class _TypedSubCommands(_SubCommands):
+    """Sub-commands with typed defaults for testing"""
+
+    @staticmethod
+    def release(version='auto', jobs=1, keep_going=False):
+        """Release package"""
+        return (version, jobs, keep_going)
+
+
+class _FailingSubCommands(_SubCommands):
+    """Sub-command that exits with non-zero for testing"""
+
+    @staticmethod
+    def fail(status=3):
+        """Exit with status"""
+        sys.exit(status)
+
+
+class LazySubCommandTestCase(unittest.TestCase):
+    """Test add_methods_as_sub_commands with lazy=True"""
+
+    def setUp(self):
+        self.cache_home = tempfile.mkdtemp()
+        self.orig_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.cache_home
+
+    def tearDown(self):
+        if self.orig_cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.orig_cache_home
+        shutil.rmtree(self.cache_home)
+
+    def _new_parser(self):
+        parser = ZanataArgParser.ZanataArgParser('lazy-test')
+        parser.add_methods_as_sub_commands(_SubCommands, lazy=True)
+        return parser
+
+    def test_lazy_build(self):
+        """Only the selected sub-command is built"""
+        parser = self._new_parser()
+        self.assertEqual(['build', 'push'], list(parser.lazy_sub_commands))
+        args = parser.parse_all(['build', 'zanata.spec'])
+        self.assertEqual(['push'], list(parser.lazy_sub_commands))
+        self.assertEqual(
+                ('zanata.spec', 'auto'), parser.run_sub_command(args))
+
+    def test_signature_table(self):
+        """Signature table is saved and reused"""
+        self._new_parser()
+        table_path = ZanataArgParser.ZanataArgParser._signature_table_path(
+                _SubCommands)
+        self.assertTrue(os.path.exists(table_path))
+
+        # Parser from the signature table behaves the same
+        parser = self._new_parser()
+        args = parser.parse_all(['build', 'zanata.spec', '4.7.0'])
+        self.assertEqual(
+                ('zanata.spec', '4.7.0'), parser.run_sub_command(args))
+        args = parser.parse_all(['push'])
+        self.assertEqual('pushed', parser.run_sub_command(args))
+
+    def test_typed_defaults(self):
+        """bool defaults become flags, int defaults become options"""
+        parser = ZanataArgParser.ZanataArgParser('typed-test')
+        parser.add_methods_as_sub_commands(_TypedSubCommands, 'release')
+        args = parser.parse_all(['release'])
+        self.assertEqual(('auto', 1, False), parser.run_sub_command(args))
+        args = parser.parse_all(
+                ['release', '4.7.0', '--jobs', '2', '--keep-going'])
+        self.assertEqual(('4.7.0', 2, True), parser.run_sub_command(args))
+
+    def test_run_batch(self):
+        """Test batch mode with lines and JSON list"""
+        script = os.path.join(self.cache_home, 'batch.txt')
+        with open(script, 'w') as out_file:
+            out_file.write(
+                    "# comment\n"
+                    "build zanata.spec 4.7.0\n"
+                    "\n"
+                    "no-such-command\n"
+                    "push\n")
+        parser = self._new_parser()
+        parser.add_batch_sub_command()
+        results = parser.run_batch(script)
+        self.assertEqual(
+                ['build zanata.spec 4.7.0', 'no-such-command', 'push'],
+                [r.command for r in results])
+        self.assertEqual([0, 2, 0], [r.status for r in results])
+
+        results = parser.run_batch(script, stop_on_error=True)
+        self.assertEqual([0, 2], [r.status for r in results])
+
+        with open(script, 'w') as out_file:
+            out_file.write('["push", ["build", "a b.spec"]]')
+        results = parser.run_batch(script)
+        self.assertEqual(
+                ['push', 'build a b.spec'], [r.command for r in results])
+        self.assertEqual([0, 0], [r.status for r in results])
+
+    def test_profile(self):
+        """Test --profile writes the profile output"""
+        for mode in ['cprofile', 'sample']:
+            output = os.path.join(self.cache_home, "%s.txt" % mode)
+            parser = self._new_parser()
+            args = parser.parse_all([
+                    'push', '--profile', mode, '--profile-output', output])
+            self.assertFalse(hasattr(args, 'profile'))
+            self.assertEqual('pushed', parser.run_sub_command(args))
+            self.assertTrue(os.path.exists(output))
+
+        # Given before the sub-command
+        output = os.path.join(self.cache_home, 'before.txt')
+        parser = self._new_parser()
+        args = parser.parse_all([
+                '--profile', 'cprofile', '--profile-output', output, 'push'])
+        self.assertEqual('pushed', parser.run_sub_command(args))
+        self.assertTrue(os.path.exists(output))
+
+    def test_trace(self):
+        """Test --trace starts tracing, before or after the sub-command"""
+        started = []
+        orig_start = ZanataTrace.start
+        ZanataTrace.start = started.append
+        try:
+            for argv in [['push', '--trace', 'after.json'],
+                         ['--trace', 'before.json', 'push']]:
+                parser = self._new_parser()
+                args = parser.parse_all(argv)
+                self.assertFalse(hasattr(args, 'trace'))
+        finally:
+            ZanataTrace.start = orig_start
+        self.assertEqual(['after.json', 'before.json'], started)
+
+
+class FormatterTestCase(unittest.TestCase):
+    """Test ColoredFormatter and JsonLinesFormatter"""
+
+    def setUp(self):
+        self.record = logging.LogRecord(
+                'root', logging.INFO, __file__, 1, 'hello %s', ('world',),
+                None)
+
+    def test_colored_formatter(self):
+        """Records are formatted with color and are not modified"""
+        formatter = ZanataArgParser.ColoredFormatter(
+                '[%(levelname)s] %(message)s', use_color=True)
+        self.assertEqual(
+                '[\033[36;40mINFO\033[0m] \033[36;40mhello world\033[0m',
+                formatter.format(self.record))
+        self.assertEqual('INFO', self.record.levelname)
+
+        formatter = ZanataArgParser.ColoredFormatter(
+                '[%(levelname)s] %(message)s', use_color=False)
+        self.assertEqual('[INFO] hello world', formatter.format(self.record))
+
+    def test_ring_buffer_handler(self):
+        """Only the latest records are kept and dumped"""
+        dump_file = tempfile.mktemp()
+        handler = ZanataArgParser.RingBufferHandler(2, dump_file)
+        for i in range(3):
+            handler.emit(logging.LogRecord(
+                    'root', logging.DEBUG, __file__, 1, 'record %d', (i,),
+                    None))
+        self.assertEqual(dump_file, handler.dump())
+        with open(dump_file, 'r') as in_file:
+            lines = in_file.readlines()
+        os.remove(dump_file)
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[0].endswith('record 1\n'))
+        self.assertTrue(lines[1].endswith('record 2\n'))
+
+    def test_ring_buffer_handler_copies(self):
+        """Arguments are merged and tracebacks are not kept alive"""
+        dump_file = tempfile.mktemp()
+        handler = ZanataArgParser.RingBufferHandler(2, dump_file)
+        values = ['before']
+        handler.emit(logging.LogRecord(
+                'root', logging.DEBUG, __file__, 1, 'value %s', (values,),
+                None))
+        values[0] = 'after'
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            record = logging.LogRecord(
+                    'root', logging.ERROR, __file__, 1, 'failed', None,
+                    sys.exc_info())
+        handler.emit(record)
+        self.assertIsNotNone(record.exc_info)
+        self.assertIsNone(handler.records[1].exc_info)
+
+        handler.dump()
+        with open(dump_file, 'r') as in_file:
+            content = in_file.read()
+        os.remove(dump_file)
+        self.assertIn("value ['before']", content)
+        self.assertIn('ValueError: broken', content)
+
+    def test_queue_listener(self):
+        """Records are written by the listener thread after stop()"""
+        log_queue = Queue.Queue()
+        output = StringIO.StringIO()
+        s_handler = logging.StreamHandler(output)
+        s_handler.setFormatter(logging.Formatter('%(message)s'))
+        listener = ZanataArgParser.QueueListener(log_queue, s_handler)
+        listener.start()
+        handler = ZanataArgParser.QueueHandler(log_queue)
+        values = ['before']
+        handler.emit(logging.LogRecord(
+                'root', logging.INFO, __file__, 1, 'value %s', (values,),
+                None))
+        values[0] = 'after'
+        listener.stop()
+        self.assertEqual("value ['before']\n", output.getvalue())
+
+    def test_dump_debug_log(self):
+        """Debug log is dumped on uncaught exception and non-zero exit"""
+        dump_file = tempfile.mktemp()
+        parser_class = ZanataArgParser.ZanataArgParser
+        orig_handler = parser_class._ring_buffer_handler
+        parser_class._ring_buffer_handler = ZanataArgParser.RingBufferHandler(
+                10, dump_file)
+        try:
+            hooked = []
+            excepthook = parser_class._dump_debug_log_excepthook(
+                    lambda *a: hooked.append(a[0]))
+            excepthook(ValueError, ValueError('broken'), None)
+            self.assertEqual([ValueError], hooked)
+            self.assertTrue(os.path.exists(dump_file))
+            os.remove(dump_file)
+
+            parser = parser_class('dump-test')
+            parser.add_methods_as_sub_commands(_FailingSubCommands, 'fail')
+            args = parser.parse_all(['fail'])
+            with self.assertRaises(SystemExit):
+                parser.run_sub_command(args)
+            self.assertTrue(os.path.exists(dump_file))
+        finally:
+            parser_class._ring_buffer_handler = orig_handler
+            if os.path.exists(dump_file):
+                os.remove(dump_file)
+
+    def test_json_lines_formatter(self):
+        """Records are formatted as JSON"""
+        entry = json.loads(
+                ZanataArgParser.JsonLinesFormatter().format(self.record))
+        self.assertEqual('INFO', entry['level'])
+        self.assertEqual('hello world', entry['message'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""Test the ZanataDocker"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+import urlparse
+import ZanataDocker  # pylint: disable=E0401
+
+
+class _FakeDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Docker daemon stand-in which records requests"""
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        SocketServer.UnixStreamServer.__init__(
+                self, socket_path, _FakeHandler)
+        self.requests = []
+        self.volumes = set()
+        # name: [id, created, size]
+        self.images = {}
+        self.containers = {}
+
+
+class _FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return 'unix'
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _reply(self, status, body=None, raw=None):
+        data = raw if raw is not None else json.dumps(body or {})
+        self.send_response(status)
+        self.send_header(
+                'Content-Type', 'application/vnd.docker.raw-stream'
+                if raw is not None else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        path = url.path.split('/', 2)[2]
+        params = dict(urlparse.parse_qsl(url.query))
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        server.requests.append((self.command, path))
+        parts = path.split('/')
+
+        if path == 'volumes/create':
+            server.volumes.add(body['Name'])
+            return self._reply(201, {'Name': body['Name']})
+        if parts[0] == 'volumes':
+            if parts[1] in server.volumes:
+                return self._reply(200, {'Name': parts[1]})
+            return self._reply(404, {'message': 'no such volume'})
+        if path == 'images/create':
+            name = "%s:%s" % (params['fromImage'], params['tag'])
+            server.images[name] = [
+                    'sha256:' + name, len(server.images), 1024 * 1024]
+            return self._reply(200)
+        if path == 'images/json':
+            return self._reply(200, [
+                    {'Id': i, 'RepoTags': [n], 'Created': c, 'Size': s}
+                    for n, (i, c, s) in server.images.items()])
+        if parts[0] == 'images':
+            if self.command == 'GET':
+                name = '/'.join(parts[1:-1])
+            else:
+                name = '/'.join(parts[1:])
+            for image_name, image in server.images.items():
+                if name not in (image_name, image[0]):
+                    continue
+                if self.command == 'DELETE':
+                    del server.images[image_name]
+                    return self._reply(200, [])
+                return self._reply(200, {
+                        'Id': image[0], 'RepoDigests': [
+                                image_name.split(':')[0] + '@sha256:d']})
+            return self._reply(404, {'message': 'no such image'})
+        if path == 'containers/create':
+            if body['Image'] not in list(server.images) + [
+                    i[0] for i in server.images.values()]:
+                return self._reply(404, {'message': 'no such image'})
+            server.containers[params['name']] = body
+            return self._reply(201, {'Id': params['name']})
+        name = parts[1]
+        if name not in server.containers:
+            return self._reply(404, {'message': 'no such container'})
+        if parts[-1] == 'logs':
+            out = b''
+            for arg in server.containers[name]['Cmd']:
+                line = arg + b'\n'
+                out += struct.pack('>BxxxI', 1, len(line)) + line
+            out += struct.pack('>BxxxI', 2, 4) + b'err\n'
+            return self._reply(200, raw=out)
+        if parts[-1] == 'wait':
+            return self._reply(200, {'StatusCode': 3})
+        if self.command == 'DELETE':
+            del server.containers[name]
+        return self._reply(204, raw=b'')
+
+    do_GET = _handle
+    do_POST = _handle
+    do_DELETE = _handle
+
+
+class DockerClientTestCase(unittest.TestCase):
+    """Test DockerClient against a fake daemon"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(self.tmp_dir, 'docker.sock')
+        self.daemon = _FakeDaemon(socket_path)
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = ZanataDocker.DockerClient(socket_path)
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.daemon.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ensure_volume(self):
+        """Test volume is only created once"""
+        self.client.ensure_volume('zanata-el-7-repo')
+        self.client.ensure_volume('zanata-el-7-repo')
+        self.assertEqual(
+                [('GET', 'volumes/zanata-el-7-repo'),
+                 ('POST', 'volumes/create'),
+                 ('GET', 'volumes/zanata-el-7-repo')],
+                self.daemon.requests)
+        self.assertIsNone(self.client.image_inspect('centos:7'))
+
+    def test_run(self):
+        """Test run pulls the image, streams logs and removes container"""
+        lines = []
+        status = self.client.run(
+                'zanata/builder:7', ['-u', '4.6.0'], 'el7-build',
+                ['vol:/repo:Z'],
+                lambda stream, line: lines.append((stream, line)))
+        self.assertEqual(3, status)
+        self.assertEqual(
+                [('stdout', '-u'), ('stdout', '4.6.0'), ('stderr', 'err')],
+                lines)
+        self.assertEqual({}, self.daemon.containers)
+        self.assertIn(('POST', 'images/create'), self.daemon.requests)
+        self.assertFalse(self.client.container_stop('el7-build'))
+
+        with self.assertRaises(ZanataDocker.DockerError) as context:
+            self.client.request('GET', '/containers/missing/json')
+        self.assertEqual(404, context.exception.status)
+
+    def test_image_pool(self):
+        """Test images are pinned by ID and stale images are removed"""
+        for tag in ['5', '6']:
+            self.client.image_pull('zanata/builder:' + tag)
+        pool = ZanataDocker.ImagePool(self.client, jobs=2)
+        pool.prefetch(['zanata/builder:7', 'zanata/builder:8'])
+        image_id = pool.pin('zanata/builder:7')
+        self.assertEqual('sha256:zanata/builder:7', image_id)
+        self.assertEqual(
+                'zanata/builder@sha256:d', pool.digest('zanata/builder:8'))
+        self.client.run(
+                image_id, ['true'], 'el7-build', log_line=lambda *_: None)
+        self.assertEqual(
+                1, self.daemon.requests.count(('POST', 'containers/create')))
+        pool.close()
+
+        self.assertEqual(
+                ['sha256:zanata/builder:5', 'sha256:zanata/builder:6'],
+                pool.gc('docker.io/zanata/builder', budget_mb=2))
+        self.assertEqual(
+                ['zanata/builder:7', 'zanata/builder:8'],
+                sorted(self.daemon.images))
+        self.assertEqual(
+                [], pool.gc('docker.io/zanata/builder', budget_mb=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,11 +3,29 @@
 
 from __future__ import (absolute_import, division, print_function)
 
+import BaseHTTPServer  # pylint: disable=import-error
+import hashlib
+import os
 import subprocess  # nosec
+import tempfile
+import threading
 import unittest
 import ZanataFunctions
 
 
+class _NoTimingsTestCase(unittest.TestCase):
+    """Keep timed() from writing to the real timings file"""
+    def setUp(self):
+        self.orig_timings_file = os.environ.get('ZANATA_TIMINGS_FILE')
+        os.environ['ZANATA_TIMINGS_FILE'] = ''
+
+    def tearDown(self):
+        if self.orig_timings_file is None:
+            del os.environ['ZANATA_TIMINGS_FILE']
+        else:
+            os.environ['ZANATA_TIMINGS_FILE'] = self.orig_timings_file
+
+
 class ZanataFunctionsTestCase(unittest.TestCase):
     """Test Case for ZanataFunctions"""
     def test_read_env(self):
@@ -17,10 +35,11 @@ class ZanataFunctionsTestCase(unittest.TestCase):
         self.assertEqual(zanata_env['EXIT_OK'], '0')
 
 
-class SshHostTestCase(unittest.TestCase):
+class SshHostTestCase(_NoTimingsTestCase):
     """Test SSH with localhost
     thus set up password less SSH is required"""
     def setUp(self):
+        super(SshHostTestCase, self).setUp()
         self.ssh_host = ZanataFunctions.SshHost('localhost')
 
     def test_run_check_call(self):
@@ -32,5 +51,129 @@ class SshHostTestCase(unittest.TestCase):
                 'false')
 
 
+class _RecordingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Record the uploaded body and headers"""
+    requests = []
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Handle POST"""
+        if self.headers.getheader('Transfer-Encoding') == 'chunked':
+            body = ''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if size == 0:
+                    break
+        else:
+            body = self.rfile.read(
+                    int(self.headers.getheader('Content-Length')))
+        _RecordingHandler.requests.append((self.headers, body))
+        self.send_response(201)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('OK')
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle GET, challenge when Authorization is missing"""
+        _RecordingHandler.requests.append((self.headers, ''))
+        if not self.headers.getheader('Authorization'):
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="test"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('OK')
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class UrlHelperTestCase(_NoTimingsTestCase):
+    """Test UrlHelper with a local HTTP server"""
+    def setUp(self):
+        super(UrlHelperTestCase, self).setUp()
+        _RecordingHandler.requests = []
+        self.server = BaseHTTPServer.HTTPServer(
+                ('127.0.0.1', 0), _RecordingHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = "http://127.0.0.1:%d/" % self.server.server_port
+        self.helper = ZanataFunctions.UrlHelper(
+                self.base_url, 'user', 'token')
+        fd, self.src_file = tempfile.mkstemp()
+        self.content = os.urandom(300 * 1024)
+        os.write(fd, self.content)
+        os.close(fd)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.src_file)
+        ZanataFunctions.HTTPBasicAuthHandler.clear_auth_cache()
+        super(UrlHelperTestCase, self).tearDown()
+
+    def test_preemptive_auth(self):
+        """Test preemptive authentication and the credential cache"""
+        self.assertEqual('OK', ZanataFunctions.UrlHelper.read(self.base_url))
+        # Challenged first, then retried with credentials
+        self.assertEqual(2, len(_RecordingHandler.requests))
+
+        _RecordingHandler.requests = []
+        ZanataFunctions.UrlHelper(
+                self.base_url, 'user', 'token', preemptive_auth=True)
+        self.assertEqual('OK', ZanataFunctions.UrlHelper.read(self.base_url))
+        self.assertEqual(1, len(_RecordingHandler.requests))
+
+        # Another instance without credentials reuses the cached header
+        _RecordingHandler.requests = []
+        ZanataFunctions.UrlHelper(
+                self.base_url, None, None, preemptive_auth=True)
+        self.assertEqual('OK', ZanataFunctions.UrlHelper.read(self.base_url))
+        self.assertEqual(1, len(_RecordingHandler.requests))
+
+    def test_auth_cache_scope(self):
+        """Test cached header is not reused outside the base or scheme"""
+        base_url = self.base_url + 'rest/'
+        helper = ZanataFunctions.UrlHelper(base_url, 'user', 'token')
+        self.assertIsNotNone(
+                helper.auth_handler.get_auth_header(base_url + 'files'))
+        handler = ZanataFunctions.HTTPBasicAuthHandler(preemptive=True)
+        self.assertIsNotNone(handler.get_auth_header(base_url + 'files'))
+        self.assertIsNone(handler.get_auth_header(self.base_url + 'other'))
+        self.assertIsNone(handler.get_auth_header(
+                base_url.replace('http:', 'https:') + 'files'))
+
+    def test_upload_file(self):
+        """Test UrlHelper.upload_file with Content-Length and chunked"""
+        for chunked in [False, True]:
+            result = self.helper.upload_file(
+                    self.base_url + 'upload', self.src_file,
+                    chunked=chunked, chunk_size=64 * 1024)
+            self.assertEqual(201, result.status)
+            self.assertEqual(len(self.content), result.size)
+            self.assertEqual(
+                    hashlib.sha256(self.content).hexdigest(),
+                    result.checksum)
+            headers, body = _RecordingHandler.requests[-1]
+            self.assertEqual(self.content, body)
+            self.assertTrue(
+                    headers.getheader('Authorization').startswith('Basic '))
+
+    def test_upload_files(self):
+        """Test UrlHelper.upload_files"""
+        results = self.helper.upload_files([
+                (self.base_url + 'a', self.src_file),
+                (self.base_url + 'b', self.src_file)])
+        self.assertEqual(
+                [self.base_url + 'a', self.base_url + 'b'],
+                [r.url for r in results])
+        self.assertEqual(2, len(_RecordingHandler.requests))
+
+
 if __name__ == '__main__':
     unittest.main()
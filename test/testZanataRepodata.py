@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""Test the ZanataRepodata"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import ZanataRepodata  # pylint: disable=E0401
+import ZanataRpmRepo  # pylint: disable=E0401
+from .testZanataRpmHeader import write_rpm
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <revision>1</revision>
+  <data type="primary">
+    <checksum type="sha256">abc</checksum>
+    <location href="repodata/abc-primary.xml.gz"/>
+    <timestamp>1514764800</timestamp>
+    <size>100</size>
+  </data>
+</repomd>
+"""
+
+PACKAGE = """<package type="rpm">
+  <name>{name}</name>
+  <arch>{arch}</arch>
+  <version epoch="0" ver="{version}" rel="{release}"/>
+  <summary>Zanata</summary>
+</package>
+"""
+
+SPEC = """Name: zanata-cli-bin
+Version: 4.6.0
+Release: 1%{?dist}
+
+%changelog
+"""
+
+
+def write_repo(repo_dir, packages):
+    """Write minimal repodata of (name, version, release, arch) packages"""
+    os.makedirs(os.path.join(repo_dir, 'repodata'))
+    with open(os.path.join(repo_dir, 'repodata', 'repomd.xml'), 'w') as f:
+        f.write(REPOMD)
+    primary = gzip.open(
+            os.path.join(repo_dir, 'repodata', 'abc-primary.xml.gz'), 'wb')
+    primary.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<metadata xmlns="http://linux.duke.edu/metadata/common"'
+            ' packages="%d">\n' % len(packages))
+    for name, version, release, arch in packages:
+        primary.write(PACKAGE.format(
+                name=name, version=version, release=release, arch=arch))
+    primary.write('</metadata>\n')
+    primary.close()
+
+
+class RepodataTestCase(unittest.TestCase):
+    """Test reading repodata"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        write_repo(os.path.join(self.tmp_dir, 'epel-7', 'x86_64'), [
+                ('zanata-cli-bin', '4.5.0', '1.el7', 'noarch'),
+                ('zanata-cli-bin', '4.6.0', '1.el7', 'noarch')])
+        write_repo(os.path.join(self.tmp_dir, 'epel-7', 'SRPMS'), [
+                ('zanata-cli-bin', '4.6.0', '1.el7', 'src')])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_published_nevras(self):
+        """Test NEVRA set over all repositories of a dist"""
+        dist_dir = os.path.join(self.tmp_dir, 'epel-7')
+        self.assertEqual(
+                'repodata/abc-primary.xml.gz',
+                ZanataRepodata.read_repomd(
+                        os.path.join(dist_dir, 'SRPMS'))['primary']['href'])
+        nevras = ZanataRepodata.published_nevras(dist_dir)
+        self.assertEqual(3, len(nevras))
+        self.assertIn(
+                ZanataRepodata.Nevra(
+                        'zanata-cli-bin', '0', '4.6.0', '1.el7', 'src'),
+                nevras)
+        self.assertTrue(ZanataRepodata.is_published(
+                nevras, 'zanata-cli-bin', '4.5.0', '1.el7'))
+        self.assertFalse(ZanataRepodata.is_published(
+                nevras, 'zanata-cli-bin', '4.7.0', '1.el7'))
+        self.assertIn(('zanata-cli-bin', '4.6.0', '1.el7'), nevras.nvrs)
+        self.assertTrue(ZanataRepodata.is_published(
+                set(nevras), 'zanata-cli-bin', '4.6.0', '1.el7'))
+
+    def test_el_repo_is_published(self):
+        """Test ElRepo checks the spec release against repodata"""
+        with open(os.path.join(self.tmp_dir, 'zanata.spec'), 'w') as f:
+            f.write(SPEC)
+        self.assertTrue(ZanataRpmRepo.ElRepo('7', self.tmp_dir).is_published(
+                'zanata.spec', '4.6.0'))
+        self.assertFalse(ZanataRpmRepo.ElRepo('7', self.tmp_dir).is_published(
+                'zanata.spec', '4.7.0'))
+        self.assertFalse(ZanataRpmRepo.ElRepo('6', self.tmp_dir).is_published(
+                'zanata.spec', '4.6.0'))
+
+
+class RepodataUpdaterTestCase(unittest.TestCase):
+    """Test incremental repodata update"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo_dir = os.path.join(self.tmp_dir, 'epel-7', 'x86_64')
+        os.makedirs(self.repo_dir)
+        self.cache = ZanataRepodata.RepodataCache(
+                os.path.join(self.tmp_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_rpm(self, version):
+        path = os.path.join(self.repo_dir, "zanata-cli-bin-%s.rpm" % version)
+        write_rpm(path, 'zanata-cli-bin', version, '1.el7')
+        return path
+
+    def _update(self):
+        return ZanataRepodata.RepodataUpdater(
+                self.repo_dir, self.cache).update()
+
+    def test_update(self):
+        """Test only changed packages cause a rewrite"""
+        self._write_rpm('4.5.0')
+        self._write_rpm('4.6.0')
+        summary = self._update()
+        self.assertEqual(2, summary['added'])
+        self.assertTrue(summary['written'])
+        self.assertEqual(
+                ['4.5.0', '4.6.0'],
+                sorted(n.version for n in ZanataRepodata.published_nevras(
+                        self.tmp_dir)))
+        repomd = ZanataRepodata.read_repomd(self.repo_dir)
+        self.assertEqual(
+                ['filelists', 'other', 'primary'], sorted(repomd))
+
+        summary = self._update()
+        self.assertEqual(2, summary['unchanged'])
+        self.assertFalse(summary['written'])
+
+        os.remove(os.path.join(self.repo_dir, 'zanata-cli-bin-4.5.0.rpm'))
+        self._write_rpm('4.7.0')
+        summary = self._update()
+        self.assertEqual(
+                (1, 1, 1),
+                (summary['added'], summary['removed'], summary['unchanged']))
+        self.assertEqual(
+                ['4.6.0', '4.7.0'],
+                sorted(n.version for n in ZanataRepodata.published_nevras(
+                        self.tmp_dir)))
+        # Old metadata files are removed
+        self.assertEqual(4, len(os.listdir(
+                os.path.join(self.repo_dir, 'repodata'))))
+
+    def test_update_copies_unchanged(self):
+        """Test entries of unchanged packages are copied, not regenerated"""
+        self._write_rpm('4.5.0')
+        self._write_rpm('4.6.0')
+        self._update()
+        reads = []
+        orig_get = self.cache.get
+        self.cache.get = lambda pkgid: reads.append(pkgid) or orig_get(pkgid)
+
+        self._write_rpm('4.7.0')
+        summary = self._update()
+        self.assertEqual((1, 2), (summary['added'], summary['unchanged']))
+        self.assertEqual(1, len(reads))
+        repomd = ZanataRepodata.read_repomd(self.repo_dir)
+        for metadata_type in ZanataRepodata.METADATA_TYPES:
+            with gzip.open(os.path.join(
+                    self.repo_dir, repomd[metadata_type]['href'])) as f:
+                text = f.read()
+            self.assertIn('packages="3"', text)
+            self.assertEqual(3, text.count('</package>'))
+        self.assertEqual(
+                ['4.5.0', '4.6.0', '4.7.0'],
+                sorted(n.version for n in ZanataRepodata.published_nevras(
+                        self.tmp_dir)))
+
+        # Unreadable old filelists, entries are generated again
+        with open(os.path.join(
+                self.repo_dir, repomd['filelists']['href']), 'w') as f:
+            f.write('broken')
+        del reads[:]
+        os.remove(os.path.join(self.repo_dir, 'zanata-cli-bin-4.5.0.rpm'))
+        summary = self._update()
+        self.assertEqual((1, 2), (summary['removed'], summary['unchanged']))
+        self.assertEqual(2, len(reads))
+        self.assertEqual(
+                ['4.6.0', '4.7.0'],
+                sorted(n.version for n in ZanataRepodata.published_nevras(
+                        self.tmp_dir)))
+
+    def test_update_unsupported_compression(self):
+        """Test primary written by newer createrepo_c is rebuilt"""
+        self._write_rpm('4.6.0')
+        repodata_dir = os.path.join(self.repo_dir, 'repodata')
+        os.makedirs(repodata_dir)
+        with open(os.path.join(repodata_dir, 'repomd.xml'), 'w') as f:
+            f.write(REPOMD.replace('abc-primary.xml.gz', 'abc-primary.xml.xz'))
+        with open(os.path.join(repodata_dir, 'abc-primary.xml.xz'), 'w') as f:
+            f.write('\xfd7zXZ\0')
+        summary = self._update()
+        self.assertEqual(1, summary['added'])
+        self.assertTrue(summary['written'])
+
+
+if __name__ == '__main__':
+    unittest.main()
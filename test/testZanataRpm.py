@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""Test the ZanataRpm"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+import ZanataRpm  # pylint: disable=E0401
+
+SPEC = """%global upstream_name zanata-cli
+%define dist_tag %{?dist}%{!?dist:.el7}
+Name:    %{upstream_name}-bin
+Version: 4.6.0
+Release: 1%{?dist}
+Summary: Zanata command line client
+
+%package javadoc
+Summary: Javadoc of %{name}
+Version: 1.0
+
+%description
+Zanata CLI
+Version: in description is not a tag
+
+%prep
+%setup -q
+
+%files
+%doc README.md
+
+%changelog
+* Mon Jan 01 2018 noreply@zanata.org 4.6.0-1
+- Initial package
+"""
+
+
+class RpmSpecTestCase(unittest.TestCase):
+    """Test RpmSpec parsing and editing"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spec_file = os.path.join(self.tmp_dir, 'zanata-cli-bin.spec')
+        with open(self.spec_file, 'w') as out_file:
+            out_file.write(SPEC)
+        self.spec = ZanataRpm.RpmSpec.init_from_file(self.spec_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_index(self):
+        """Test tags, sections and macros are indexed"""
+        self.assertEqual('4.6.0', getattr(self.spec, 'Version'))
+        self.assertEqual('1%{?dist}', getattr(self.spec, 'Release'))
+        self.assertEqual('1.0', self.spec.get_tag('Version', 'javadoc'))
+        self.assertEqual(
+                [3], self.spec.tag_index[(None, 'Version')])
+        self.assertEqual(
+                ['package', 'description', 'prep', 'files', 'changelog'],
+                [sec[0] for sec in self.spec.section_index])
+        self.assertEqual(
+                ['upstream_name', 'dist_tag'],
+                list(self.spec.macro_index))
+
+    def test_expand_macros(self):
+        """Test macro expansion"""
+        self.assertEqual(
+                'zanata-cli-bin', self.spec.get_tag('Name', expand=True))
+        self.assertEqual(
+                'Javadoc of zanata-cli-bin',
+                self.spec.get_tag('Summary', 'javadoc', expand=True))
+        self.assertEqual('1', self.spec.get_tag('Release', expand=True))
+        self.assertEqual(
+                '1.el6', self.spec.expand_macros(
+                        '%{release}', {'dist': '.el6'}))
+        self.assertEqual('.el7', self.spec.expand_macros('%{dist_tag}'))
+        self.assertEqual('%{unknown}', self.spec.expand_macros('%{unknown}'))
+
+    def test_update_version(self):
+        """Test only indexed lines are edited"""
+        self.assertFalse(self.spec.update_version('4.6.0'))
+        self.assertTrue(self.spec.update_version('4.7.0'))
+        self.assertEqual('2%{?dist}', self.spec.bump_release())
+        self.spec.write_to_file(self.spec_file)
+
+        with open(self.spec_file, 'r') as in_file:
+            lines = in_file.read().split('\n')
+        self.assertEqual('Version: 4.7.0', lines[3])
+        self.assertEqual('Release: 2%{?dist}', lines[4])
+        self.assertEqual('Version: 1.0', lines[9])
+        self.assertIn('Version: in description is not a tag', lines)
+        changelog_idx = lines.index('%changelog')
+        self.assertTrue(lines[changelog_idx + 1].endswith(' 4.7.0-1'))
+        self.assertEqual(
+                '- Upgrade to upstream version 4.7.0',
+                lines[changelog_idx + 2])
+        self.assertEqual(
+                changelog_idx,
+                self.spec.get_sections('changelog')[0][2])
+
+    def test_stream_update_version(self):
+        """Test streaming edits give the same result as in-memory edits"""
+        self.assertTrue(self.spec.update_version('4.7.0'))
+        self.spec.bump_release()
+        expected = str(self.spec) + '\n'
+
+        self.assertFalse(
+                ZanataRpm.RpmSpec.stream_update_version(
+                        self.spec_file, '4.6.0'))
+        self.assertTrue(ZanataRpm.RpmSpec.transform_file(self.spec_file, [
+                ZanataRpm.SetTagEdit('Version', '4.7.0'),
+                ZanataRpm.BumpReleaseEdit(),
+                ZanataRpm.ChangelogEntryEdit(
+                        ZanataRpm.RpmSpec.version_changelog_entry('4.7.0'))]))
+        with open(self.spec_file, 'r') as in_file:
+            self.assertEqual(expected, in_file.read())
+        self.assertEqual([], [
+                f for f in os.listdir(self.tmp_dir) if f.endswith('.tmp')])
+
+    def test_stream_failure(self):
+        """Test failed transform leaves the spec file untouched"""
+        class _FailingEdit(ZanataRpm.SpecEdit):
+            def apply(self, token, line):
+                if token.kind == 'section':
+                    raise ValueError("Failed")
+                self.changed = True
+                return ['']
+
+        self.assertRaises(
+                ValueError, ZanataRpm.RpmSpec.transform_file,
+                self.spec_file, [_FailingEdit()])
+        with open(self.spec_file, 'r') as in_file:
+            self.assertEqual(SPEC, in_file.read())
+        self.assertEqual(['zanata-cli-bin.spec'], os.listdir(self.tmp_dir))
+
+
+class BulkUpdateTestCase(unittest.TestCase):
+    """Test bulk-update"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for name in ['a', 'b', 'c']:
+            with open(os.path.join(self.tmp_dir, name + '.spec'), 'w') as f:
+                f.write(SPEC)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read(self, name):
+        with open(os.path.join(self.tmp_dir, name + '.spec'), 'r') as f:
+            return f.read()
+
+    def test_bulk_update(self):
+        """Test manifest entries are applied with a shared template"""
+        manifest = os.path.join(self.tmp_dir, 'manifest.txt')
+        with open(manifest, 'w') as out_file:
+            out_file.write(
+                    "# spec version release changes\n"
+                    "a.spec 4.7.0\n"
+                    "b.spec 4.6.0 bump 'Rebuild for EL8'\n"
+                    "c.spec 4.6.0\n"
+                    "missing.spec 4.7.0\n")
+        results = ZanataRpm.bulk_update(
+                ZanataRpm.read_bulk_manifest(manifest), jobs=2,
+                template=ZanataRpm.ChangelogTemplate(
+                        'Tue Jan 02 2018', 'dev@example.com'))
+
+        self.assertEqual(
+                ['updated', 'updated', 'unchanged', 'failed'],
+                [r.status for r in results])
+        self.assertEqual('2%{?dist}', results[1].release)
+        self.assertIn(
+                "%changelog\n"
+                "* Tue Jan 02 2018 dev@example.com 4.7.0-1\n"
+                "- Upgrade to upstream version 4.7.0\n\n",
+                self._read('a'))
+        self.assertIn(
+                "Release: 2%{?dist}\n", self._read('b'))
+        self.assertIn(
+                "* Tue Jan 02 2018 dev@example.com 4.6.0-2\n"
+                "- Rebuild for EL8\n",
+                self._read('b'))
+        self.assertEqual(SPEC, self._read('c'))
+
+    def test_bulk_update_same_spec(self):
+        """Test a spec listed twice does not share a temporary file"""
+        entries = [
+                {'spec_file': os.path.join(self.tmp_dir, 'a.spec'),
+                 'version': '4.7.0', 'release': None}] * 4
+        results = ZanataRpm.bulk_update(entries, jobs=4)
+        self.assertNotIn('failed', [r.status for r in results])
+        self.assertIn('Version: 4.7.0\n', self._read('a'))
+        self.assertEqual(
+                ['a.spec', 'b.spec', 'c.spec'],
+                sorted(os.listdir(self.tmp_dir)))
+
+        # Every edit lands, in manifest order
+        entries = [
+                {'spec_file': os.path.join(self.tmp_dir, 'b.spec'),
+                 'version': '4.6.0', 'release': 'bump',
+                 'changelog': ['Rebuild %d' % i]} for i in range(4)]
+        entries[1]['spec_file'] = os.path.join(self.tmp_dir, '.', 'b.spec')
+        results = ZanataRpm.bulk_update(entries, jobs=4)
+        self.assertEqual(
+                ['2%{?dist}', '3%{?dist}', '4%{?dist}', '5%{?dist}'],
+                [r.release for r in results])
+        self.assertIn("Release: 5%{?dist}\n", self._read('b'))
+        for i in range(4):
+            self.assertIn("- Rebuild %d\n" % i, self._read('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Test the ZanataRpmHeader"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import ZanataRpmHeader  # pylint: disable=E0401
+
+RPM_STRING_TYPE = ZanataRpmHeader.RPM_STRING_TYPE
+RPM_BIN_TYPE = ZanataRpmHeader.RPM_BIN_TYPE
+RPM_INT32_TYPE = ZanataRpmHeader.RPM_INT32_TYPE
+RPM_STRING_ARRAY_TYPE = ZanataRpmHeader.RPM_STRING_ARRAY_TYPE
+
+
+def _header(entries):
+    """Build header from (tag, type, value) list"""
+    index = b''
+    data = b''
+    for tag, data_type, value in entries:
+        if data_type == RPM_INT32_TYPE:
+            data += b'\0' * (-len(data) % 4)
+            payload, count = struct.pack('>i', value), 1
+        elif data_type == RPM_STRING_ARRAY_TYPE:
+            payload, count = b''.join(v + b'\0' for v in value), len(value)
+        elif data_type == RPM_BIN_TYPE:
+            payload, count = value, len(value)
+        else:
+            payload, count = value + b'\0', 1
+        index += struct.pack('>iiii', tag, data_type, len(data), count)
+        data += payload
+    return struct.pack(
+            '>4s4xII', ZanataRpmHeader.HEADER_MAGIC,
+            len(entries), len(data)) + index + data
+
+
+def write_rpm(path, name, version, release, arch='noarch', source=False):
+    """Write a minimal RPM file"""
+    signature = _header([
+            (ZanataRpmHeader.RPMSIGTAG_SHA1, RPM_STRING_TYPE, b'ab' * 20),
+            (ZanataRpmHeader.RPMSIGTAG_MD5, RPM_BIN_TYPE, b'\x01' * 16)])
+    entries = [
+            (ZanataRpmHeader.RPMTAG_NAME, RPM_STRING_TYPE, name),
+            (ZanataRpmHeader.RPMTAG_VERSION, RPM_STRING_TYPE, version),
+            (ZanataRpmHeader.RPMTAG_RELEASE, RPM_STRING_TYPE, release),
+            (ZanataRpmHeader.RPMTAG_ARCH, RPM_STRING_TYPE, arch),
+            (ZanataRpmHeader.RPMTAG_PAYLOADDIGEST, RPM_STRING_ARRAY_TYPE,
+             [b'cd' * 32]),
+            (ZanataRpmHeader.RPMTAG_PAYLOADDIGESTALGO, RPM_INT32_TYPE, 8)]
+    if not source:
+        entries.append((
+                ZanataRpmHeader.RPMTAG_SOURCERPM, RPM_STRING_TYPE,
+                "%s-%s-%s.src.rpm" % (name, version, release)))
+    with open(path, 'wb') as out_file:
+        out_file.write(ZanataRpmHeader.LEAD_MAGIC + b'\0' * 92)
+        out_file.write(signature + b'\0' * (-len(signature) % 8))
+        out_file.write(_header(entries))
+        out_file.write(b'payload')
+
+
+class RpmHeaderTestCase(unittest.TestCase):
+    """Test reading RPM headers"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_package(self):
+        """Test NEVRA, sourcerpm and digests are read"""
+        rpm_file = os.path.join(self.tmp_dir, 'a.rpm')
+        write_rpm(rpm_file, 'zanata-cli-bin', '4.6.0', '1.el7')
+        pkg = ZanataRpmHeader.read_package(rpm_file)
+        self.assertEqual('zanata-cli-bin-4.6.0-1.el7.noarch', pkg.nevra)
+        self.assertEqual(
+                'zanata-cli-bin-4.6.0-1.el7.src.rpm', pkg.sourcerpm)
+        self.assertEqual('sha256', pkg.payload_digest_algo)
+        self.assertEqual('cd' * 32, pkg.payload_digest)
+        self.assertEqual(
+                {'sha1': 'ab' * 20, 'md5': '01' * 16}, pkg.header_digests)
+
+        src_file = os.path.join(self.tmp_dir, 'a.src.rpm')
+        write_rpm(src_file, 'zanata-cli-bin', '4.6.0', '1.el7', source=True)
+        self.assertEqual('src', ZanataRpmHeader.read_package(src_file).arch)
+
+        bad_file = os.path.join(self.tmp_dir, 'bad.rpm')
+        with open(bad_file, 'wb') as out_file:
+            out_file.write(b'\0' * 200)
+        self.assertRaises(
+                ZanataRpmHeader.RpmHeaderError,
+                ZanataRpmHeader.read_package, bad_file)
+
+    def test_scan_dir(self):
+        """Test scanning a directory tree into an index"""
+        for ver in ['4.5.0', '4.6.0']:
+            sub_dir = os.path.join(self.tmp_dir, 'epel-7', 'x86_64')
+            if not os.path.isdir(sub_dir):
+                os.makedirs(sub_dir)
+            write_rpm(
+                    os.path.join(sub_dir, "zanata-cli-bin-%s.rpm" % ver),
+                    'zanata-cli-bin', ver, '1.el7')
+        with open(os.path.join(self.tmp_dir, 'broken.rpm'), 'wb') as f:
+            f.write(b'not an rpm')
+        # INT32 entry with count beyond the data
+        corrupt = _header([(ZanataRpmHeader.RPMTAG_NAME, RPM_INT32_TYPE, 1)])
+        corrupt = corrupt[:28] + struct.pack('>I', 1000) + corrupt[32:]
+        with open(os.path.join(self.tmp_dir, 'corrupt.rpm'), 'wb') as f:
+            f.write(ZanataRpmHeader.LEAD_MAGIC + b'\0' * 92 + corrupt)
+
+        index = ZanataRpmHeader.scan_dir(self.tmp_dir, jobs=2)
+        self.assertEqual(2, len(index))
+        self.assertEqual(['4.5.0', '4.6.0'], index.versions('zanata-cli-bin'))
+        self.assertTrue(index.has_version('zanata-cli-bin', '4.6.0'))
+        self.assertFalse(index.has_version('zanata-cli-bin', '4.7.0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+"""Test the ZanataRpmRepo"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import ZanataDocker  # pylint: disable=E0401
+import ZanataRepodata  # pylint: disable=E0401
+import ZanataRpmRepo  # pylint: disable=E0401
+from ZanataFunctions import CLIException  # pylint: disable=E0401
+from .testZanataRpmHeader import write_rpm
+
+
+class UpdateEpelReposTestCase(unittest.TestCase):
+    """Test concurrent update_epel_repos"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.host = ZanataRpmRepo.RpmRepoHost(local_dir=self.tmp_dir)
+        self.orig_build = ZanataRpmRepo.ElRepo.build_and_update
+        self.orig_cancel = ZanataRpmRepo.ElRepo.cancel
+        self.built = []
+        self.running = set()
+        self.max_running = 0
+        self.lock = threading.Lock()
+        test = self
+
+        def _build(elrepo, spec_file, version=None, tarball_dir=None, **_):
+            with test.lock:
+                test.running.add(elrepo.dist_ver)
+                test.max_running = max(test.max_running, len(test.running))
+            time.sleep(0.1)
+            with test.lock:
+                test.running.discard(elrepo.dist_ver)
+            if elrepo.dist_ver == '6':
+                raise RuntimeError("build failed")
+            test.built.append((elrepo.dist_ver, spec_file, version))
+
+        ZanataRpmRepo.ElRepo.build_and_update = _build
+        ZanataRpmRepo.ElRepo.cancel = lambda elrepo: None
+        # No docker daemon here
+        self.orig_prefetch = ZanataRpmRepo.ImagePool.prefetch
+        self.orig_gc = ZanataRpmRepo.ImagePool.gc
+        self.orig_pin = ZanataRpmRepo.ImagePool.pin
+        self.orig_image_inspect = ZanataDocker.DockerClient.image_inspect
+        # Image name: ID of the local image
+        self.image_ids = {}
+        ZanataRpmRepo.ImagePool.prefetch = lambda pool, names: None
+        ZanataRpmRepo.ImagePool.gc = lambda pool, repository: []
+        ZanataRpmRepo.ImagePool.pin = lambda pool, name: test.image_ids.get(
+                name, 'sha256:' + name)
+        ZanataDocker.DockerClient.image_inspect = lambda client, name: {
+                'Id': test.image_ids.get(name, 'sha256:' + name)}
+        with open(os.path.join(self.tmp_dir, 'zanata.spec'), 'w') as f:
+            f.write(
+                    "Name: zanata-cli-bin\nVersion: 4.6.0\n"
+                    "Source0: https://example.com/zanata-%{version}.tgz\n")
+        os.environ['ZANATA_TIMINGS_FILE'] = os.path.join(
+                self.tmp_dir, 'timings.jsonl')
+        self.orig_work_root = ZanataRpmRepo.WORK_ROOT
+        ZanataRpmRepo.WORK_ROOT = self.tmp_dir
+        # Already cached, so nothing is downloaded
+        self.orig_tarball_cache_dir = ZanataRpmRepo.TARBALL_CACHE_DIR
+        ZanataRpmRepo.TARBALL_CACHE_DIR = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(ZanataRpmRepo.TARBALL_CACHE_DIR)
+        with open(os.path.join(
+                ZanataRpmRepo.TARBALL_CACHE_DIR, 'zanata-4.7.0.tgz'),
+                  'w') as f:
+            f.write('tgz')
+
+    def tearDown(self):
+        ZanataRpmRepo.ElRepo.build_and_update = self.orig_build
+        ZanataRpmRepo.ElRepo.cancel = self.orig_cancel
+        ZanataRpmRepo.ImagePool.prefetch = self.orig_prefetch
+        ZanataRpmRepo.ImagePool.gc = self.orig_gc
+        ZanataRpmRepo.ImagePool.pin = self.orig_pin
+        ZanataDocker.DockerClient.image_inspect = self.orig_image_inspect
+        ZanataRpmRepo.TARBALL_CACHE_DIR = self.orig_tarball_cache_dir
+        ZanataRpmRepo.WORK_ROOT = self.orig_work_root
+        del os.environ['ZANATA_TIMINGS_FILE']
+        shutil.rmtree(self.tmp_dir)
+
+    def test_concurrent(self):
+        """Test builds run concurrently and failures are collected"""
+        self.host.update_epel_repos(
+                'zanata.spec', '4.7.0', dist_versions='8,7', jobs=2)
+        self.assertEqual(2, self.max_running)
+        self.assertEqual(
+                [('7', 'zanata.spec', '4.7.0'), ('8', 'zanata.spec', '4.7.0')],
+                sorted(self.built))
+
+        self.built = []
+        self.assertRaises(
+                CLIException, self.host.update_epel_repos,
+                'zanata.spec', '4.7.0', None, ['6', '7', '8'], 2, True)
+        self.assertEqual(['7', '8'], sorted(b[0] for b in self.built))
+
+    def test_sequential_fail_fast(self):
+        """Test sequential builds stop at the first failure"""
+        self.assertRaises(
+                RuntimeError, self.host.update_epel_repos,
+                'zanata.spec', '4.7.0', None, ['6', '7'])
+        self.assertEqual([], self.built)
+
+    def test_pipelined_all(self):
+        """Test each dist is pushed as soon as its build finishes"""
+        events = []
+
+        def _rsync(src, dest, options=None):
+            events.append(('rsync', src, dest))
+
+        def _build(elrepo, spec_file, version=None, tarball_dir=None, **_):
+            time.sleep(0.3 if elrepo.dist_ver == '6' else 0.05)
+            events.append(('built', elrepo.dist_ver))
+
+        self.host.rsync = _rsync
+        failing_build = ZanataRpmRepo.ElRepo.build_and_update
+        ZanataRpmRepo.ElRepo.build_and_update = _build
+        self.host.all('zanata.spec', '4.7.0', '7,6', jobs=2)
+
+        remote = self.host.remote_host_dir
+        local = self.tmp_dir
+        self.assertEqual(('rsync', remote + '/', local), events[0])
+        push_7 = ('rsync', local + '/epel-7/', remote + '/epel-7')
+        self.assertLess(events.index(push_7), events.index(('built', '6')))
+        self.assertEqual(('rsync', local + '/', remote), events[-1])
+
+        events[:] = []
+        ZanataRpmRepo.ElRepo.build_and_update = failing_build
+        self.assertRaises(
+                CLIException, self.host.all, 'zanata.spec', '4.7.0', '7,6',
+                2)
+        self.assertNotIn(
+                ('rsync', local + '/epel-6/', remote + '/epel-6'), events)
+        self.assertNotIn(('rsync', local + '/', remote), events)
+
+    def test_resume(self):
+        """Test resumed run skips tasks completed with unchanged outputs"""
+        events = []
+        fail = set(['6'])
+        self.host.rsync = lambda src, dest, options=None: events.append(
+                ('rsync', src, dest))
+
+        def _build(elrepo, spec_file, version=None, tarball_dir=None, **_):
+            if elrepo.dist_ver in fail:
+                raise RuntimeError("build failed")
+            rpm_dir = os.path.join(elrepo.dist_dir, 'noarch')
+            if not os.path.isdir(rpm_dir):
+                os.makedirs(rpm_dir)
+            with open(os.path.join(rpm_dir, 'a.rpm'), 'w') as f:
+                f.write('rpm')
+            events.append(('built', elrepo.dist_ver))
+
+        ZanataRpmRepo.ElRepo.build_and_update = _build
+        self.assertRaises(
+                CLIException, self.host.all, 'zanata.spec', '4.7.0',
+                '7,6', 2, True)
+        self.assertIn(('built', '7'), events)
+
+        events[:] = []
+        fail.clear()
+        self.host.all('zanata.spec', '4.7.0', '7,6', 2, resume=True)
+        self.assertEqual([('built', '6')], [
+                e for e in events if e[0] == 'built'])
+        self.assertNotIn(
+                ('rsync', self.host.remote_host_dir + '/', self.tmp_dir),
+                events)
+
+        # Changed output is rebuilt
+        events[:] = []
+        with open(os.path.join(
+                self.tmp_dir, 'epel-7', 'noarch', 'a.rpm'), 'w') as f:
+            f.write('changed')
+        self.host.all('zanata.spec', '4.7.0', '7,6', 2, resume=True)
+        self.assertEqual([('built', '7')], [
+                e for e in events if e[0] == 'built'])
+
+        # Changed builder image is rebuilt
+        events[:] = []
+        self.image_ids[ZanataRpmRepo.BUILDER_IMAGE + ':6'] = 'sha256:new'
+        self.host.all('zanata.spec', '4.7.0', '7,6', 2, resume=True)
+        self.assertEqual([('built', '6')], [
+                e for e in events if e[0] == 'built'])
+
+        # Changed tarball rebuilds all
+        events[:] = []
+        with open(os.path.join(
+                ZanataRpmRepo.TARBALL_CACHE_DIR, 'zanata-4.7.0.tgz'),
+                  'w') as f:
+            f.write('changed')
+        self.host.all('zanata.spec', '4.7.0', '7,6', 2, resume=True)
+        self.assertEqual([('built', '6'), ('built', '7')], sorted(
+                e for e in events if e[0] == 'built'))
+
+    def test_copy_back_built_spec(self):
+        """Test spec is copied back only from a build that ran"""
+        self.host.rsync = lambda src, dest, options=None: None
+        stale_dir = os.path.join(self.tmp_dir, '.el7-build')
+        os.mkdir(stale_dir)
+
+        def _build(elrepo, spec_file, version=None, tarball_dir=None, **_):
+            if elrepo.dist_ver == '7':
+                return False
+            work_dir = os.path.join(self.tmp_dir, elrepo.work_dir)
+            if not os.path.isdir(work_dir):
+                os.mkdir(work_dir)
+            with open(os.path.join(work_dir, spec_file), 'w') as f:
+                f.write('el8')
+            return True
+
+        ZanataRpmRepo.ElRepo.build_and_update = _build
+        spec_path = os.path.join(self.tmp_dir, 'zanata.spec')
+        with open(spec_path, 'r') as f:
+            spec_content = f.read()
+        for update in (self.host.update_epel_repos, self.host.all):
+            with open(os.path.join(stale_dir, 'zanata.spec'), 'w') as f:
+                f.write('stale')
+            update('zanata.spec', '4.7.0', dist_versions='7,8', jobs=2)
+            with open(spec_path, 'r+') as f:
+                self.assertEqual('el8', f.read())
+                f.seek(0)
+                f.truncate()
+                f.write(spec_content)
+
+        # Skipped build removes its stale private spec
+        elrepo = ZanataRpmRepo.ElRepo('7', self.tmp_dir, concurrent=True)
+        elrepo.is_published = lambda spec_file, version: True
+        self.assertFalse(self.orig_build(elrepo, 'zanata.spec', '4.7.0'))
+        self.assertEqual([], os.listdir(stale_dir))
+
+    def test_plan(self):
+        """Test plan resolves inputs once and orders tasks"""
+        tarball_dir = os.path.join(self.tmp_dir, 'tarballs')
+        os.mkdir(tarball_dir)
+        with open(os.path.join(tarball_dir, 'zanata-4.7.0.tgz'), 'w') as f:
+            f.write('tgz')
+        plan = self.host.plan_release(
+                'zanata.spec', '4.7.0', '7,6', tarball_dir)
+        self.assertEqual(('7', '6'), plan.dist_versions)
+        self.assertEqual(
+                [('zanata-4.7.0.tgz',
+                  'https://example.com/zanata-4.7.0.tgz',
+                  ZanataRpmRepo.sha256_file(
+                          os.path.join(tarball_dir, 'zanata-4.7.0.tgz')))],
+                list(plan.tarballs))
+        self.assertEqual(
+                ('pull-el7', 'image-el7', 'fetch-tarballs'),
+                plan.tasks()['build-el7'])
+        self.assertIn('push-base <- push-el7, push-el6', str(plan))
+
+        with ZanataRpmRepo.timed('build', 'el7'):
+            pass
+        self.assertIn(
+                "build-el7        0s",
+                ZanataRpmRepo.RpmRepoHost.format_prediction(plan))
+
+    def test_prefetch_sources(self):
+        """Test sources are downloaded once to the shared directory"""
+        src_file = os.path.join(self.tmp_dir, 'zanata-4.8.0.tgz')
+        with open(src_file, 'w') as f:
+            f.write('tgz')
+        cache_dir = os.path.join(self.tmp_dir, 'shared')
+        sources = [
+                ('zanata-4.8.0.tgz', 'file://' + src_file),
+                ('zanata.conf', 'zanata.conf')]
+        self.assertEqual(
+                ['zanata-4.8.0.tgz'],
+                ZanataRpmRepo.prefetch_sources(sources, cache_dir))
+        self.assertEqual(['zanata-4.8.0.tgz'], os.listdir(cache_dir))
+        self.assertEqual(
+                [], ZanataRpmRepo.prefetch_sources(sources, cache_dir))
+
+    def test_run_tasks(self):
+        """Test dependents of a failed task are not run"""
+        ran = []
+
+        def _task(name, fail=False):
+            def _run():
+                if fail:
+                    raise RuntimeError(name)
+                ran.append(name)
+            return _run
+
+        tasks = ZanataRpmRepo.OrderedDict([
+                ('a', ((), _task('a', True))),
+                ('b', ((), _task('b'))),
+                ('c', (('a',), _task('c'))),
+                ('d', (('b',), _task('d')))])
+        errors = ZanataRpmRepo.run_tasks(tasks, 1, keep_going=True)
+        self.assertEqual(['a'], list(errors))
+        self.assertEqual(['b', 'd'], ran)
+
+
+class _FakeBuilderDocker(object):
+    """Docker client that runs a fake centos-repo-builder
+
+    The spec version is updated, an RPM is written under -D,
+    with repodata like createrepo."""
+
+    def __init__(self):
+        self.runs = []
+
+    def ensure_volume(self, name):
+        """Volumes are not needed"""
+        pass
+
+    def run(self, image, cmd, name=None, binds=None, log_line=None):
+        """Run the build, return exit status"""
+        self.runs.append(cmd)
+        mounts = {}
+        for bind in binds:
+            host, container = bind.split(':')[:2]
+            mounts[container] = host
+
+        def _host(path):
+            container = '/' + path.split('/')[1]
+            return mounts[container] + path[len(container):]
+
+        spec_file = os.path.join(_host(cmd[cmd.index('-S') + 1]), cmd[-1])
+        version = cmd[cmd.index('-u') + 1]
+        with open(spec_file, 'r') as in_file:
+            content = in_file.read()
+        with open(spec_file, 'w') as out_file:
+            out_file.write(re.sub(
+                    r'(?m)^Version:.*$', 'Version: ' + version, content))
+        dist = "epel-%s" % name.split('-')[2]
+        rpm_dir = os.path.join(_host(cmd[cmd.index('-D') + 1]), dist)
+        os.makedirs(os.path.join(rpm_dir, 'repodata'))
+        with open(os.path.join(rpm_dir, 'repodata', 'repomd.xml'), 'w') as f:
+            f.write('<repomd/>')
+        os.mkdir(os.path.join(rpm_dir, 'noarch'))
+        write_rpm(
+                os.path.join(
+                        rpm_dir, 'noarch', "zanata-cli-bin-%s.rpm" % version),
+                'zanata-cli-bin', version, "1.el%s" % dist[5:])
+        return 0
+
+
+class _FakeImages(object):
+    """ImagePool with the builder image already pulled"""
+
+    @staticmethod
+    def pin(name):
+        """Image ID"""
+        return 'sha256:' + name
+
+    @staticmethod
+    def digest(name):
+        """Repository digest"""
+        return 'sha256:' + name
+
+
+class ElRepoBuildTestCase(unittest.TestCase):
+    """Test ElRepo.build_and_update with a fake builder"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_env = dict(os.environ)
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.tmp_dir, 'cache')
+        os.environ['ZANATA_TIMINGS_FILE'] = ''
+        with open(os.path.join(self.tmp_dir, 'zanata.spec'), 'w') as f:
+            f.write(
+                    "Name: zanata-cli-bin\nVersion: 4.6.0\n"
+                    "Release: 1%{?dist}\n")
+        self.docker = _FakeBuilderDocker()
+        self.elrepo = ZanataRpmRepo.ElRepo(
+                '7', self.tmp_dir, docker=self.docker, images=_FakeImages())
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.orig_env)
+        shutil.rmtree(self.tmp_dir)
+
+    def _published(self):
+        return sorted(
+                n.version for n in ZanataRepodata.published_nevras(
+                        self.elrepo.dist_dir))
+
+    def test_build_and_update(self):
+        """Test built RPMs are moved to dist_dir and indexed"""
+        self.assertTrue(self.elrepo.build_and_update('zanata.spec', '4.7.0'))
+        cmd = self.docker.runs[0]
+        self.assertEqual(
+                '/output_dir/.el7-build/output/', cmd[cmd.index('-D') + 1])
+        self.assertEqual(['4.7.0'], self._published())
+        self.assertEqual(
+                ['noarch', 'repodata'], sorted(os.listdir(
+                        self.elrepo.dist_dir)))
+        self.assertFalse(os.path.exists(os.path.join(
+                self.tmp_dir, self.elrepo.work_dir, 'output')))
+
+        self.assertTrue(self.elrepo.build_and_update('zanata.spec', '4.8.0'))
+        self.assertEqual(['4.7.0', '4.8.0'], self._published())
+        self.assertFalse(self.elrepo.build_and_update('zanata.spec', '4.8.0'))
+        self.assertEqual(2, len(self.docker.runs))
+
+    def test_build_cache(self):
+        """Test a re-run with the spec updated by the build is skipped"""
+        self.elrepo.is_published = lambda spec_file, version: False
+        self.assertTrue(self.elrepo.build_and_update('zanata.spec', '4.7.0'))
+        self.assertFalse(self.elrepo.build_and_update('zanata.spec', '4.7.0'))
+        self.assertEqual(1, len(self.docker.runs))
+
+        # Pulled repodata without the outputs is updated
+        shutil.rmtree(os.path.join(self.elrepo.dist_dir, 'repodata'))
+        self.assertFalse(self.elrepo.build_and_update('zanata.spec', '4.7.0'))
+        self.assertEqual(['4.7.0'], self._published())
+
+        # Outputs are kept from pull --delete
+        host = ZanataRpmRepo.RpmRepoHost(local_dir=self.tmp_dir)
+        rsync_options = []
+        host.rsync = lambda src, dest, options=None: rsync_options.append(
+                options)
+        host.pull_dist('7')
+        self.assertEqual(
+                ['--delete', '--filter',
+                 'protect /noarch/zanata-cli-bin-4.7.0.rpm'],
+                rsync_options[0])
+
+
+class BuildCacheTestCase(unittest.TestCase):
+    """Test BuildCache and build input keys"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'cache', 'build.json')
+        self.rpm_file = os.path.join(self.tmp_dir, 'a.rpm')
+        with open(self.rpm_file, 'w') as out_file:
+            out_file.write('rpm')
+        st = os.stat(self.rpm_file)
+        self.outputs = [[self.rpm_file, st.st_size, int(st.st_mtime)]]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookup(self):
+        """Test hit, missing outputs and eviction"""
+        cache = ZanataRpmRepo.BuildCache(self.cache_file, max_entries=2)
+        self.assertIsNone(cache.lookup('k1'))
+        cache.store('k1', self.outputs)
+        self.assertEqual(self.outputs, cache.lookup('k1'))
+
+        cache.store('k2', self.outputs)
+        cache.store('k3', self.outputs)
+        self.assertIsNone(cache.lookup('k1'))
+        self.assertEqual(self.outputs, cache.lookup('k3'))
+
+        expired = ZanataRpmRepo.BuildCache(
+                self.cache_file, max_age_days=1e-9)
+        self.assertIsNone(expired.lookup('k3'))
+
+        cache.store('k4', self.outputs)
+        os.remove(self.rpm_file)
+        self.assertIsNone(cache.lookup('k4'))
+
+    def test_build_inputs_key(self):
+        """Test key depends on version and tarball content"""
+        elrepo = ZanataRpmRepo.ElRepo('7', self.tmp_dir)
+        elrepo._image_digest = lambda: 'sha256:image'  # pylint: disable=W0212
+        spec = (
+                "Name: zanata-cli-bin\nVersion: 4.6.0\n"
+                "Source0: https://example.com/zanata-cli-%{version}.tar.gz\n")
+        tarball = os.path.join(self.tmp_dir, 'zanata-cli-4.7.0.tar.gz')
+        key_missing = elrepo.build_inputs_key(spec, '4.7.0', self.tmp_dir)
+        with open(tarball, 'w') as out_file:
+            out_file.write('v1')
+        key_v1 = elrepo.build_inputs_key(spec, '4.7.0', self.tmp_dir)
+        self.assertNotEqual(key_missing, key_v1)
+        self.assertEqual(
+                key_v1, elrepo.build_inputs_key(spec, '4.7.0', self.tmp_dir))
+        self.assertNotEqual(
+                key_v1, elrepo.build_inputs_key(spec, '4.8.0', self.tmp_dir))
+        with open(tarball, 'w') as out_file:
+            out_file.write('v2')
+        self.assertNotEqual(
+                key_v1, elrepo.build_inputs_key(spec, '4.7.0', self.tmp_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
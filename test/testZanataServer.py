@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Test the ZanataServer"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import StringIO  # pylint: disable=E0401
+import os
+import shutil
+import socket
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+import unittest
+import ZanataServer  # pylint: disable=E0401
+
+SPEC = """Name: zanata-cli-bin
+Version: 4.6.0
+Release: 1%{?dist}
+
+%changelog
+"""
+
+
+class SubCommandServerTestCase(unittest.TestCase):
+    """Test server and client through a Unix socket"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'server.sock')
+        self.server = subprocess.Popen([  # nosec
+                sys.executable, ZanataServer.__file__.replace('.pyc', '.py'),
+                'serve', '--socket', self.socket_path, 'ZanataRpm'])
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.1)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.wait()
+        shutil.rmtree(self.tmp_dir)
+
+    def _call(self, module, argv):
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+        try:
+            status = ZanataServer.call(module, argv, self.socket_path)
+            return status, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_call(self):
+        """Test call returns output and exit status"""
+        spec_file = os.path.join(self.tmp_dir, 'zanata.spec')
+        with open(spec_file, 'w') as out_file:
+            out_file.write(SPEC)
+
+        status, _, _ = self._call(
+                'ZanataRpm', ['update-version', spec_file, '4.7.0'])
+        self.assertEqual(0, status)
+        with open(spec_file, 'r') as in_file:
+            self.assertIn('Version: 4.7.0', in_file.read())
+
+        status, _, stderr = self._call('ZanataRpm', ['no-such-command'])
+        self.assertEqual(2, status)
+        self.assertIn('invalid choice', stderr)
+
+        status, _, stderr = self._call('ZanataRpmRepo', ['pull'])
+        self.assertEqual(2, status)
+        self.assertIn('not served', stderr)
+
+    def test_bad_request(self):
+        """Test a malformed request does not stop the server"""
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(self.socket_path)
+        try:
+            conn.sendall('{"argv": []}\n')
+            while conn.recv(4096):
+                pass
+        finally:
+            conn.close()
+
+        os.environ['WORK_ROOT'] = self.tmp_dir
+        try:
+            status, _, stderr = self._call('ZanataRpm', ['--help'])
+        finally:
+            del os.environ['WORK_ROOT']
+        self.assertEqual(2, status)
+        self.assertIn('WORK_ROOT differ', stderr)
+        self.assertEqual(0, self._call('ZanataRpm', ['--help'])[0])
+
+    def test_unsafe_socket_dir(self):
+        """Test client and server refuse a socket directory others can use"""
+        os.chmod(self.tmp_dir, 0o755)
+        try:
+            with self.assertRaises(ZanataServer.UnsafeSocketError):
+                ZanataServer.call('ZanataRpm', ['--help'], self.socket_path)
+            server = ZanataServer.SubCommandServer(
+                    os.path.join(self.tmp_dir, 'other.sock'), [])
+            with self.assertRaises(ZanataServer.UnsafeSocketError):
+                server.serve_forever()
+        finally:
+            os.chmod(self.tmp_dir, 0o700)
+
+
+if __name__ == '__main__':
+    unittest.main()
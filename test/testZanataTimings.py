@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Test the ZanataTimings"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+import ZanataTimings  # pylint: disable=E0401
+
+TimingRecord = ZanataTimings.TimingRecord
+
+
+class TimingsTestCase(unittest.TestCase):
+    """Test timing store, statistics and predictions"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = ZanataTimings.TimingStore(
+                os.path.join(self.tmp_dir, 'sub', 'timings.jsonl'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_timed(self):
+        """Test records are appended, including failed stages"""
+        with ZanataTimings.timed('pull', store=self.store):
+            pass
+        with self.assertRaises(RuntimeError):
+            with ZanataTimings.timed('build', 'el7', self.store):
+                raise RuntimeError("build failed")
+        with open(self.store.timings_file, 'a') as out_file:
+            out_file.write('{"broken\n')
+
+        records = self.store.read()
+        self.assertEqual(
+                [('pull', None, True), ('build', 'el7', False)],
+                [(r.stage, r.target, r.ok) for r in records])
+        self.assertEqual(ZanataTimings.RUN_ID, records[0].run)
+        self.assertEqual([], self.store.read(tool='other'))
+
+        os.environ['ZANATA_TIMINGS_FILE'] = ''
+        try:
+            self.assertIsNone(ZanataTimings.TimingStore().timings_file)
+        finally:
+            del os.environ['ZANATA_TIMINGS_FILE']
+
+    def test_stats(self):
+        """Test percentiles, trend and critical path"""
+        durations = [10, 10, 10, 10, 10, 20, 20, 20, 20, 20]
+        records = [
+                TimingRecord('r%d' % i, 't', 'build', 'el7', i * 100, d, True)
+                for i, d in enumerate(durations)]
+        stats = ZanataTimings.stage_stats(records)[('build', 'el7')]
+        self.assertEqual(10, stats['count'])
+        self.assertEqual(20, stats['p90'])
+        self.assertEqual(2.0, stats['trend'])
+
+        run = [
+                TimingRecord('r', 't', 'pull', 'el7', 0, 10, True),
+                TimingRecord('r', 't', 'rsync', 'host', 1, 9, True),
+                TimingRecord('r', 't', 'pull', 'el6', 0, 2, True),
+                TimingRecord('r', 't', 'build', 'el7', 10, 50, True),
+                TimingRecord('r', 't', 'build', 'el6', 2, 30, True),
+                TimingRecord('r', 't', 'push', 'el7', 60, 5, True)]
+        self.assertEqual(
+                [('pull', 'el7'), ('build', 'el7'), ('push', 'el7')],
+                [(r.stage, r.target)
+                 for r in ZanataTimings.critical_path(run)])
+        self.assertIn('Run r (t): 1m05s', ZanataTimings.report(run))
+
+    def test_predict(self):
+        """Test prediction follows the longest dependency chain"""
+        records = [
+                TimingRecord('r', 't', 'pull', 'el7', 0, 10, True),
+                TimingRecord('r', 't', 'build', 'el7', 0, 60, True),
+                TimingRecord('r', 't', 'push', 'el7', 0, 5, True),
+                TimingRecord('r', 't', 'push', 'el7', 0, 500, False)]
+        tasks = ZanataTimings.OrderedDict([
+                ('pull-el7', ()), ('pull-el6', ()),
+                ('build-el7', ('pull-el7',)), ('build-el6', ('pull-el6',)),
+                ('push-base', ('build-el7', 'build-el6'))])
+        total, estimates = ZanataTimings.predict(
+                tasks, lambda name: tuple(name.split('-', 1)), records)
+        self.assertEqual(75, total)
+        self.assertEqual(60, estimates['build-el6'])
+        self.assertEqual(5, estimates['push-base'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Test the ZanataTrace"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import json
+import os
+import shutil
+import subprocess  # nosec
+import sys
+import tempfile
+import unittest
+
+from multiprocessing.pool import ThreadPool
+import ZanataTrace  # pylint: disable=E0401
+
+Span = ZanataTrace.Span
+
+
+class TraceTestCase(unittest.TestCase):
+    """Test spans across threads and processes, and the trace file"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.trace_file = os.path.join(self.tmp_dir, 'trace.json')
+        self.tracer = ZanataTrace.Tracer(self.trace_file)
+        ZanataTrace._tracer = self.tracer  # pylint: disable=protected-access
+
+    def tearDown(self):
+        ZanataTrace._tracer = None  # pylint: disable=protected-access
+        shutil.rmtree(self.tmp_dir)
+
+    def test_nesting(self):
+        """Test spans nest within a thread"""
+        with ZanataTrace.span('all') as all_id:
+            with ZanataTrace.span('pull') as pull_id:
+                pass
+            with self.assertRaises(RuntimeError):
+                with ZanataTrace.span('push'):
+                    raise RuntimeError("push failed")
+
+        spans = {s.name: s for s in self.tracer.spans}
+        self.assertIsNone(spans['all'].parent)
+        self.assertEqual(all_id, spans['pull'].parent)
+        self.assertEqual(pull_id, spans['pull'].id)
+        self.assertEqual(all_id, spans['push'].parent)
+        self.assertFalse(spans['push'].ok)
+        self.assertTrue(spans['all'].ok)
+
+    def test_bound_threads(self):
+        """Test spans in pool threads are children of the caller span"""
+        def _build(name):
+            with ZanataTrace.span(name):
+                pass
+
+        with ZanataTrace.span('all') as all_id:
+            pool = ThreadPool(2)
+            try:
+                pool.map(ZanataTrace.bind(_build), ['el6', 'el7'])
+            finally:
+                pool.close()
+                pool.join()
+        with ZanataTrace.span('after'):
+            pass
+
+        spans = {s.name: s for s in self.tracer.spans}
+        self.assertEqual(all_id, spans['el6'].parent)
+        self.assertEqual(all_id, spans['el7'].parent)
+        self.assertIsNone(spans['after'].parent)
+
+    def test_write(self):
+        """Test subprocess spans are merged into the Chrome trace"""
+        with ZanataTrace.span('all') as all_id:
+            env = ZanataTrace.trace_env()
+            env['PYTHONPATH'] = os.path.dirname(
+                    os.path.abspath(ZanataTrace.__file__))
+            subprocess.check_call([  # nosec
+                    sys.executable, '-c',
+                    'import ZanataTrace\n'
+                    'with ZanataTrace.span("child"):\n'
+                    '    pass\n'], env=env)
+        self.tracer.write()
+
+        self.assertEqual(['trace.json'], os.listdir(self.tmp_dir))
+        with open(self.trace_file, 'r') as in_file:
+            events = json.load(in_file)['traceEvents']
+        complete = {e['name']: e for e in events if e['ph'] == 'X'}
+        self.assertEqual(['all', 'child'], sorted(complete))
+        self.assertEqual(all_id, complete['child']['args']['parent'])
+        self.assertNotEqual(complete['all']['pid'], complete['child']['pid'])
+        self.assertEqual(
+                ['f', 's'], sorted(e['ph'] for e in events
+                                   if e.get('name') == 'spawn'))
+
+    def test_summary(self):
+        """Test the critical path is expanded into child spans"""
+        spans = [
+                Span('all', '1', None, 1, 1, 'Main', 0, 70, True),
+                Span('pull el7', '2', '1', 1, 2, 'T-1', 0, 10, True),
+                Span('pull el6', '3', '1', 1, 3, 'T-2', 0, 2, True),
+                Span('build el7', '4', '1', 1, 2, 'T-1', 10, 50, True),
+                Span('docker', '5', '4', 1, 2, 'T-1', 12, 48, False),
+                Span('build el6', '6', '1', 1, 3, 'T-2', 2, 30, True),
+                Span('push el7', '7', '1', 1, 2, 'T-1', 60, 5, True)]
+        self.assertEqual(
+                ['  70.000s all',
+                 '      10.000s pull el7',
+                 '      50.000s build el7',
+                 '          48.000s docker (failed)',
+                 '       5.000s push el7'],
+                ZanataTrace.Tracer.summary(spans).split('\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()